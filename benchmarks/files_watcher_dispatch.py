@@ -0,0 +1,48 @@
+"""
+Fire synthetic events through FilesWatcher.dispatch and report throughput.
+
+Usage: python benchmarks/files_watcher_dispatch.py [events_n]
+"""
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+from watchdog.events import FileModifiedEvent
+
+from envo.misc import Callback, FilesWatcher, GlobMatcher
+
+
+def run(events_n: int, cache_size: int) -> float:
+    root = Path(tempfile.gettempdir()) / "envo_bench"
+    watcher = FilesWatcher(
+        FilesWatcher.Sets(
+            root=root,
+            include=["**/*.py", "env_*.py"],
+            exclude=[r"**/.*", r"**/*~", r"**/__pycache__", "build/**", "node_modules/**"],
+        ),
+        calls=FilesWatcher.Callbacks(on_changes=Callback(None)),
+    )
+    watcher.matcher = GlobMatcher(watcher.include, watcher.exclude, cache_size=cache_size)
+
+    # busy build directory with a few real sources in between
+    paths = [str(root / f"build/lib/pkg{i % 50}/module{i % 40}.o") for i in range(2000)]
+    paths += [str(root / f"src/pkg{i % 10}/module{i}.py") for i in range(100)]
+    events = [FileModifiedEvent(paths[i % len(paths)]) for i in range(events_n)]
+
+    start = perf_counter()
+    for e in events:
+        watcher.dispatch(e)
+    return perf_counter() - start
+
+
+def main() -> None:
+    events_n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    for name, cache_size in [("uncached", 0), ("cached", 4096)]:
+        took = run(events_n, cache_size)
+        print(f"{name:>10}: {events_n} events in {took:.3f}s ({events_n / took:,.0f} events/s)")
+
+
+if __name__ == "__main__":
+    main()
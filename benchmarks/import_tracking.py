@@ -0,0 +1,98 @@
+"""
+Compare import heavy workloads with dependency tracking on and off.
+
+Imports are not hooked, tracking cost is paid when the graph is needed (first sync scans all modules
+under the root). A python level __import__ wrapper (how tracking used to work) is measured for reference.
+
+Usage: python benchmarks/import_tracking.py [modules_n]
+"""
+import builtins
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+from envo import dependency_watcher
+
+
+def create_package(root: Path, modules_n: int) -> None:
+    package = root / "bench_pkg"
+    package.mkdir(parents=True)
+    (package / "__init__.py").write_text("")
+    for i in range(modules_n):
+        imports = "\n".join(f"from bench_pkg import module{j}" for j in range(max(0, i - 3), i))
+        (package / f"module{i}.py").write_text(
+            f"import os\nimport json\nimport collections\n{imports}\n\nvalue = {i}\n"
+        )
+
+
+def unload() -> None:
+    for n in [n for n in sys.modules if n.startswith("bench_pkg")]:
+        sys.modules.pop(n)
+
+
+def import_all(modules_n: int) -> float:
+    start = perf_counter()
+    for i in range(modules_n):
+        __import__(f"bench_pkg.module{i}")
+    return perf_counter() - start
+
+
+def repeated_imports(n: int) -> float:
+    def fun() -> None:
+        import os  # noqa: F401
+        import json  # noqa: F401
+
+    start = perf_counter()
+    for _ in range(n):
+        fun()
+    return perf_counter() - start
+
+
+def main() -> None:
+    modules_n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    root = Path(tempfile.mkdtemp(prefix="envo_bench"))
+    create_package(root, modules_n)
+    sys.path.insert(0, str(root))
+
+    try:
+        took = import_all(modules_n)
+        print(f"{'off':>10}: imported {modules_n} modules in {took * 1000:.1f} ms")
+        print(f"{'off':>10}: 200000 cached imports in {repeated_imports(100_000) * 1000:.1f} ms")
+        unload()
+
+        dependency_watcher.enable(root)
+        took = import_all(modules_n)
+        start = perf_counter()
+        graph = dependency_watcher.get_graph()
+        sync = perf_counter() - start
+        print(f"{'on':>10}: imported {modules_n} modules in {took * 1000:.1f} ms, first sync {sync * 1000:.1f} ms")
+        print(f"{'on':>10}: 200000 cached imports in {repeated_imports(100_000) * 1000:.1f} ms")
+        start = perf_counter()
+        dependency_watcher.get_graph()
+        print(f"{'on':>10}: sync without changes {(perf_counter() - start) * 1000:.2f} ms")
+        print(f"{'on':>10}: module0 has {len(graph.get_dependents('bench_pkg.module0'))} dependents")
+        dependency_watcher.disable(root)
+        unload()
+
+        base_import = builtins.__import__
+
+        def _import(*args, **kwargs):
+            return base_import(*args, **kwargs)
+
+        builtins.__import__ = _import
+        try:
+            took = import_all(modules_n)
+            print(f"{'wrapper':>10}: imported {modules_n} modules in {took * 1000:.1f} ms")
+            print(f"{'wrapper':>10}: 200000 cached imports in {repeated_imports(100_000) * 1000:.1f} ms")
+        finally:
+            builtins.__import__ = base_import
+    finally:
+        unload()
+        sys.path.remove(str(root))
+        shutil.rmtree(str(root))
+
+
+if __name__ == "__main__":
+    main()
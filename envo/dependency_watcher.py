@@ -1,29 +1,334 @@
-from envo import misc
-
-try:
-    import builtins
-except ImportError:
-    import __builtin__ as builtins
-
-from collections import defaultdict
-from typing import List, Optional, Any, Dict
+from envo import import_scanner, misc
+from envo.import_scanner import get_imports, scan_file
 
+import hashlib
+import json
+import os
+import subprocess
 import sys
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import RLock
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
 
-__all__ = ('enable', 'disable', 'get_dependencies')
+__all__ = (
+    'enable', 'disable', 'get_dependencies', 'get_graph', 'get_imports', 'invalidate', 'rescan', 'DependencyGraph',
+    'ImportCache'
+)
 
-_baseimport = builtins.__import__
 _blacklist = None
-_dependencies = defaultdict(list)
-_parent = None
 
-# PEP 328 changed the default level to 0 in Python 3.3.
-_default_level = -1 if sys.version_info < (3, 3) else 0
 
+class DependencyGraph:
+    """
+    Module import graph.
+
+    Keeps adjacency sets in both directions (module -> modules it imports and module -> its importers).
+    Transitive dependents are computed once and cached until the graph changes.
+    """
+
+    def __init__(self) -> None:
+        self._lock = RLock()
+        self._imports: Dict[str, Set[str]] = defaultdict(set)
+        self._importers: Dict[str, Set[str]] = defaultdict(set)
+        self._dependents_cache: Dict[str, List[str]] = {}
+
+    def add(self, module: str, importer: str) -> None:
+        """
+        Record that importer imports module.
+        """
+        if module == importer:
+            return
+
+        with self._lock:
+            if importer in self._importers[module]:
+                return
+
+            self._importers[module].add(importer)
+            self._imports[importer].add(module)
+            self._dependents_cache.clear()
+
+    def remove(self, module: str) -> None:
+        """
+        Drop module's own imports, e.g. before it's executed again.
+        """
+        with self._lock:
+            for m in self._imports.pop(module, set()):
+                self._importers[m].discard(module)
+            self._dependents_cache.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._imports.clear()
+            self._importers.clear()
+            self._dependents_cache.clear()
+
+    def get_imports(self, module: str) -> Set[str]:
+        with self._lock:
+            return set(self._imports.get(module, set()))
+
+    def get_importers(self, module: str) -> Set[str]:
+        with self._lock:
+            return set(self._importers.get(module, set()))
+
+    def get_dependents(self, module: str) -> List[str]:
+        """
+        Return modules importing module directly or transitively, in topological order.
+        """
+        with self._lock:
+            if module in self._dependents_cache:
+                return list(self._dependents_cache[module])
+
+            reachable: Dict[str, None] = OrderedDict()
+            queue = deque([module])
+            while queue:
+                for m in sorted(self._importers.get(queue.popleft(), ())):
+                    if m != module and m not in reachable:
+                        reachable[m] = None
+                        queue.append(m)
+
+            ret = self.topological_order(reachable.keys())
+            self._dependents_cache[module] = ret
+            return list(ret)
+
+    def topological_order(self, modules: Iterable[str]) -> List[str]:
+        """
+        Order modules so each comes after the modules it imports (edges outside of modules are ignored).
+
+        Modules in import cycles can't be ordered, they are appended in the given order.
+        """
+        modules = list(OrderedDict.fromkeys(modules))
+        selected = set(modules)
+
+        with self._lock:
+            pending = {m: len(self._imports.get(m, set()) & selected) for m in modules}
+            queue = deque(m for m in modules if not pending[m])
+            ret = []
+            while queue:
+                m = queue.popleft()
+                ret.append(m)
+                for i in sorted(self._importers.get(m, set()) & selected):
+                    pending[i] -= 1
+                    if not pending[i]:
+                        queue.append(i)
+
+        ret.extend(m for m in modules if pending[m])
+        return ret
+
+    def get_cycles(self) -> List[List[str]]:
+        """
+        Return import cycles (strongly connected components with more than one module).
+        """
+        with self._lock:
+            graph = {m: set(i) for m, i in self._imports.items()}
+
+        index: Dict[str, int] = {}
+        lowlink: Dict[str, int] = {}
+        stack: List[str] = []
+        on_stack: Set[str] = set()
+        ret = []
+
+        # iterative Tarjan, import graphs can be deeper than the recursion limit
+        for root in sorted(graph.keys()):
+            if root in index:
+                continue
+
+            work = [(root, iter(sorted(graph.get(root, ()))))]
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+
+            while work:
+                node, children = work[-1]
+                child = next(children, None)
+                if child is not None:
+                    if child not in index:
+                        index[child] = lowlink[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(sorted(graph.get(child, ())))))
+                    elif child in on_stack:
+                        lowlink[node] = min(lowlink[node], index[child])
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        m = stack.pop()
+                        on_stack.discard(m)
+                        component.append(m)
+                        if m == node:
+                            break
+                    if len(component) > 1:
+                        ret.append(sorted(component))
+
+        return ret
+
+    def set_imports(self, importer: str, modules: Iterable[str]) -> None:
+        """
+        Replace importer's imports.
+        """
+        with self._lock:
+            self.remove(importer)
+            for m in modules:
+                self.add(m, importer)
+
+
+def _scan_in_process(items: List[Tuple[str, str]]) -> List[Tuple[str, Optional[Tuple[int, int]], List[str]]]:
+    # isolated mode, directory of the scanner (envo) isn't put on sys.path
+    output = subprocess.run(
+        [sys.executable, "-I", import_scanner.__file__],
+        input=json.dumps(items).encode("utf-8"),
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    return [(p, tuple(s) if s else None, i) for p, s, i in json.loads(output)]  # type: ignore
+
+
+class ImportCache:
+    """
+    Module level imports of source files under root, persisted between sessions.
+
+    Entries are validated with mtime and size once per session so only changed files are parsed again,
+    after that they are trusted until invalidated (e.g. by a watcher event).
+    Many stale files (e.g. the first session) are parsed in parallel processes.
+    """
+
+    version = 1
+    # files per worker process, starting one takes tens of milliseconds
+    parallel_threshold = 1024
+
+    def __init__(self, root: Path, directory: Optional[Path] = None) -> None:
+        self.root = Path(os.path.realpath(str(root)))
+        self.directory = directory or Path.home() / ".envo/import_graph"
+        name = hashlib.blake2b(str(self.root).encode("utf-8"), digest_size=16).hexdigest()
+        self.file = self.directory / f"{name}.json"
+
+        # relative path -> (mtime_ns, size, module name, imports)
+        self._entries: Dict[str, Tuple[int, int, str, List[str]]] = {}
+        self._dirty = False
+        # real paths validated in this session
+        self._checked: Set[str] = set()
+        self.scanned_n = 0
+
+        self.load()
+
+    def load(self) -> None:
+        try:
+            data = json.loads(self.file.read_text("utf-8"))
+            if data["version"] != self.version:
+                return
+            self._entries = {p: tuple(e) for p, e in data["files"].items()}  # type: ignore
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            self._entries = {}
 
-def enable(blacklist=None) -> None:
-    """Enable global module dependency tracking.
+    def save(self) -> None:
+        if not self._dirty:
+            return
+
+        data = json.dumps({"version": self.version, "files": self._entries})
+        tmp_file = self.file.with_name(f"{self.file.name}.{os.getpid()}.tmp")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_file.write_text(data, "utf-8")
+            os.replace(str(tmp_file), str(self.file))
+            self._dirty = False
+        except OSError:
+            try:
+                tmp_file.unlink()
+            except OSError:
+                pass
+
+    def invalidate(self, path: Path) -> None:
+        self._checked.discard(str(path))
+
+    def _is_valid(self, path: Path, name: str) -> bool:
+        entry = self._entries.get(str(path.relative_to(self.root)))
+        if not entry or entry[2] != name:
+            return False
+
+        if str(path) in self._checked:
+            return True
+
+        try:
+            stat = path.stat()
+        except OSError:
+            return False
+
+        if (stat.st_mtime_ns, stat.st_size) != (entry[0], entry[1]):
+            return False
+
+        self._checked.add(str(path))
+        return True
+
+    def _scan(self, items: List[Tuple[str, str]]) -> List[Tuple[str, Optional[Tuple[int, int]], List[str]]]:
+        workers_n = min(os.cpu_count() or 1, len(items) // self.parallel_threshold)
+        if workers_n > 1:
+            chunks = [items[i::workers_n] for i in range(workers_n)]
+            try:
+                # separate interpreters, forking would copy locks held by other threads (watchers, reloaders)
+                with ThreadPoolExecutor(workers_n) as executor:
+                    return [r for c in executor.map(_scan_in_process, chunks) for r in c]
+            except Exception:
+                # e.g. processes can't be started, scanning serially is only slower
+                pass
+
+        return [scan_file(i) for i in items]
+
+    def get_imports(self, modules: Dict[Path, str]) -> Dict[str, Set[str]]:
+        """
+        Return imports of the given modules (real path -> module name), scanning only changed files.
+        """
+        names = {str(p): n for p, n in modules.items()}
+        stale = [(p, n) for p, n in names.items() if not self._is_valid(Path(p), n)]
+
+        for path, stat, imports in self._scan(stale):
+            rel_path = str(Path(path).relative_to(self.root))
+            if stat is None:
+                self._entries.pop(rel_path, None)
+            else:
+                self._entries[rel_path] = (stat[0], stat[1], names[path], imports)
+                self._checked.add(path)
+            self._dirty = True
+            self.scanned_n += 1
+
+        ret = {}
+        for p, n in names.items():
+            entry = self._entries.get(str(Path(p).relative_to(self.root)))
+            ret[n] = set(entry[3]) if entry else set()
+        return ret
+
+
+_graph = DependencyGraph()
+_lock = RLock()
+# realpaths of tracked roots -> number of users (source reloaders)
+_roots: Dict[str, int] = defaultdict(int)
+_caches: Dict[str, ImportCache] = {}
+# module name -> (module object, imports) applied to the graph
+_scanned: Dict[str, Tuple[Any, Set[str]]] = {}
+
+
+def get_graph() -> DependencyGraph:
+    """
+    Return import graph of modules under tracked roots, modules imported since the last call are scanned first.
+    """
+    with _lock:
+        _sync()
+    return _graph
+
+
+def enable(root: Path, blacklist: Optional[Iterable[str]] = None) -> None:
+    """Enable module dependency tracking for modules under root.
+
+    Nothing is hooked into the import system, imports of loaded modules are scanned statically
+    when the graph is needed.
 
     A blacklist can be specified to exclude specific modules (and their import
     hierachies) from the reloading process.  The blacklist can be any iterable
@@ -32,88 +337,90 @@ def enable(blacklist=None) -> None:
     will just not be reloaded.
     """
     global _blacklist
-    builtins.__import__ = _import
-    if blacklist is not None:
-        _blacklist = frozenset(blacklist)
-
-def disable():
-    """Disable global module dependency tracking."""
-    global _blacklist, _parent
-    builtins.__import__ = _baseimport
-    _blacklist = None
-    _dependencies.clear()
-    _parent = None
-
-
-def flatten(m, visited: Optional[List[str]] = None):
-    if not visited:
-        visited = []
-
-    ret = _dependencies.get(misc.get_module_from_full_name(m).__name__, [])
-    for v in visited:
-        while v in ret: ret.remove(v)
-
-    for mr in ret:
-        visited.append(mr)
-        flat = flatten(mr, visited.copy())
-        for fm in flat:
-            if fm in ret:
-                continue
-            ret.append(fm)
+    with _lock:
+        real_root = os.path.realpath(str(root))
+        _roots[real_root] += 1
+        if real_root not in _caches:
+            _caches[real_root] = ImportCache(Path(real_root))
+        if blacklist is not None:
+            _blacklist = frozenset(blacklist)
+
+
+def disable(root: Optional[Path] = None) -> None:
+    """Disable module dependency tracking for root (or all roots)."""
+    global _blacklist
+    with _lock:
+        if root is not None:
+            real_root = os.path.realpath(str(root))
+            _roots[real_root] -= 1
+            if _roots[real_root] > 0:
+                return
+            _roots.pop(real_root)
+            _caches.pop(real_root, None)
+
+        if root is None or not _roots:
+            _roots.clear()
+            _caches.clear()
+            _scanned.clear()
+            _blacklist = None
+            _graph.clear()
+
+
+def is_enabled() -> bool:
+    return bool(_roots)
+
+
+def rescan(module: Any) -> None:
+    """Scan module's imports again next time the graph is needed (e.g. after its source was reloaded)."""
+    with _lock:
+        _scanned.pop(module.__name__, None)
+        file = getattr(module, "__file__", None)
+        if isinstance(file, str):
+            invalidate(Path(file))
+
+
+def invalidate(path: Path) -> None:
+    """Check file again next time the graph is needed, cached imports are trusted until then."""
+    real_path = Path(os.path.realpath(str(path)))
+    with _lock:
+        for cache in _caches.values():
+            cache.invalidate(real_path)
 
-    return ret
 
 def get_dependencies(m) -> List[Any]:
-    """Get the dependency list for the given imported module."""
-    flat = flatten(m.__name__)
-
-    fixed_flat = []
-
-    for m in flat:
-        fixed = misc.get_module_from_full_name(m).__name__
-        if fixed:
-            fixed_flat.append(fixed)
-
-    return fixed_flat
-
-def _import(name, globals=None, locals=None, fromlist=None, level=_default_level):
-    """__import__() replacement function that tracks module dependencies."""
-    # Track our current parent module.  This is used to find our current place
-    # in the dependency graph.
-    global _parent
-    parent = _parent
-    if globals and "__package__" in globals and globals["__package__"]:
-        _parent = (globals["__package__"] + "." + name)
-    else:
-        _parent = name
-
-    add info about imported objects and stuff
-
-    # Perform the actual import work using the base import function.
-    base = _baseimport(name, globals, locals, fromlist, level)
-
-    if base is not None and parent is not None:
-        m = base
-
-        # We manually walk through the imported hierarchy because the import
-        # function only returns the top-level package reference for a nested
-        # import statement (e.g. 'package' for `import package.module`) when
-        # no fromlist has been specified.  It's possible that the package
-        # might not have all of its descendents as attributes, in which case
-        # we fall back to using the immediate ancestor of the module instead.
-        if fromlist is None:
-            for component in name.split('.')[1:]:
-                try:
-                    m = getattr(m, component)
-                except AttributeError:
-                    m = sys.modules[m.__name__ + '.' + component]
-
-        # If this is a nested import for a reloadable (source-based) module,
-        # we append ourself to our parent's dependency list.
-        if hasattr(m, '__file__'):
-            _dependencies[m.__name__].append(parent)
-
-    # Lastly, we always restore our global _parent pointer.
-    _parent = parent
-
-    return base
+    """Get names of modules depending on the given imported module, in topological order."""
+    ret = []
+    for d in get_graph().get_dependents(m.__name__):
+        if _blacklist and d in _blacklist:
+            continue
+        ret.append(d)
+
+    return ret
+
+
+def _sync() -> None:
+    if not _roots:
+        return
+
+    index = misc.ModuleIndex.get()
+    modules: Dict[str, Any] = {}
+    imports: Dict[str, Set[str]] = {}
+    for root, cache in _caches.items():
+        root_modules = index.get_modules(Path(root))
+        imports.update(cache.get_imports({p: m.__name__ for p, m in root_modules.items()}))
+        modules.update({m.__name__: m for m in root_modules.values()})
+        cache.save()
+
+    for name in list(_scanned.keys()):
+        if name not in modules:
+            _scanned.pop(name)
+            _graph.remove(name)
+
+    for name, module in modules.items():
+        # only modules under tracked roots can change
+        module_imports = {i for i in imports.get(name, set()) if i in modules}
+        if name in _scanned and _scanned[name] == (module, module_imports):
+            continue
+
+        _scanned[name] = (module, module_imports)
+        _graph.set_imports(name, module_imports)
@@ -2,18 +2,20 @@ import inspect
 import os
 import re
 import sys
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 from copy import copy
-from dataclasses import dataclass, field, is_dataclass
+from dataclasses import dataclass, field, fields, is_dataclass
 from pathlib import Path
-from threading import Lock, Thread
-from time import sleep
+from threading import Condition, Lock, Thread
+from time import perf_counter, sleep
+from types import FunctionType
 from typing import (
     TYPE_CHECKING,
     Any,
     Callable,
     Dict,
     Generic,
+    Iterable,
     List,
     Optional,
     Tuple,
@@ -22,14 +24,20 @@ from typing import (
     Union,
 )
 
-from globmatch_temp import glob_match
 from rhei import Stopwatch
-from watchdog import events
-from watchdog.events import FileModifiedEvent
 
-from envo import console, logger
+from envo import console, dependency_watcher, logger
 from envo.logging import Logger
-from envo.misc import Callback, EnvoError, FilesWatcher, import_from_file
+from envo.metrics import ReloadMetrics
+from envo.misc import (
+    Callback,
+    ChangeSet,
+    EnvoError,
+    FilesWatcher,
+    ModuleIndex,
+    get_watch_dirs,
+    import_from_file,
+)
 
 __all__ = [
     "UserEnv",
@@ -52,13 +60,21 @@ __all__ = [
     "Source",
 ]
 
-from envo.partial_reloader import Action, PartialReloader
+from envo.partial_reloader import (
+    Action,
+    IncompatibleChange,
+    PartialReloader,
+    ReloadTransaction,
+    RollbackError,
+    get_code_fingerprint,
+    rebind_obj,
+)
 
 T = TypeVar("T")
 
 if TYPE_CHECKING:
     Raw = Union[T]
-    from envo import Plugin, misc
+    from envo import Plugin
     from envo.scripts import Status
     from envo.shell import FancyShell
 else:
@@ -368,6 +384,9 @@ class Source:
     root: Path
     watch_files: List[str] = field(default_factory=list)
     ignore_files: List[str] = field(default_factory=list)
+    debounce: float = 0.1  # s
+    watcher_backend: str = "native"
+    use_ignore_files: bool = False  # skip files ignored by .gitignore/.ignore
 
 
 class SourceReloader:
@@ -375,8 +394,8 @@ class SourceReloader:
     class Callbacks:
         on_reload_start: Callback
         after_partial_reload: Callback
-        after_full_reload: Callback
         on_reload_error: Callback
+        on_restart_needed: Callback
 
     @dataclass
     class Sets:
@@ -387,93 +406,174 @@ class SourceReloader:
         env: "Env"
         status: "Status"
         logger: "Logger"
+        metrics: ReloadMetrics
 
     _default_watch_files = ["**/*.py"]
     _default_ignore_files = [r"**/.*", r"**/*~", r"**/__pycache__"]
     _watcher: FilesWatcher
+    _pending: Dict[Path, None]
+    _generations: Dict[Path, int]
 
     def __init__(self, li: Links, se: Sets, calls: Callbacks) -> None:
         self.li = li
         self.se = se
         self.calls = calls
+
+        # reloads run on a worker so the observer thread only queues them
+        self._pending = OrderedDict()
+        self._generations = defaultdict(int)
+        self._reload_cond = Condition()
+        self._worker: Optional[Thread] = None
+        self._stopping = False
         self._watcher = FilesWatcher(
             FilesWatcher.Sets(
                 root=self.se.source.root,
                 include=self.se.source.watch_files + self._default_watch_files,
                 exclude=self.se.source.ignore_files + self._default_ignore_files,
                 name=str(self.se.source.root),
+                debounce=self.se.source.debounce,
+                backend=self.se.source.watcher_backend,
+                use_ignore_files=self.se.source.use_ignore_files,
             ),
-            calls=FilesWatcher.Callbacks(on_event=Callback(self._on_source_edit)),
+            calls=FilesWatcher.Callbacks(on_changes=Callback(self._on_source_edit)),
         )
 
-    def _on_source_edit(self, event: FileModifiedEvent) -> None:
-        module = next(
-            (
-                m
-                for m in reversed(list(sys.modules.values()))
-                if hasattr(m, "__file__") and m.__file__ == event.src_path
-            ),
-            None,
-        )
+    def _on_source_edit(self, changes: ChangeSet) -> None:
+        for path in changes.paths:
+            dependency_watcher.invalidate(path)
+
+        with self._reload_cond:
+            for path in changes.existing_paths:
+                # supersedes reload of the same file that is queued or being computed
+                self._generations[path] += 1
+                self._pending.pop(path, None)
+                self._pending[path] = None
+            self._reload_cond.notify()
+
+    def _requeue(self, paths: Iterable[Path]) -> None:
+        with self._reload_cond:
+            for path in paths:
+                if path not in self._pending:
+                    self._pending[path] = None
+            self._reload_cond.notify()
+
+    def _is_current(self, path: Path, generation: int) -> bool:
+        with self._reload_cond:
+            return self._generations[path] == generation
+
+    def _work(self) -> None:
+        # builds the import graph (mostly from the persisted cache) before the first reload needs it
+        dependency_watcher.get_graph()
+
+        while True:
+            with self._reload_cond:
+                self._reload_cond.wait_for(lambda: self._pending or self._stopping)
+                if self._stopping:
+                    return
+
+                # everything that changed so far is reloaded in one transaction
+                generations = {p: self._generations[p] for p in self._pending.keys()}
+                self._pending.clear()
+
+            self._reload_files(generations)
+
+    def _reload_files(self, generations: Dict[Path, int]) -> None:
+        modules = OrderedDict()
+        for path in generations.keys():
+            module = ModuleIndex.get().get_module(path)
+            if module:
+                modules[path] = module
 
-        if not module:
+        if not modules:
             return
 
-        reloader = PartialReloader(module, self.se.source.root)
-        self.li.logger.info(f"Detected changes in {event.src_path}")
+        for path in modules.keys():
+            self.li.logger.info(f"Detected changes in {str(path)}")
+
+        transaction = ReloadTransaction(
+            [PartialReloader(m, self.se.source.root) for m in modules.values()],
+            cancelled=lambda: not all(self._is_current(p, g) for p, g in generations.items()),
+        )
 
         try:
             self.calls.on_reload_start()
-            actions = reloader.run()
-            self.calls.after_partial_reload(Path(event.src_path), actions)
+            transaction.run()
+
+            if not transaction.completed:
+                # applied modules were rolled back, all of them are reloaded together with the newer versions
+                self.li.logger.debug("Reload superseded")
+                self._requeue(modules.keys())
+                return
+
+            timings = transaction.timings
+            action_counts = transaction.get_action_counts()
+            self.li.metrics.add_reload(
+                time=transaction.time,
+                timings=timings,
+                actions=action_counts,
+                modules={n: r.used_incremental for n, r in transaction.reloaders.items()},
+                dependents_n=transaction.dependents_n,
+            )
+            self.li.logger.info(
+                f"Reloaded {transaction.modules_n} modules ({len(transaction.actions)} actions) "
+                f"in {transaction.time * 1000:.1f} ms",
+                metadata={
+                    "type": "reload_transaction",
+                    "modules_n": transaction.modules_n,
+                    "incremental_n": transaction.incremental_n,
+                    "dependents_n": transaction.dependents_n,
+                    "actions_n": len(transaction.actions),
+                    "actions": action_counts,
+                    "time": transaction.time,
+                    "timings": timings,
+                },
+            )
+            for path, module in modules.items():
+                self.calls.after_partial_reload(path, transaction.reloaders[module.__name__].actions)
         except SyntaxError as e:
+            self.li.metrics.add_error()
             self.calls.on_reload_error(e)
+        except RollbackError as e:
+            # modules are partially reloaded, only a fresh process has a consistent state
+            self.li.logger.error(f"Rollback failed ({e})", metadata={"type": "rollback_error"})
+            self.li.metrics.add_restart([m.__name__ for m in modules.values()])
+            self.calls.on_restart_needed(e)
+        except IncompatibleChange as e:
+            self.li.logger.info(f"{e}, restarting", metadata={"type": "incompatible_change"})
+            self.li.metrics.add_restart([m.__name__ for m in modules.values()])
+            self.calls.on_restart_needed(e)
         except BaseException as e:
-            self.full_reload()
-            self.calls.after_full_reload()
-
-        self._watcher.flush()
+            # reloaded modules were rolled back to the previous version
+            self.li.logger.debug("Reload rolled back", metadata={"type": "rollback"})
+            self.li.metrics.add_error()
+            self.calls.on_reload_error(e)
 
     @property
     def source_files(self) -> List[Path]:
-        exclude = self.se.source.ignore_files + self._default_ignore_files
-        ret = []
-        for p in self.se.source.root.glob("**/*.py"):
-            if glob_match(p, exclude):
-                continue
-
-            ret.append(p.absolute())
-        return ret
+        return self._watcher.get_matching_files()
 
     @property
     def modules(self) -> List[Any]:
-        ret = []
-        source_files = self.source_files
-
-        potential_module_names = []
-        for p in source_files:
-            module_name = misc.path_to_module_name(p, self.se.source.root)
-            potential_module_names.append(module_name)
-
-        for n in potential_module_names:
-            m = misc.get_module_from_full_name(n)
-            if not m:
-                continue
-
-            if not hasattr(m, "__file__"):
-                continue
-
-            if not self.se.source.root in Path(m.__file__).parents:
-                continue
-
-            ret .append(m)
-        return ret
+        root = Path(os.path.realpath(str(self.se.source.root)))
+        modules = ModuleIndex.get().get_modules(root)
+        # index keeps real paths, match them as if they were under the (possibly symlinked) root
+        return [m for p, m in modules.items() if self._watcher.match(self._watcher.root / p.relative_to(root))]
 
     def start(self) -> None:
+        dependency_watcher.enable(self.se.source.root)
+        self._worker = Thread(target=self._work, name=f"{self.se.source.root} reloader", daemon=True)
+        self._worker.start()
         self._watcher.start()
         self.li.status.reloader_ready = True
 
     def stop(self):
+        with self._reload_cond:
+            self._stopping = True
+            self._pending.clear()
+            self._reload_cond.notify()
+
+        dependency_watcher.disable(self.se.source.root)
+
         def fun():
             self._watcher.flush()
             self._watcher.stop()
@@ -491,6 +591,8 @@ class EnvReloader:
         extra_watchers: List[FilesWatcher]
         watch_files: List[str]
         ignore_files: List[str]
+        debounce: float
+        watcher_backend: str
 
     @dataclass
     class Links:
@@ -520,18 +622,25 @@ class EnvReloader:
 
         # inject callbacks into existing watchers
         for w in self.se.extra_watchers:
-            w.calls = FilesWatcher.Callbacks(on_event=self.calls.on_env_edit)
+            w.calls = FilesWatcher.Callbacks(on_changes=self.calls.on_env_edit)
+            w.se.debounce = self.se.debounce
+            w.se.backend = self.se.watcher_backend
             self._env_watchers.append(w)
 
         for p in constituents:
+            include = self.se.watch_files + ["env_*.py"]
             watcher = FilesWatcher(
                 FilesWatcher.Sets(
                     root=p.Meta.root,
-                    include=self.se.watch_files + ["env_*.py"],
+                    include=include,
                     exclude=self.se.ignore_files + [r"**/.*", r"**/*~", r"**/__pycache__"],
                     name=p.__name__,
+                    debounce=self.se.debounce,
+                    backend=self.se.watcher_backend,
+                    # watch only directories that can contain matching files instead of the whole root
+                    watch_dirs=get_watch_dirs(p.Meta.root, include),
                 ),
-                calls=FilesWatcher.Callbacks(on_event=self.calls.on_env_edit),
+                calls=FilesWatcher.Callbacks(on_changes=self.calls.on_env_edit),
             )
             self._env_watchers.append(watcher)
 
@@ -539,6 +648,10 @@ class EnvReloader:
         for w in self._env_watchers:
             w.start()
 
+        self.li.logger.info(
+            f"Watching env files with {sum(w.watches_n for w in self._env_watchers)} watches",
+            metadata={"type": "env_watches"},
+        )
         self.li.status.reloader_ready = True
 
     def stop(self):
@@ -566,6 +679,8 @@ class BaseEnv:
         stage: str = "comm"
         watch_files: List[str] = []
         ignore_files: List[str] = []
+        reload_debounce: float = 0.1  # s
+        watcher_backend: str = "native"  # "native" or "polling" (for network and container filesystems)
 
     root: Path
     path: Raw[str]
@@ -735,6 +850,155 @@ class UserEnv(BaseEnv):
         return obj
 
 
+class EnvPatch:
+    """
+    Differences between loaded env classes and the ones from edited env files.
+
+    Methods, magic functions, class attributes and module globals are patched into the loaded classes
+    (magic function objects are updated in place, the shell keeps references to them).
+    Changes to Meta, parents, plugins or bases raise IncompatibleChange.
+    Applied changes are recorded, rollback() restores the loaded classes.
+    """
+
+    _ignored = ["Meta", "__module__", "__dict__", "__weakref__", "__doc__", "__qualname__"]
+
+    def __init__(self, old_env: Type[BaseEnv], new_env: Type[BaseEnv]) -> None:
+        self.old_parts = old_env.get_user_envs()
+        self.new_parts = new_env.get_user_envs()
+        self._changes = Action(reloader=None)
+
+        self._check(old_env, new_env)
+
+    def _check(self, old_env: Type[BaseEnv], new_env: Type[BaseEnv]) -> None:
+        def names(classes: List[Type[Any]]) -> List[str]:
+            return [c.__qualname__ for c in classes]
+
+        if names(self.old_parts) != names(self.new_parts):
+            raise IncompatibleChange("Env parents changed")
+
+        if names(old_env.get_plugin_envs()) != names(new_env.get_plugin_envs()):
+            raise IncompatibleChange("Env plugins changed")
+
+        for old, new in zip(self.old_parts, self.new_parts):
+            if self._get_meta(old) != self._get_meta(new):
+                raise IncompatibleChange(f"Meta of {old.__qualname__} changed")
+            if names(old.__bases__) != names(new.__bases__):
+                raise IncompatibleChange(f"Bases of {old.__qualname__} changed")
+
+    @classmethod
+    def get_fingerprint(cls, env: Type[BaseEnv]) -> Tuple[Any, ...]:
+        """
+        Return what env parts (and their modules) define, regardless of formatting, comments and order.
+        """
+        parts = env.get_user_envs()
+        ret = []
+        for p in parts:
+            module_globals = cls._get_globals(p) or {}
+            values = {
+                k: ("env", v.__qualname__) if any(v is o for o in parts) else cls._fingerprint(v)
+                for k, v in module_globals.items()
+                if not k.startswith("__")
+            }
+            ret.append((cls._fingerprint(p), sorted(values.items())))
+        ret.append(tuple(p.__qualname__ for p in env.get_plugin_envs()))
+        return tuple(ret)
+
+    @classmethod
+    def _fingerprint(cls, obj: Any, depth: int = 0) -> Any:
+        if isinstance(obj, MagicFunction):
+            return ("magic", obj.type, obj.namespace, repr(obj.kwargs), cls._fingerprint(obj.func, depth))
+        if isinstance(obj, (staticmethod, classmethod)):
+            return (type(obj).__name__, cls._fingerprint(obj.__func__, depth))
+        if isinstance(obj, FunctionType):
+            return ("function", get_code_fingerprint(obj.__code__), repr(obj.__defaults__), repr(obj.__kwdefaults__))
+        if isinstance(obj, property):
+            return ("property", tuple(cls._fingerprint(f, depth) for f in [obj.fget, obj.fset, obj.fdel]))
+        if obj is None or isinstance(obj, (bool, int, float, str, bytes, Path)):
+            return repr(obj)
+
+        # objects from other modules (imports) are the same objects in both versions
+        if depth < 8:
+            if isinstance(obj, (list, tuple, set)):
+                items = [cls._fingerprint(o, depth + 1) for o in obj]
+                return (type(obj).__name__, sorted(items, key=repr) if isinstance(obj, set) else items)
+            if isinstance(obj, dict):
+                return (
+                    "dict",
+                    sorted(((repr(k), cls._fingerprint(v, depth + 1)) for k, v in obj.items()), key=lambda x: x[0]),
+                )
+            if inspect.isclass(obj) and obj.__module__ not in sys.modules:
+                # defined in an env file, these are not registered in sys.modules
+                return (
+                    "class",
+                    obj.__qualname__,
+                    tuple(b.__qualname__ for b in obj.__bases__),
+                    sorted(
+                        (k, cls._fingerprint(v, depth + 1))
+                        for k, v in vars(obj).items()
+                        # init_parts leaves these on initialised classes
+                        if (k not in cls._ignored or k == "Meta")
+                        and k not in ["__initialised__", "__undecorated_init__"]
+                    ),
+                )
+
+        return ("object", id(obj))
+
+    @classmethod
+    def _get_meta(cls, env: Type[BaseEnv]) -> Dict[str, Any]:
+        return {k: v for k, v in vars(env.Meta).items() if not k.startswith("__")}
+
+    @classmethod
+    def _get_globals(cls, env: Type[BaseEnv]) -> Optional[Dict[str, Any]]:
+        for o in vars(env).values():
+            if isinstance(o, MagicFunction):
+                o = o.func
+            if isinstance(o, FunctionType):
+                return o.__globals__
+        return None
+
+    def apply(self) -> None:
+        for old, new in zip(self.old_parts, self.new_parts):
+            new_globals = self._get_globals(new)
+            old_globals = self._get_globals(old) or new_globals
+            if new_globals is not None and old_globals is not new_globals:
+                # loaded env classes stay, everything else defined in the file is refreshed
+                for k, v in new_globals.items():
+                    if not k.startswith("__") and not any(v is p for p in self.new_parts):
+                        self._changes._set(old_globals, k, v)
+
+            self._patch_class(old, new, old_globals)
+
+    def rollback(self) -> None:
+        self._changes.undo()
+
+    def _patch_class(self, old: Type[BaseEnv], new: Type[BaseEnv], module_globals: Dict[str, Any]) -> None:
+        old_dict = vars(old)
+        new_dict = vars(new)
+
+        for name in old_dict.keys() - new_dict.keys():
+            if not name.startswith("__"):
+                self._changes._delete(old, name)
+
+        for name, new_obj in new_dict.items():
+            if name in self._ignored:
+                continue
+
+            old_obj = old_dict.get(name)
+            if isinstance(new_obj, MagicFunction):
+                func = rebind_obj(new_obj.func, module_globals, old)
+                if type(old_obj) is type(new_obj):
+                    # commands are referenced by the shell, keep identity
+                    names = {f.name for f in fields(new_obj)} | vars(new_obj).keys()
+                    for n in sorted(names - {"env", "func"}):
+                        self._changes._set(old_obj, n, getattr(new_obj, n))
+                    self._changes._set(old_obj, "func", func)
+                else:
+                    new_obj.func = func
+                    self._changes._set(old, name, new_obj)
+            elif name == "__annotations__" or not name.startswith("__") or callable(new_obj):
+                self._changes._set(old, name, rebind_obj(new_obj, module_globals, old))
+
+
 class Env(EnvoEnv):
     """
     Defines environment.
@@ -755,6 +1019,8 @@ class Env(EnvoEnv):
         extra_watchers: List[FilesWatcher]
         reloader_enabled: bool = True
         blocking: bool = False
+        # environ to build variables from, os.environ if not set
+        environ: Optional[Dict[str, str]] = None
 
     _parents: List[Type["Env"]]
     _env_reloader: EnvReloader
@@ -776,18 +1042,21 @@ class Env(EnvoEnv):
         self.stage = self.meta.stage
         self.envo_stage = self.stage
 
-        self.path = os.environ["PATH"]
-        if "PYTHONPATH" not in os.environ:
+        environ = os.environ if self._se.environ is None else self._se.environ
+        self.path = environ["PATH"]
+        if "PYTHONPATH" not in environ:
             self.pythonpath = ""
         else:
-            self.pythonpath = os.environ["PYTHONPATH"]
+            self.pythonpath = environ["PYTHONPATH"]
 
         self._add_sources_to_syspath()
 
         self.pythonpath = str(self.root) + ":" + self.pythonpath
 
         self._exiting = False
-        self._executing_cmd = False
+        self._reload_pending = False
+        # env files changed while the new env was being built
+        self._restart_stale = False
 
         self._environ_before = None
         self._shell_environ_before = None
@@ -821,23 +1090,19 @@ class Env(EnvoEnv):
 
         self._collect_magic_functions()
 
-        self._li.shell.calls.pre_cmd = Callback(self._on_precmd)
-        self._li.shell.calls.on_stdout = Callback(self._on_stdout)
-        self._li.shell.calls.on_stderr = Callback(self._on_stderr)
-        self._li.shell.calls.post_cmd = Callback(self._on_postcmd)
-        self._li.shell.calls.post_cmd = Callback(self._on_postcmd)
-        self._li.shell.calls.on_exit = Callback(self._on_destroy)
-
         self.genstub()
 
         self.init_parts()
         self._env_reloader = None
+        # kept by the shell so counts survive restarts
+        self._reload_metrics = self._li.shell.reload_metrics if self._li.shell else ReloadMetrics()
 
         if self._se.reloader_enabled:
             self._env_reloader = EnvReloader(
                 li=EnvReloader.Links(env=self, status=self._li.status, logger=self.logger),
                 se=EnvReloader.Sets(extra_watchers=se.extra_watchers, watch_files=self.meta.watch_files,
-                                    ignore_files=self.meta.ignore_files),
+                                    ignore_files=self.meta.ignore_files, debounce=self.meta.reload_debounce,
+                                    watcher_backend=self.meta.watcher_backend),
                 calls=EnvReloader.Callbacks(
                     on_env_edit=Callback(self._on_env_edit),
                 ),
@@ -846,17 +1111,26 @@ class Env(EnvoEnv):
 
             for s in self.meta.sources:
                 reloader = SourceReloader(
-                    li=SourceReloader.Links(env=self, status=self._li.status, logger=self.logger),
+                    li=SourceReloader.Links(
+                        env=self, status=self._li.status, logger=self.logger, metrics=self._reload_metrics
+                    ),
                     se=SourceReloader.Sets(source=s),
                     calls=SourceReloader.Callbacks(
                         on_reload_start=Callback(self._on_reload_start),
                         after_partial_reload=Callback(self._after_partial_reload),
-                        after_full_reload=Callback(self._after_full_reload),
-                        on_reload_error=Callback(self._on_reload_error)
+                        on_reload_error=Callback(self._on_reload_error),
+                        on_restart_needed=Callback(self._on_source_restart_needed),
                     ),
                 )
                 self._source_reloaders.append(reloader)
 
+    def _bind_shell(self) -> None:
+        self._li.shell.calls.pre_cmd = Callback(self._on_precmd)
+        self._li.shell.calls.on_stdout = Callback(self._on_stdout)
+        self._li.shell.calls.on_stderr = Callback(self._on_stderr)
+        self._li.shell.calls.post_cmd = Callback(self._on_postcmd)
+        self._li.shell.calls.on_exit = Callback(self._on_destroy)
+
     def _add_sources_to_syspath(self) -> None:
         for p in reversed(self.meta.sources):
             sys.path.insert(0, str(p.root))
@@ -889,10 +1163,8 @@ class Env(EnvoEnv):
 
         self._li.status.source_ready = True
 
-    def _after_full_reload(self) -> None:
-        self._run_boot_codes()
-        self._li.status.source_ready = True
-        self.logger.debug("Applied full reload")
+    def _on_source_restart_needed(self, error: Exception) -> None:
+        self._restart(metadata={"type": "reload", "reason": error.__class__.__name__, "error": str(error)})
 
     def _on_reload_error(self, error: Exception) -> None:
         from rich.traceback import Traceback
@@ -1119,41 +1391,184 @@ class Env(EnvoEnv):
 
         self._exit()
 
-    def _on_env_edit(self, event: FileModifiedEvent) -> None:
-        while self._executing_cmd:
-            sleep(0.2)
-        self._reload_lock.acquire()
-
-        if self._exiting:
-            self._reload_lock.release()
+    def _on_env_edit(self, changes: ChangeSet) -> None:
+        metadata = {
+            "type": "reload",
+            "event": ", ".join(c.event_type for c in changes),
+            "path": ", ".join(str(p) for p in changes.paths),
+        }
+
+        with self._reload_lock:
+            busy = self._exiting or self._reload_pending
+        if busy:
+            self._restart(metadata)
             return
 
-        subscribe_events = [
-            events.EVENT_TYPE_MOVED,
-            events.EVENT_TYPE_MODIFIED,
-            events.EVENT_TYPE_CREATED,
-            events.EVENT_TYPE_DELETED,
-        ]
+        env_files = self._get_env_files()
+        edited = [Path(os.path.realpath(str(p))) for p in changes.paths]
+        # other watched files and removed env files need a restart
+        if all(p in env_files and p.exists() for p in edited):
+            try:
+                new_env = EnvBuilder.build_shell_env_from_file(env_files[0])
+            except Exception:
+                # restart reports errors in env files
+                new_env = None
+
+            if new_env and self._is_env_unchanged(new_env):
+                self.logger.info(
+                    "Env variables and functions unchanged, skipping reload",
+                    metadata=dict(metadata, type="reload_skipped"),
+                )
+                return
 
-        if any([s in event.event_type for s in subscribe_events]):
-            self._stop_reloaders()
+            if new_env and self._partial_env_reload(new_env, metadata):
+                return
 
-            self.logger.info(
-                "Reloading",
-                metadata={
-                    "type": "reload",
-                    "event": event.event_type,
-                    "path": event.src_path,
-                },
-            )
+        self._restart(metadata)
+
+    def _get_env_files(self) -> List[Path]:
+        return [Path(os.path.realpath(str(p.get_env_path()))) for p in self.get_user_envs()]
+
+    def _is_env_unchanged(self, new_env: Type["Env"]) -> bool:
+        """
+        Compare functions and exported variables of the rebuilt env with the live one.
+        """
+        try:
+            if EnvPatch.get_fingerprint(self.__class__) != EnvPatch.get_fingerprint(new_env):
+                return False
+
+            env = BaseEnv.__new__(new_env)
+            env.meta = env.Meta()
+            env._name = env.meta.name
+            # computed from os.environ before activation
+            for n in ["root", "stage", "envo_stage", "path", "pythonpath"]:
+                setattr(env, n, getattr(self, n))
+            env.init_parts()
+
+            return env.get_env_vars() == self.get_env_vars()
+        except Exception as e:
+            self.logger.debug(f"Couldn't compare envs ({e})")
+            return False
+
+    def _partial_env_reload(self, new_env: Type["Env"], metadata: Dict[str, Any]) -> bool:
+        """
+        Patch edited env files into the live env. Return False if a restart is needed.
+
+        On failure the live env is left as it was.
+        """
+        with self._reload_lock:
+            if self._exiting:
+                return True
+            if self._reload_pending:
+                # restart coalesces it into the pending one
+                return False
+            self._reload_pending = True
+
+        start = perf_counter()
+        self._li.shell.begin_reload()
+        try:
+            patch = EnvPatch(self.__class__, new_env)
+
+            env_vars_before = self.get_env_vars()
+            commands_before = set(self._magic_functions["command"].keys())
+            state_before = dict(vars(self))
+
+            env_vars_activated = None
+            try:
+                patch.apply()
+                self.init_parts()
+                self.validate()
+
+                self._magic_functions = {t: {} for t in self._magic_functions.keys()}
+                self._collect_magic_functions()
+
+                env_vars_activated = self.get_env_vars()
+                self._activate_changes(env_vars_before)
+                context = self._get_context()
+            except BaseException:
+                patch.rollback()
+                vars(self).clear()
+                vars(self).update(state_before)
+                if env_vars_activated is not None:
+                    self._activate_changes(env_vars_activated)
+                raise
+
+            for name in commands_before - self._magic_functions["command"].keys():
+                self._li.shell.unset_variable(name)
+            for name, c in self._magic_functions["command"].items():
+                self._li.shell.set_variable(name, c)
+            self._li.shell.set_context(context)
+        except IncompatibleChange as e:
+            self.logger.info(f"{e}, restarting", metadata=metadata)
+            return False
+        except Exception as e:
+            # restart reports errors in env files
+            self.logger.debug(f"Partial env reload failed ({e})", metadata=metadata)
+            return False
+        finally:
+            self._li.shell.end_reload()
+            with self._reload_lock:
+                self._reload_pending = False
+                # restarts requested meanwhile were coalesced into this reload
+                stale = self._restart_stale
+                self._restart_stale = False
+
+        self.logger.info(
+            f"Reloaded env in place in {(perf_counter() - start) * 1000:.1f} ms",
+            metadata=dict(metadata, type="partial_env_reload"),
+        )
+        return not stale
+
+    def _activate_changes(self, env_vars_before: Dict[str, str]) -> None:
+        """
+        Apply only changed env variables to os.environ and shell environ.
+        """
+        env_vars = self.get_env_vars()
+        environ_before = self._environ_before or {}
+        shell_environ_before = self._shell_environ_before or {}
+
+        for k in env_vars_before.keys() - env_vars.keys():
+            for environ, before in [(os.environ, environ_before), (self._li.shell.environ, shell_environ_before)]:
+                if before.get(k) is not None:
+                    environ[k] = before[k]
+                else:
+                    environ.pop(k, None)
+
+        changed = {k: v for k, v in env_vars.items() if env_vars_before.get(k) != v}
+        os.environ.update(**changed)
+        self._li.shell.environ.update(**changed)
+
+    def _restart(self, metadata: Dict[str, Any]) -> None:
+        with self._reload_lock:
+            if self._exiting or self._reload_pending:
+                self.logger.debug(
+                    "Coalescing restart into pending reload",
+                    metadata=metadata,
+                )
+                self._restart_stale = True
+                return
+            self._reload_pending = True
+
+        # this env keeps serving commands until the new one is built and swapped in
+        try:
+            while True:
+                with self._reload_lock:
+                    self._restart_stale = False
 
-            self._calls.restart()
-            self._exiting = True
+                self.logger.info("Reloading", metadata=metadata)
+                self._calls.restart()
 
-        self._reload_lock.release()
+                # retry if the new env failed on files that changed during the build
+                with self._reload_lock:
+                    if self._exiting or not self._restart_stale:
+                        break
+        finally:
+            with self._reload_lock:
+                self._reload_pending = False
 
     def _exit(self) -> None:
         self.logger.info("Exiting env")
+        self._exiting = True
         self._stop_reloaders()
 
     def activate(self) -> None:
@@ -1245,18 +1660,12 @@ class Env(EnvoEnv):
 
     @precmd
     def _pre_cmd(self, command: str) -> Optional[str]:
-        self._executing_cmd = True
-
         if self._is_python_fire_cmd(command):
             fun = command.split()[0]
             return f'__envo__execute_with_fire__({fun}, "{command}")'
 
         return command
 
-    @postcmd
-    def _post_cmd(self, command: str, stderr: str, stdout: str) -> None:
-        self._executing_cmd = False
-
     @command
     def genstub(self) -> None:
         from envo.stub_gen import StubGen
@@ -1284,11 +1693,19 @@ class Env(EnvoEnv):
     def _on_load(self) -> None:
         self._run_boot_codes()
 
+    def _run_cmd_hook(self, hook: MagicFunction, **kwargs: Any) -> Any:
+        t0 = perf_counter()
+        ret = hook(**kwargs)
+        self._li.shell.metrics.add_hook_time(
+            hook.type, hook.namespaced_name, perf_counter() - t0
+        )
+        return ret
+
     def _on_precmd(self, command: str) -> Tuple[Optional[str], Optional[str]]:
         functions = self._magic_functions["precmd"]
         for f in functions.values():
             if re.match(f.kwargs["cmd_regex"], command):
-                ret = f(command=command)  # type: ignore
+                ret = self._run_cmd_hook(f, command=command)
                 command = ret
         return command
 
@@ -1296,7 +1713,7 @@ class Env(EnvoEnv):
         functions = self._magic_functions["onstdout"]
         for f in functions.values():
             if re.match(f.kwargs["cmd_regex"], command):
-                ret = f(command=command, out=out)  # type: ignore
+                ret = self._run_cmd_hook(f, command=command, out=out)
                 if ret:
                     out = ret
         return out
@@ -1305,7 +1722,7 @@ class Env(EnvoEnv):
         functions = self._magic_functions["onstderr"]
         for f in functions.values():
             if re.match(f.kwargs["cmd_regex"], command):
-                ret = f(command=command, out=out)  # type: ignore
+                ret = self._run_cmd_hook(f, command=command, out=out)
                 if ret:
                     out = ret
         return out
@@ -1316,7 +1733,19 @@ class Env(EnvoEnv):
         functions = self._magic_functions["postcmd"]
         for f in functions.values():
             if re.match(f.kwargs["cmd_regex"], command):
-                f(command=command, stdout=stdout, stderr=stderr)  # type: ignore
+                self._run_cmd_hook(f, command=command, stdout=stdout, stderr=stderr)
+
+    def stats(self) -> None:
+        """
+        Print command execution metrics (wall time, hooks time, output size).
+        """
+        print(self._li.shell.metrics.render())
+
+    def reload_stats(self) -> None:
+        """
+        Print source reload metrics (reload counts, phase timings, applied actions).
+        """
+        print(self._reload_metrics.render())
 
     def _unload(self) -> None:
         self._deactivate()
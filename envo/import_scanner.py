@@ -0,0 +1,76 @@
+# Only the standard library is imported here, ImportCache runs this file in worker processes
+# so they start without importing envo (and xonsh).
+
+import ast
+import json
+import os
+import sys
+from typing import List, Optional, Set, Tuple, Union
+
+__all__ = ("get_imports", "scan_file")
+
+
+_statement_types = tuple(
+    getattr(ast, n) for n in ["stmt", "excepthandler", "match_case"] if hasattr(ast, n)
+)
+
+
+def get_imports(source: Union[str, bytes], name: str, is_package: bool) -> Set[str]:
+    """
+    Return names of modules imported by module level code (not function bodies) of the given source.
+
+    For `from package import name` both package and package.name are returned, name might be a submodule.
+    """
+    tree = ast.parse(source)
+    package = name if is_package else name.rpartition(".")[0]
+
+    ret = set()
+    nodes = list(tree.body)
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+            continue
+
+        if isinstance(node, ast.Import):
+            ret.update(a.name for a in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            if node.level:
+                parts = package.split(".") if package else []
+                # beyond top level package
+                if node.level > len(parts):
+                    continue
+                parent = ".".join(parts[: len(parts) - (node.level - 1)])
+                base = f"{parent}.{base}".strip(".") if base else parent
+
+            if base:
+                ret.add(base)
+            ret.update(f"{base}.{a.name}".strip(".") for a in node.names if a.name != "*")
+        else:
+            # imports are statements, expressions are not searched
+            nodes.extend(c for c in ast.iter_child_nodes(node) if isinstance(c, _statement_types))
+
+    return ret
+
+
+def scan_file(item: Tuple[str, str]) -> Tuple[str, Optional[Tuple[int, int]], List[str]]:
+    path, name = item
+    try:
+        stat = os.stat(path)
+        with open(path, "rb") as f:
+            source = f.read()
+        imports = get_imports(source, name, is_package=os.path.basename(path) == "__init__.py")
+    except (OSError, SyntaxError, ValueError):
+        return path, None, []
+
+    return path, (stat.st_mtime_ns, stat.st_size), sorted(imports)
+
+
+def main() -> None:
+    # (path, module name) items on stdin, results of scan_file on stdout
+    items = json.load(sys.stdin)
+    json.dump([scan_file((p, n)) for p, n in items], sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
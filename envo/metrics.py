@@ -0,0 +1,265 @@
+import json
+from bisect import bisect_left
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional
+
+__all__ = ["Histogram", "CommandRecord", "CommandMetrics", "ReloadMetrics"]
+
+HOOK_TYPES = ["precmd", "onstdout", "onstderr", "postcmd"]
+
+# upper bounds in seconds, values above the last one land in an overflow bucket
+DEFAULT_BOUNDS = [
+    0.001,
+    0.002,
+    0.005,
+    0.01,
+    0.02,
+    0.05,
+    0.1,
+    0.2,
+    0.5,
+    1.0,
+    2.0,
+    5.0,
+    10.0,
+]
+
+
+@dataclass
+class Histogram:
+    bounds: List[float] = field(default_factory=lambda: DEFAULT_BOUNDS[:])
+    counts: List[int] = field(default_factory=list)
+    total: float = 0.0
+    n: int = 0
+    max: float = 0.0
+
+    def __post_init__(self) -> None:
+        if not self.counts:
+            self.counts = [0] * (len(self.bounds) + 1)
+
+    def add(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.n += 1
+        self.max = max(self.max, value)
+
+    def merge(self, other: "Histogram") -> None:
+        assert self.bounds == other.bounds
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.n += other.n
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.n if self.n else 0.0
+
+    def percentile(self, p: float) -> float:
+        """
+        Return upper bound of the bucket containing p-th percentile (0-100).
+        """
+        if not self.n:
+            return 0.0
+
+        threshold = self.n * p / 100
+        cumulative = 0
+        for i, c in enumerate(self.counts):
+            cumulative += c
+            if cumulative >= threshold:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "bounds": self.bounds,
+            "counts": self.counts,
+            "total": self.total,
+            "n": self.n,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Histogram":
+        return cls(**data)
+
+
+@dataclass
+class CommandRecord:
+    command: str
+    wall_time: float = 0.0  # s
+    hooks_time: Dict[str, float] = field(default_factory=lambda: defaultdict(float))
+    stdout_bytes: int = 0
+    stderr_bytes: int = 0
+    rtn: Optional[int] = None
+
+    @property
+    def output_bytes(self) -> int:
+        return self.stdout_bytes + self.stderr_bytes
+
+
+class CommandMetrics:
+    """
+    In-memory store of command execution metrics.
+    """
+
+    records: Deque[CommandRecord]
+    histograms: Dict[str, Histogram]
+
+    def __init__(self, history_size: int = 100) -> None:
+        self.records = deque(maxlen=history_size)
+        self.histograms = defaultdict(Histogram)
+        self.commands_n = 0
+        self.failed_n = 0
+        self.output_bytes = 0
+
+    def add(self, record: CommandRecord) -> None:
+        self.records.append(record)
+        self.commands_n += 1
+        self.output_bytes += record.output_bytes
+        if record.rtn:
+            self.failed_n += 1
+
+        self.histograms["command"].add(record.wall_time)
+        for t in HOOK_TYPES:
+            self.histograms[f"hooks.{t}"].add(record.hooks_time.get(t, 0.0))
+
+    def add_hook_time(self, hook_type: str, name: str, seconds: float) -> None:
+        self.histograms[f"hook.{hook_type}.{name}"].add(seconds)
+
+    def render(self) -> str:
+        ret = [
+            f"Commands: {self.commands_n} (failed: {self.failed_n}), "
+            f"output: {self.output_bytes} bytes",
+            f"{'name':<40}{'n':>8}{'mean ms':>10}{'p95 ms':>10}{'max ms':>10}{'total s':>10}",
+        ]
+
+        for n, h in sorted(self.histograms.items(), key=lambda x: -x[1].total):
+            ret.append(
+                f"{n:<40}{h.n:>8}{h.mean * 1000:>10.2f}{h.percentile(95) * 1000:>10.2f}"
+                f"{h.max * 1000:>10.2f}{h.total:>10.3f}"
+            )
+
+        if self.records:
+            ret.append("Last commands:")
+            for r in self.records:
+                hooks = sum(r.hooks_time.values())
+                ret.append(
+                    f"  {r.command[:40]:<40} {r.wall_time * 1000:.1f} ms "
+                    f"(hooks {hooks * 1000:.1f} ms, {r.output_bytes} bytes, rtn={r.rtn})"
+                )
+
+        return "\n".join(ret)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "commands_n": self.commands_n,
+            "failed_n": self.failed_n,
+            "output_bytes": self.output_bytes,
+            "histograms": {n: h.to_dict() for n, h in self.histograms.items()},
+        }
+
+    def save(self, path: Path) -> None:
+        path.write_text(json.dumps(self.to_dict()), "utf-8")
+
+    @classmethod
+    def load(cls, path: Path) -> "CommandMetrics":
+        """
+        Load persisted summary. Returns empty metrics if file is missing or corrupted.
+        """
+        metrics = cls()
+        try:
+            data = json.loads(path.read_text("utf-8"))
+            metrics.commands_n = data["commands_n"]
+            metrics.failed_n = data["failed_n"]
+            metrics.output_bytes = data["output_bytes"]
+            for n, h in data["histograms"].items():
+                metrics.histograms[n] = Histogram.from_dict(h)
+        except (OSError, ValueError, KeyError, TypeError):
+            return cls()
+
+        return metrics
+
+
+class ReloadMetrics:
+    """
+    In-memory store of source reload metrics.
+    """
+
+    histograms: Dict[str, Histogram]
+
+    def __init__(self) -> None:
+        self.reloads_n = 0  # applied reload transactions
+        self.modules_n = 0
+        self.incremental_n = 0  # modules reloaded from changed definitions only
+        self.dependents_n = 0
+        self.errors_n = 0  # failed and rolled back
+        self.restarts_n = 0
+        self.histograms = defaultdict(Histogram)
+        self.actions: Dict[str, int] = defaultdict(int)
+        # modules needing the full diff or a restart, to find the ones worth restructuring
+        self.full_diff_modules: Dict[str, int] = defaultdict(int)
+        self.restart_modules: Dict[str, int] = defaultdict(int)
+
+    def add_reload(
+        self,
+        time: float,
+        timings: Dict[str, float],
+        actions: Dict[str, int],
+        modules: Dict[str, bool],
+        dependents_n: int,
+    ) -> None:
+        """
+        modules maps reloaded module names to whether they were reloaded incrementally.
+        """
+        self.reloads_n += 1
+        self.modules_n += len(modules)
+        self.dependents_n += dependents_n
+        self.histograms["reload"].add(time)
+        for phase, t in timings.items():
+            self.histograms[f"reload.{phase}"].add(t)
+
+        for kind, n in actions.items():
+            self.actions[kind] += n
+
+        for name, incremental in modules.items():
+            if incremental:
+                self.incremental_n += 1
+            else:
+                self.full_diff_modules[name] += 1
+
+    def add_error(self) -> None:
+        self.errors_n += 1
+
+    def add_restart(self, modules: List[str]) -> None:
+        self.restarts_n += 1
+        for m in modules:
+            self.restart_modules[m] += 1
+
+    def render(self) -> str:
+        ret = [
+            f"Reloads: {self.reloads_n} ({self.modules_n} modules, {self.incremental_n} incremental, "
+            f"{self.dependents_n} dependents), errors: {self.errors_n}, restarts: {self.restarts_n}",
+            f"{'phase':<40}{'n':>8}{'mean ms':>10}{'p95 ms':>10}{'max ms':>10}{'total s':>10}",
+        ]
+
+        for n, h in sorted(self.histograms.items(), key=lambda x: -x[1].total):
+            ret.append(
+                f"{n:<40}{h.n:>8}{h.mean * 1000:>10.2f}{h.percentile(95) * 1000:>10.2f}"
+                f"{h.max * 1000:>10.2f}{h.total:>10.3f}"
+            )
+
+        if self.actions:
+            ret.append("Actions:")
+            for kind, n in sorted(self.actions.items(), key=lambda x: -x[1]):
+                ret.append(f"  {kind:<38}{n:>8}")
+
+        for title, modules in [("Full diff", self.full_diff_modules), ("Restarts", self.restart_modules)]:
+            if modules:
+                ret.append(f"{title}:")
+                for name, n in sorted(modules.items(), key=lambda x: -x[1]):
+                    ret.append(f"  {name:<38}{n:>8}")
+
+        return "\n".join(ret)
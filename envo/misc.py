@@ -1,18 +1,35 @@
 import errno
+import hashlib
 import importlib.machinery
 import importlib.util
+import marshal
 import os
 import re
 import sys
 import traceback
+from collections import OrderedDict
+from functools import lru_cache
 from dataclasses import dataclass
 from pathlib import Path
 from textwrap import dedent
-from typing import Any, Callable, Dict, List, Optional
-
-from globmatch_temp import glob_match
-from watchdog.events import FileModifiedEvent, FileSystemEventHandler
+from threading import Event, Lock, RLock, Thread, Timer
+from time import monotonic
+from types import CodeType
+from typing import Any, Callable, Dict, Iterator, List, Optional, Pattern, Tuple, Union
+
+from globmatch_temp.translation import translate_glob
+from watchdog.events import (
+    EVENT_TYPE_CREATED,
+    EVENT_TYPE_DELETED,
+    EVENT_TYPE_MOVED,
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileSystemEvent,
+    FileSystemEventHandler,
+)
 from watchdog.observers import Observer
+from watchdog.observers.api import ObservedWatch
 
 __all__ = [
     "dir_name_to_class_name",
@@ -22,6 +39,7 @@ __all__ = [
     "EnvoError",
     "Callback",
     "FilesWatcher",
+    "ChangeSet",
 ]
 
 
@@ -51,15 +69,896 @@ class InotifyPath:
         if self.relative.is_dir():
             self.relative_str += "/"
 
-    def match(self, include: List[str], exclude: List[str]) -> bool:
-        return not glob_match(self.relative_str, exclude) and glob_match(
-            self.relative_str, include
-        )
+    def match(self, matcher: "GlobMatcher") -> bool:
+        return matcher.match(self.relative_str)
 
     def is_dir(self) -> bool:
         return self.absolute.is_dir()
 
 
+class GlobMatcher:
+    """
+    Include/exclude globs compiled once into a single regex each.
+
+    Decisions are cached per path, events for the same files (build dirs, editors swap files) are
+    matched only once.
+    """
+
+    def __init__(self, include: List[str], exclude: List[str], cache_size: int = 4096) -> None:
+        self.include = include
+        self.exclude = exclude
+
+        self._include_re = self._compile(include)
+        self._exclude_re = self._compile(exclude)
+
+        self.match = lru_cache(maxsize=cache_size)(self._match)  # type: ignore
+        self.is_excluded = lru_cache(maxsize=cache_size)(self._is_excluded)  # type: ignore
+
+    @classmethod
+    def _compile(cls, globs: List[str]) -> Optional[Pattern]:
+        if not globs:
+            return None
+
+        parts = []
+        for g in globs:
+            # translate_glob appends inline flags at the end which newer pythons reject
+            regex = translate_glob(os.path.normcase(g))
+            regex = regex.replace(r"\Z(?ms)", r"\Z")
+            parts.append(f"(?:{regex})")
+
+        return re.compile("(?ms)" + "|".join(parts))
+
+    def is_included(self, path: str) -> bool:
+        return bool(self._include_re and self._include_re.match(os.path.normcase(path)))
+
+    def _is_excluded(self, path: str) -> bool:
+        return bool(self._exclude_re and self._exclude_re.match(os.path.normcase(path)))
+
+    def _match(self, path: str) -> bool:
+        return not self._is_excluded(path) and self.is_included(path)
+
+
+class IgnoreRules:
+    """
+    Rules from .gitignore and .ignore files applying to paths under root.
+
+    Ignore files are read from root, its parents up to the repository top and any directory below root
+    the first time a path in that directory is checked. Patterns are compiled once,
+    use reload() when an ignore file changes.
+    """
+
+    FILE_NAMES = [".gitignore", ".ignore"]
+
+    @dataclass
+    class Rule:
+        regex: Pattern
+        negate: bool
+        dir_only: bool
+
+    def __init__(self, root: Path, cache_size: int = 4096) -> None:
+        self.root = root
+        self.top = self._find_top(root)
+
+        self._rules: Dict[Path, List[IgnoreRules.Rule]] = {}
+        self._lock = Lock()
+        self.is_ignored = lru_cache(maxsize=cache_size)(self._is_ignored)  # type: ignore
+
+    @classmethod
+    def _find_top(cls, root: Path) -> Path:
+        for d in [root, *root.parents]:
+            if (d / ".git").exists():
+                return d
+        return root
+
+    @classmethod
+    def is_ignore_file(cls, path: Path) -> bool:
+        return path.name in cls.FILE_NAMES
+
+    @classmethod
+    def _translate(cls, pattern: str) -> str:
+        ret = []
+        i = 0
+        while i < len(pattern):
+            c = pattern[i]
+            if pattern.startswith("**/", i):
+                ret.append("(?:.*/)?")
+                i += 3
+                continue
+            if pattern.startswith("**", i):
+                ret.append(".*")
+                i += 2
+                continue
+
+            if c == "*":
+                ret.append("[^/]*")
+            elif c == "?":
+                ret.append("[^/]")
+            elif c == "[" and "]" in pattern[i + 1:]:
+                end = pattern.index("]", i + 1)
+                chars = pattern[i + 1:end]
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                ret.append("[" + chars + "]")
+                i = end
+            elif c == "\\" and i + 1 < len(pattern):
+                i += 1
+                ret.append(re.escape(pattern[i]))
+            else:
+                ret.append(re.escape(c))
+            i += 1
+
+        return "".join(ret)
+
+    @classmethod
+    def parse(cls, text: str) -> List[Rule]:
+        ret = []
+        for line in text.splitlines():
+            line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+
+            negate = line.startswith("!")
+            line = line[1:] if negate else line
+
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+
+            # patterns with a slash are relative to the ignore file's directory, others match at any depth
+            anchored = "/" in line
+            line = line.lstrip("/")
+            if not line:
+                continue
+
+            prefix = "" if anchored else "(?:.*/)?"
+            # a match on a directory covers everything below it
+            regex = re.compile(f"{prefix}{cls._translate(line)}(?P<sub>/.*)?$")
+            ret.append(cls.Rule(regex=regex, negate=negate, dir_only=dir_only))
+
+        return ret
+
+    def _get_rules(self, directory: Path) -> List[Rule]:
+        with self._lock:
+            if directory in self._rules:
+                return self._rules[directory]
+
+        rules = []
+        for n in self.FILE_NAMES:
+            try:
+                rules.extend(self.parse((directory / n).read_text("utf-8")))
+            except (OSError, UnicodeDecodeError):
+                continue
+
+        with self._lock:
+            self._rules[directory] = rules
+        return rules
+
+    def reload(self, ignore_file: Optional[Path] = None) -> None:
+        with self._lock:
+            if ignore_file:
+                self._rules.pop(ignore_file.parent, None)
+            else:
+                self._rules.clear()
+        self.is_ignored.cache_clear()
+
+    def _is_ignored(self, path: Path, is_dir: bool) -> bool:
+        try:
+            relative = path.relative_to(self.top)
+        except ValueError:
+            return False
+
+        # files can't be re-included by a negation when their directory is excluded
+        if len(relative.parts) > 1 and self.is_ignored(path.parent, True):
+            return True
+
+        parts = relative.parts
+        ignored = False
+        directory = self.top
+        # deeper ignore files take precedence over the ones above
+        for i, part in enumerate(parts):
+            sub_path = "/".join(parts[i:])
+            for r in self._get_rules(directory):
+                m = r.regex.match(sub_path)
+                if not m:
+                    continue
+                if r.dir_only and not is_dir and not m.group("sub"):
+                    continue
+                ignored = not r.negate
+            directory /= part
+
+        return ignored
+
+
+class PathTrie:
+    """
+    Maps paths to values, allows to look up all values registered on a path and its ancestors.
+    """
+
+    class Node:
+        __slots__ = ("children", "values")
+
+        def __init__(self) -> None:
+            self.children: Dict[str, "PathTrie.Node"] = {}
+            self.values: List[Any] = []
+
+    def __init__(self) -> None:
+        self._root = self.Node()
+
+    def add(self, path: Path, value: Any) -> None:
+        node = self._root
+        for part in path.parts:
+            node = node.children.setdefault(part, self.Node())
+        node.values.append(value)
+
+    def remove(self, path: Path, value: Any) -> None:
+        nodes = [self._root]
+        for part in path.parts:
+            node = nodes[-1].children.get(part)
+            if not node:
+                return
+            nodes.append(node)
+
+        if value in nodes[-1].values:
+            nodes[-1].values.remove(value)
+
+        # prune empty branches
+        for parent, part, node in reversed(list(zip(nodes, path.parts, nodes[1:]))):
+            if node.values or node.children:
+                break
+            parent.children.pop(part)
+
+    def get_along(self, path: Path) -> List[Any]:
+        """
+        Return values registered on the path and all its ancestors (closest last).
+        """
+        ret = list(self._root.values)
+        node = self._root
+        for part in path.parts:
+            node = node.children.get(part)
+            if not node:
+                break
+            ret.extend(node.values)
+        return ret
+
+    def get_under(self, path: Path) -> List[Any]:
+        """
+        Return values registered on the path and all its descendants.
+        """
+        node = self._root
+        for part in path.parts:
+            node = node.children.get(part)
+            if not node:
+                return []
+
+        ret = []
+        nodes = [node]
+        while nodes:
+            n = nodes.pop()
+            ret.extend(n.values)
+            nodes.extend(n.children.values())
+        return ret
+
+    def top_paths(self) -> List[Path]:
+        """
+        Return paths that have values and no ancestors with values.
+        """
+        ret = []
+
+        def walk(node: "PathTrie.Node", parts: List[str]) -> None:
+            if node.values:
+                ret.append(Path(*parts))
+                return
+            for part, child in node.children.items():
+                walk(child, parts + [part])
+
+        walk(self._root, [])
+        return ret
+
+
+WATCHER_BACKEND_NATIVE = "native"
+WATCHER_BACKEND_POLLING = "polling"
+WATCHER_BACKENDS = [WATCHER_BACKEND_NATIVE, WATCHER_BACKEND_POLLING]
+
+
+def get_inotify_max_user_watches() -> Optional[int]:
+    try:
+        return int(Path("/proc/sys/fs/inotify/max_user_watches").read_text())
+    except (OSError, ValueError):
+        return None
+
+
+class PollingBackend:
+    """
+    Stat polling watcher backend for filesystems where inotify is unavailable or unreliable.
+
+    Keeps an mtime/size index of matching files only (excluded directories are not descended into and
+    not matching files are never stat'ed). Scans are incremental and throttled to use at most cpu_budget
+    of a core, changes are dispatched as regular watchdog events.
+    """
+
+    _slice = 0.01  # s of work before yielding the cpu
+
+    def __init__(
+        self, manager: "WatchManager", interval: float = 1.0, cpu_budget: float = 0.05
+    ) -> None:
+        self.manager = manager
+        self.interval = interval
+        self.cpu_budget = cpu_budget
+
+        self._indexes: Dict[Path, Dict[str, Tuple[int, int]]] = {}
+        self._recursive: Dict[Path, bool] = {}
+        self._lock = Lock()
+        self._stop_event = Event()
+        self._thread: Optional[Thread] = None
+        self._slice_start = 0.0
+
+    def schedule(self, root: Path, recursive: bool = True) -> None:
+        # initial index is built synchronously so existing files are not reported as created
+        index = {path: (st.st_mtime_ns, st.st_size) for path, st in self._scan(root, recursive)}
+
+        with self._lock:
+            self._indexes[root] = index
+            self._recursive[root] = recursive
+
+        if not self._thread:
+            self._thread = Thread(target=self._run, name="envo polling watcher", daemon=True)
+            self._thread.start()
+
+    def unschedule(self, root: Path) -> None:
+        with self._lock:
+            self._indexes.pop(root, None)
+            self._recursive.pop(root, None)
+
+    @property
+    def files_n(self) -> int:
+        return sum(len(i) for i in self._indexes.values())
+
+    def _scan(self, root: Path, recursive: bool) -> Iterator[Tuple[str, os.stat_result]]:
+        dirs = [str(root)]
+        while dirs:
+            try:
+                entries = list(os.scandir(dirs.pop()))
+            except OSError:
+                continue
+
+            for e in entries:
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        if recursive and not self.manager._is_excluded(Path(e.path)):
+                            dirs.append(e.path)
+                    elif self.manager._is_matched(Path(e.path)):
+                        yield e.path, e.stat()
+                except OSError:
+                    # removed in the meantime
+                    continue
+
+    def _throttle(self) -> None:
+        elapsed = monotonic() - self._slice_start
+        if elapsed >= self._slice:
+            self._stop_event.wait(elapsed * (1 - self.cpu_budget) / self.cpu_budget)
+            self._slice_start = monotonic()
+
+    def _poll(self, root: Path) -> None:
+        index = self._indexes.get(root)
+        if index is None:
+            return
+
+        seen = set()
+        for path, st in self._scan(root, self._recursive.get(root, True)):
+            if self._stop_event.is_set():
+                return
+
+            seen.add(path)
+            key = (st.st_mtime_ns, st.st_size)
+            old = index.get(path)
+            index[path] = key
+
+            if old is None:
+                self.manager.dispatch(FileCreatedEvent(path))
+            elif old != key:
+                self.manager.dispatch(FileModifiedEvent(path))
+
+            self._throttle()
+
+        for path in index.keys() - seen:
+            index.pop(path)
+            self.manager.dispatch(FileDeletedEvent(path))
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            started = monotonic()
+            self._slice_start = started
+
+            with self._lock:
+                roots = list(self._indexes.keys())
+
+            for r in roots:
+                self._poll(r)
+
+            self._stop_event.wait(max(self.interval - (monotonic() - started), 0))
+
+
+class WatchManager(FileSystemEventHandler):
+    """
+    Process wide owner of a single watchdog observer.
+
+    Every watched directory is scheduled once (directories nested in recursively watched ones are not
+    scheduled at all) and events are routed to subscribed FilesWatchers through a path trie.
+    Roots that would exceed the inotify budget are watched by the polling backend instead.
+
+    Backend can be forced for all roots with ENVO_WATCHER_BACKEND environment variable.
+    """
+
+    _instance: Optional["WatchManager"] = None
+    _instance_lock = Lock()
+
+    def __init__(self) -> None:
+        from envo import logger
+
+        super().__init__()
+
+        self.logger = logger.create_child("Watch Manager", descriptor="Watch Manager")
+
+        # guards subscribers only and is never held while calling the observer, its thread takes it in dispatch
+        self._lock = RLock()
+        # serialises scheduling of watches
+        self._sync_lock = RLock()
+        self._subscribers = PathTrie()
+        self._watchers: List["FilesWatcher"] = []
+        # path -> (recursive, native watch or None when polled)
+        self._watches: Dict[Path, Tuple[bool, Optional[ObservedWatch]]] = {}
+        self._watched_dirs: Dict[Path, List[Path]] = {}
+        self._pending_dirs: Dict[Path, List[Path]] = {}
+        self._to_refresh: List["FilesWatcher"] = []
+        self._refresh_thread: Optional[Thread] = None
+        self._observer = Observer()
+        self._polling: Optional[PollingBackend] = None
+
+        self.budget = self._get_budget()
+
+        if is_linux():
+            self._patch_inotify()
+
+        self._observer.start()
+
+    @classmethod
+    def get(cls) -> "WatchManager":
+        with cls._instance_lock:
+            if not cls._instance:
+                cls._instance = cls()
+            return cls._instance
+
+    @classmethod
+    def _get_budget(cls) -> Optional[int]:
+        if "ENVO_INOTIFY_BUDGET" in os.environ:
+            return int(os.environ["ENVO_INOTIFY_BUDGET"])
+
+        max_watches = get_inotify_max_user_watches()
+        if max_watches is None:
+            return None
+
+        # the limit is shared with every other process of the user (editors, IDEs), leave them half
+        return max_watches // 2
+
+    @property
+    def watches_n(self) -> int:
+        return sum(len(d) for d in self._watched_dirs.values())
+
+    def get_watches_n(self, root: Path) -> int:
+        """
+        Return number of watched directories under the root.
+        """
+        ret = 0
+        for dirs in self._watched_dirs.values():
+            ret += sum(1 for d in dirs if d == root or root in d.parents)
+        return ret
+
+    def _patch_inotify(self) -> None:
+        from watchdog.observers.inotify_c import Inotify
+
+        manager = self
+
+        def _add_dir_watch(inotify: Inotify, path: bytes, recursive: bool, mask: int) -> None:
+            """
+            Adds a watch for the given directory path and (if recursive) its not excluded subdirectories.
+            """
+            if not os.path.isdir(path):
+                raise OSError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+
+            root = Path(os.fsdecode(path))
+            if recursive:
+                dirs = manager._pending_dirs.pop(root, None) or manager._collect_dirs(root)
+            else:
+                dirs = [root]
+
+            try:
+                for d in dirs:
+                    inotify._add_watch(os.fsencode(str(d)), mask)
+            except OSError:
+                # Inotify object is never constructed so release its descriptor (and watches) here
+                os.close(inotify._inotify_fd)
+                raise
+
+        Inotify._add_dir_watch = _add_dir_watch
+
+    def _is_excluded(self, path: Path) -> bool:
+        """
+        Path is excluded only if every watcher covering it excludes it.
+        """
+        with self._lock:
+            watchers = self._subscribers.get_along(path)
+        return bool(watchers) and all(w.is_excluded(path) for w in watchers)
+
+    def _collect_dirs(self, root: Path) -> List[Path]:
+        """
+        Return root and all its subdirectories, excluded subtrees are pruned without descending into them.
+        """
+        ret = [root]
+
+        for dirpath, dirnames, _ in os.walk(str(root)):
+            kept = []
+            for d in dirnames:
+                path = Path(dirpath) / d
+                if path.is_symlink() or self._is_excluded(path):
+                    continue
+                kept.append(d)
+                ret.append(path)
+            dirnames[:] = kept
+
+        return ret
+
+    def _is_matched(self, path: Path) -> bool:
+        with self._lock:
+            watchers = self._subscribers.get_along(path)
+        return any(w.match(path) or w.is_ignore_file(path) for w in watchers)
+
+    def _get_backend(self, path: Path) -> str:
+        if "ENVO_WATCHER_BACKEND" in os.environ:
+            backend = os.environ["ENVO_WATCHER_BACKEND"]
+            if backend not in WATCHER_BACKENDS:
+                raise EnvoError(
+                    f'Unknown ENVO_WATCHER_BACKEND "{backend}", should be one of {WATCHER_BACKENDS}'
+                )
+            return backend
+
+        with self._lock:
+            backends = {w.se.backend for w in self._subscribers.get_under(path)}
+        return WATCHER_BACKEND_POLLING if WATCHER_BACKEND_POLLING in backends else WATCHER_BACKEND_NATIVE
+
+    def _schedule(self, path: Path, recursive: bool) -> None:
+        if self._get_backend(path) == WATCHER_BACKEND_POLLING:
+            self._schedule_polling(path, recursive)
+            return
+
+        dirs = self._collect_dirs(path) if recursive else [path]
+
+        if self.budget is not None and self.watches_n + len(dirs) > self.budget:
+            self.logger.warning(
+                f"Watching {str(path)} would need {len(dirs)} inotify watches "
+                f"({self.watches_n}/{self.budget} used), falling back to polling"
+            )
+            self._schedule_polling(path, recursive)
+            return
+
+        self._pending_dirs[path] = dirs
+        try:
+            self._watches[path] = (
+                recursive,
+                self._observer.schedule(self, str(path), recursive=recursive),
+            )
+        except OSError as e:
+            if e.errno != errno.ENOSPC:
+                raise
+            self.logger.warning(
+                f"Ran out of inotify watches for {str(path)}, falling back to polling"
+            )
+            self._discard_failed_watch(ObservedWatch(str(path), recursive))
+            self._schedule_polling(path, recursive)
+            return
+        finally:
+            self._pending_dirs.pop(path, None)
+
+        self._watched_dirs[path] = dirs
+
+    def _discard_failed_watch(self, watch: ObservedWatch) -> None:
+        """
+        Remove handler and emitter a failed observer.schedule() registered before its emitter failed to start.
+        """
+        observer = self._observer
+        with observer._lock:
+            observer._handlers.pop(watch, None)
+            emitter = observer._emitter_for_watch.get(watch)
+            if emitter:
+                observer._remove_emitter(emitter)
+            observer._watches.discard(watch)
+
+    def _schedule_polling(self, path: Path, recursive: bool) -> None:
+        if not self._polling:
+            self._polling = PollingBackend(self)
+
+        self._polling.schedule(path, recursive)
+        self._watches[path] = (recursive, None)
+
+    def _unschedule(self, path: Path) -> None:
+        _, watch = self._watches.pop(path)
+        if watch:
+            self._observer.unschedule(watch)
+        else:
+            self._polling.unschedule(path)
+        self._watched_dirs.pop(path, None)
+
+    def _get_needed_watches(self) -> Dict[Path, bool]:
+        """
+        Return directories to schedule and whether they need a recursive watch.
+        """
+        with self._lock:
+            watchers = self._watchers[:]
+
+        recursive = {d.path for w in watchers for d in w.watch_dirs if d.recursive}
+        flat = {d.path for w in watchers for d in w.watch_dirs if not d.recursive}
+
+        def covered(path: Path) -> bool:
+            return any(p in recursive for p in path.parents)
+
+        ret = {p: True for p in recursive if not covered(p)}
+        ret.update({p: False for p in flat if p not in recursive and not covered(p)})
+        return ret
+
+    def _sync_watches(self) -> None:
+        needed = self._get_needed_watches()
+
+        # schedule first so there is no gap when a broader root replaces narrower ones
+        for p, recursive in needed.items():
+            if p in self._watches:
+                if self._watches[p][0] == recursive:
+                    continue
+                self._unschedule(p)
+
+            self.logger.debug(f"Scheduling {'recursive' if recursive else 'flat'} watch on {str(p)}")
+            self._schedule(p, recursive)
+
+        for p in self._watches.keys() - needed.keys():
+            self.logger.debug(f"Unscheduling watch on {str(p)}")
+            self._unschedule(p)
+
+    def subscribe(self, watcher: "FilesWatcher") -> None:
+        with self._lock:
+            for d in watcher.watch_dirs:
+                self._subscribers.add(d.path, watcher)
+            self._watchers.append(watcher)
+
+        with self._sync_lock:
+            self._sync_watches()
+
+            watcher.watches_n = sum(
+                self.get_watches_n(d.path) if d.recursive else 1 for d in watcher.watch_dirs
+            )
+            watcher.logger.info(
+                f"Using {watcher.watches_n} inotify watches",
+                metadata={"total": self.watches_n, "budget": self.budget},
+            )
+
+    def unsubscribe(self, watcher: "FilesWatcher") -> None:
+        with self._lock:
+            for d in watcher.watch_dirs:
+                self._subscribers.remove(d.path, watcher)
+            if watcher in self._watchers:
+                self._watchers.remove(watcher)
+
+        with self._sync_lock:
+            self._sync_watches()
+
+    def request_refresh(self, watcher: "FilesWatcher") -> None:
+        """
+        Refresh watcher from a worker thread.
+        Safe to call while dispatching, observer thread holds the observer lock that scheduling takes.
+        """
+        with self._lock:
+            if watcher not in self._to_refresh:
+                self._to_refresh.append(watcher)
+            if self._refresh_thread:
+                return
+            self._refresh_thread = Thread(target=self._refresh_worker, daemon=True)
+            self._refresh_thread.start()
+
+    def _refresh_worker(self) -> None:
+        while True:
+            with self._lock:
+                if not self._to_refresh:
+                    self._refresh_thread = None
+                    return
+                watchers = [w for w in self._to_refresh if w in self._watchers]
+                self._to_refresh.clear()
+
+            for w in watchers:
+                self.refresh(w)
+
+    def refresh(self, watcher: "FilesWatcher") -> None:
+        """
+        Reschedule the root covering watcher, e.g. when its exclusion rules changed.
+        """
+        with self._sync_lock:
+            for p, (recursive, _) in list(self._watches.items()):
+                if p == watcher.root or p in watcher.root.parents:
+                    self._unschedule(p)
+                    self._schedule(p, recursive)
+
+    def _get_watchers(self, event: FileSystemEvent) -> List["FilesWatcher"]:
+        from watchdog.utils import has_attribute, unicode_paths
+
+        paths = []
+        if has_attribute(event, "dest_path"):
+            paths.append(unicode_paths.decode(event.dest_path))
+        if event.src_path:
+            paths.append(unicode_paths.decode(event.src_path))
+
+        ret = []
+        with self._lock:
+            for p in paths:
+                for w in self._subscribers.get_along(Path(p)):
+                    if w not in ret:
+                        ret.append(w)
+        return ret
+
+    def dispatch(self, event: FileSystemEvent) -> None:
+        for w in self._get_watchers(event):
+            w.dispatch(event)
+
+    def flush(self, watcher: "FilesWatcher") -> None:
+        """
+        Drop queued events that would be routed to the watcher.
+        """
+        queue = self._observer.event_queue
+        with queue.mutex:
+            kept = [i for i in queue.queue if watcher not in self._get_watchers(i[0])]
+            queue.queue.clear()
+            queue.queue.extend(kept)
+
+
+@dataclass
+class FileChange:
+    path: Path
+    event_type: str
+
+
+class ChangeSet:
+    """
+    Deduplicated file changes collected during a debounce window, each path keeps its final event type.
+    """
+
+    changes: Dict[Path, FileChange]
+
+    def __init__(self) -> None:
+        self.changes = OrderedDict()
+
+    def _add(self, path: Path, event_type: str) -> None:
+        previous = self.changes.pop(path, None)
+
+        if previous and previous.event_type == EVENT_TYPE_CREATED:
+            # created and removed within the window - nothing changed from the outside
+            if event_type == EVENT_TYPE_DELETED:
+                return
+            event_type = EVENT_TYPE_CREATED
+
+        self.changes[path] = FileChange(path=path, event_type=event_type)
+
+    def add(self, event: FileSystemEvent) -> None:
+        from watchdog.utils import unicode_paths
+
+        if event.is_directory:
+            return
+
+        src_path = Path(unicode_paths.decode(event.src_path))
+        if event.event_type == EVENT_TYPE_MOVED:
+            # editors save by moving a temporary file over the original
+            self._add(src_path, EVENT_TYPE_DELETED)
+            self._add(Path(unicode_paths.decode(event.dest_path)), EVENT_TYPE_CREATED)
+        else:
+            self._add(src_path, event.event_type)
+
+    def discard(self, path: Path) -> None:
+        self.changes.pop(path, None)
+
+    @property
+    def paths(self) -> List[Path]:
+        return list(self.changes.keys())
+
+    @property
+    def existing_paths(self) -> List[Path]:
+        return [c.path for c in self.changes.values() if c.event_type != EVENT_TYPE_DELETED]
+
+    def __iter__(self) -> Iterator[FileChange]:
+        return iter(list(self.changes.values()))
+
+    def __len__(self) -> int:
+        return len(self.changes)
+
+    def __repr__(self) -> str:
+        return f"ChangeSet({', '.join(f'{c.event_type}: {c.path}' for c in self)})"
+
+
+class FileFingerprints:
+    """
+    Content fingerprints of files used to tell real changes from touches and identical rewrites.
+
+    Size and mtime are compared first, content is hashed only when they differ.
+    """
+
+    _chunk_size = 1024 * 1024
+
+    def __init__(self) -> None:
+        self._index: Dict[Path, Tuple[int, int, bytes]] = {}
+        self._lock = Lock()
+
+    def _hash(self, path: Path) -> bytes:
+        h = hashlib.blake2b(digest_size=16)
+        with path.open("rb") as f:
+            for chunk in iter(lambda: f.read(self._chunk_size), b""):
+                h.update(chunk)
+        return h.digest()
+
+    def add(self, path: Path) -> None:
+        self.update(path)
+
+    def update(self, path: Path) -> bool:
+        """
+        Refresh fingerprint of the file, return True if its content changed.
+        """
+        try:
+            st = path.stat()
+            with self._lock:
+                old = self._index.get(path)
+            if old and old[:2] == (st.st_mtime_ns, st.st_size):
+                return False
+
+            digest = self._hash(path)
+        except OSError:
+            # gone or unreadable, let the change through
+            self.remove(path)
+            return True
+
+        with self._lock:
+            self._index[path] = (st.st_mtime_ns, st.st_size, digest)
+
+        return not old or old[2] != digest
+
+    def remove(self, path: Path) -> None:
+        with self._lock:
+            self._index.pop(path, None)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+@dataclass
+class WatchDir:
+    path: Path
+    recursive: bool = True
+
+
+def get_watch_dirs(root: Path, patterns: List[str]) -> List[WatchDir]:
+    """
+    Return directories that need to be watched to catch files matching glob patterns relative to root.
+
+    Patterns with wildcards only in the file name need a flat watch on their directory,
+    recursion is used only for patterns with wildcards in directory parts.
+    """
+    dirs: Dict[Path, bool] = OrderedDict()
+
+    for p in patterns:
+        parts = p.lstrip("./").split("/")
+        static = []
+        for part in parts[:-1]:
+            if re.search(r"[*?\[]", part):
+                break
+            static.append(part)
+
+        path = root.joinpath(*static)
+        recursive = len(static) < len(parts) - 1
+        dirs[path] = dirs.get(path, False) or recursive
+
+    return [WatchDir(path, recursive) for path, recursive in dirs.items()]
+
+
 class FilesWatcher(FileSystemEventHandler):
     @dataclass
     class Sets:
@@ -67,17 +966,31 @@ class FilesWatcher(FileSystemEventHandler):
         exclude: List[str]
         root: Path
         name: str = "Anonymous"
+        debounce: float = 0.0  # s, 0 delivers every event separately
+        backend: str = "native"
+        suppress_unchanged: bool = True
+        use_ignore_files: bool = False  # honour .gitignore and .ignore files
+        # directories to watch, whole root recursively by default
+        watch_dirs: Optional[List[WatchDir]] = None
 
     @dataclass
     class Callbacks:
-        on_event: Callback
+        on_changes: Callback
 
     def __init__(self, se: Sets, calls: Callbacks):
         from envo import logger
 
+        if se.backend not in WATCHER_BACKENDS:
+            raise EnvoError(
+                f'Unknown watcher backend "{se.backend}", should be one of {WATCHER_BACKENDS}'
+            )
+
         self.include = [p.lstrip("./") for p in se.include]
         self.exclude = [p.lstrip("./") for p in se.exclude]
-        self.root = se.root
+        self.root = se.root.absolute()
+        self.matcher = GlobMatcher(self.include, self.exclude)
+        self.ignore_rules = IgnoreRules(self.root) if se.use_ignore_files else None
+        self._root_prefix = os.path.join(str(self.root), "")
 
         super().__init__()
         self.se = se
@@ -87,66 +1000,150 @@ class FilesWatcher(FileSystemEventHandler):
             f"{self.se.name} Inotify", descriptor=f"{self.se.name} Inotify"
         )
 
-        self.logger.debug("Starting Inotify")
-        self.observer = Observer()
+        self._pending = ChangeSet()
+        self._pending_lock = Lock()
+        self._deliver_lock = Lock()
+        self._last_event_time = 0.0
+        self._timer: Optional[Timer] = None
 
-        self.observer.schedule(self, str(self.se.root), recursive=True)
+        self._fingerprints = FileFingerprints()
+        self.suppressed_n = 0
+        self.watches_n = 0
 
     def on_any_event(self, event: FileModifiedEvent):
-        self.calls.on_event(event)
+        if not self.se.debounce:
+            changes = ChangeSet()
+            changes.add(event)
+            self._deliver(changes)
+            return
 
-    def flush(self) -> None:
-        self.observer.event_queue.queue.clear()
+        with self._pending_lock:
+            self._pending.add(event)
+            self._last_event_time = monotonic()
+            if not self._timer:
+                self._start_timer(self.se.debounce)
+
+    def _start_timer(self, delay: float) -> None:
+        self._timer = Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self) -> None:
+        with self._pending_lock:
+            # events keep coming, wait until it's quiet for the whole window
+            remaining = self._last_event_time + self.se.debounce - monotonic()
+            if remaining > 0:
+                self._start_timer(remaining)
+                return
+
+            self._timer = None
+            changes = self._pending
+            self._pending = ChangeSet()
+
+        self._deliver(changes)
+
+    def _suppress_unchanged(self, changes: ChangeSet) -> None:
+        for c in changes:
+            if not self.match(c.path):
+                continue
+
+            if c.event_type == EVENT_TYPE_DELETED:
+                self._fingerprints.remove(c.path)
+                continue
+
+            if not self._fingerprints.update(c.path):
+                changes.discard(c.path)
+                self.suppressed_n += 1
+                self.logger.debug(
+                    f"Suppressed unchanged {str(c.path)} ({self.suppressed_n} so far)",
+                    metadata={"type": "suppressed", "path": str(c.path), "suppressed_n": self.suppressed_n},
+                )
+
+    def _deliver(self, changes: ChangeSet) -> None:
+        if self.se.suppress_unchanged:
+            self._suppress_unchanged(changes)
+
+        if not changes:
+            return
 
-    def match(self, path: str, include: List[str], exclude: List[str]) -> bool:
-        return not glob_match(path, exclude) and glob_match(path, include)
+        with self._deliver_lock:
+            self.calls.on_changes(changes)
 
-    def walk_dirs(self, on_match: Callable) -> None:
-        def walk(path: Path):
-            for p in path.iterdir():
-                if glob_match(path, self.exclude):
-                    continue
-                on_match(str(p).encode("utf-8"))
-                if p.is_dir():
-                    walk(p)
+    def _cancel_pending(self) -> None:
+        with self._pending_lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            self._pending = ChangeSet()
 
-        walk(self.root)
+    def flush(self) -> None:
+        WatchManager.get().flush(self)
+        self._cancel_pending()
 
-    def start(self) -> None:
-        self.logger.debug("Starting observer")
+    def _get_relative(self, path: str) -> Optional[str]:
+        if not path.startswith(self._root_prefix):
+            return None
+        return path[len(self._root_prefix):]
+
+    def is_excluded(self, path: Union[str, Path]) -> bool:
+        relative = self._get_relative(str(path))
+        if relative is None:
+            return True
+        if self.matcher.is_excluded(relative):
+            return True
+        return bool(self.ignore_rules and self.ignore_rules.is_ignored(Path(path), True))
+
+    def match(self, path: Union[str, Path]) -> bool:
+        relative = self._get_relative(str(path))
+        if relative is None:
+            return False
+        if not self.matcher.match(relative):
+            return False
+        return not (self.ignore_rules and self.ignore_rules.is_ignored(Path(path), False))
 
-        if is_linux():
+    @property
+    def watch_dirs(self) -> List[WatchDir]:
+        if self.se.watch_dirs is None:
+            return [WatchDir(self.root)]
+        return [WatchDir(d.path.absolute(), d.recursive) for d in self.se.watch_dirs]
 
-            def _add_dir_watch(self2, path, recursive, mask):
-                """
-                Adds a watch (optionally recursively) for the given directory path
-                to monitor events specified by the mask.
+    def is_ignore_file(self, path: Union[str, Path]) -> bool:
+        return bool(self.ignore_rules) and IgnoreRules.is_ignore_file(Path(path))
 
-                :param path:
-                    Path to monitor
-                :param recursive:
-                    ``True`` to monitor recursively.
-                :param mask:
-                    Event bit mask.
-                """
-                if not os.path.isdir(path):
-                    raise OSError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
-                self2._add_watch(path, mask)
-                if recursive:
-                    self.walk_dirs(on_match=lambda p: self2._add_watch(p, mask))
+    def get_matching_files(self) -> List[Path]:
+        """
+        Return files under root that match, excluded directories are not descended into.
+        """
+        # ordered and deduplicated, watch dirs can overlap
+        ret: Dict[Path, None] = {}
 
-            from watchdog.observers.inotify_c import Inotify
+        for w in self.watch_dirs:
+            for dirpath, dirnames, filenames in os.walk(str(w.path)):
+                if not w.recursive:
+                    dirnames.clear()
+                dirnames[:] = [d for d in dirnames if not self.is_excluded(Path(dirpath) / d)]
+                for f in filenames:
+                    path = Path(dirpath) / f
+                    if self.match(path):
+                        ret[path] = None
 
-            Inotify._add_dir_watch = _add_dir_watch
+        return list(ret)
 
-        self.observer.start()
-        self.logger.debug("Observer started")
+    def start(self) -> None:
+        self.logger.debug("Starting watcher")
+        if self.se.suppress_unchanged:
+            for p in self.get_matching_files():
+                self._fingerprints.add(p)
+
+        WatchManager.get().subscribe(self)
+        self.logger.debug("Watcher started")
 
     def clone(self) -> "FilesWatcher":
         return FilesWatcher(se=self.se, calls=self.calls)
 
     def stop(self) -> None:
-        self.observer.stop()
+        WatchManager.get().unsubscribe(self)
+        self._cancel_pending()
 
     def dispatch(self, event: FileModifiedEvent):
         """Dispatches events to the appropriate methods.
@@ -164,14 +1161,14 @@ class FilesWatcher(FileSystemEventHandler):
         if event.src_path:
             paths.append(unicode_paths.decode(event.src_path))
 
-        if any(
-            self.match(
-                str(Path(p).relative_to(self.root)),
-                include=self.include,
-                exclude=self.exclude,
-            )
-            for p in paths
-        ):
+        ignore_files = [p for p in paths if self.is_ignore_file(p)]
+        if ignore_files:
+            for p in ignore_files:
+                self.logger.debug(f"Reloading ignore rules from {p}")
+                self.ignore_rules.reload(Path(p))
+            WatchManager.get().request_refresh(self)
+
+        if any(self.match(p) for p in paths):
             super().dispatch(event)
 
 
@@ -226,9 +1223,107 @@ def path_to_module_name(path: Path, package_root: Path) -> str:
     return ret
 
 
+class BytecodeCache:
+    """
+    Content hash keyed bytecode cache for files executed by import_from_file(_raw).
+
+    Code is kept in memory and in hash based pyc files (~/.envo/bytecode) so files that didn't change
+    are not recompiled on reloads and restarts, regardless of their mtime.
+    """
+
+    _instance: Optional["BytecodeCache"] = None
+    _instance_lock = Lock()
+
+    # PEP 552 flags: hash based, checked
+    _flags = 0b11
+
+    def __init__(self, directory: Optional[Path] = None) -> None:
+        self.directory = directory or Path.home() / ".envo/bytecode"
+        self._lock = Lock()
+        self._codes: Dict[str, Tuple[bytes, CodeType]] = {}  # path -> (source hash, code)
+
+        self.hits_n = 0
+        self.compiled_n = 0
+
+    @classmethod
+    def get(cls) -> "BytecodeCache":
+        with cls._instance_lock:
+            if not cls._instance:
+                cls._instance = cls()
+            return cls._instance
+
+    def _get_cache_file(self, path: str) -> Path:
+        # code objects embed their file name so the cache is per path
+        name = hashlib.blake2b(path.encode("utf-8"), digest_size=16).hexdigest()
+        return self.directory / f"{name}.pyc"
+
+    def _load(self, path: str, source_hash: bytes) -> Optional[CodeType]:
+        try:
+            data = self._get_cache_file(path).read_bytes()
+        except OSError:
+            return None
+
+        header = importlib.util.MAGIC_NUMBER + self._flags.to_bytes(4, "little") + source_hash
+        if not data.startswith(header):
+            return None
+
+        try:
+            code = marshal.loads(data[len(header):])
+        except (EOFError, ValueError, TypeError):
+            return None
+
+        return code if isinstance(code, CodeType) else None
+
+    def _save(self, path: str, source_hash: bytes, code: CodeType) -> None:
+        cache_file = self._get_cache_file(path)
+        data = importlib.util.MAGIC_NUMBER + self._flags.to_bytes(4, "little") + source_hash + marshal.dumps(code)
+
+        tmp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_file.write_bytes(data)
+            os.replace(str(tmp_file), str(cache_file))
+        except OSError:
+            # cache is an optimisation only
+            try:
+                tmp_file.unlink()
+            except OSError:
+                pass
+
+    def get_code(self, path: str, source: bytes) -> CodeType:
+        source_hash = importlib.util.source_hash(source)
+
+        with self._lock:
+            cached = self._codes.get(path)
+        if cached and cached[0] == source_hash:
+            self.hits_n += 1
+            return cached[1]
+
+        code = self._load(path, source_hash)
+        if code:
+            self.hits_n += 1
+        else:
+            code = compile(source, path, "exec", dont_inherit=True)
+            self.compiled_n += 1
+            self._save(path, source_hash, code)
+
+        with self._lock:
+            self._codes[path] = (source_hash, code)
+
+        return code
+
+
+class CachedSourceLoader(importlib.machinery.SourceFileLoader):
+    def get_code(self, fullname: str) -> CodeType:
+        path = self.get_filename(fullname)
+        return BytecodeCache.get().get_code(path, self.get_data(path))
+
+
 def import_from_file(path: Path, package_root: Path) -> Any:
     module_name = path_to_module_name(path, package_root)
-    spec = importlib.util.spec_from_file_location(module_name, str(path.absolute()))
+    spec = importlib.util.spec_from_file_location(
+        module_name, str(path.absolute()), loader=CachedSourceLoader(module_name, str(path.absolute()))
+    )
 
     module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(module)
@@ -247,8 +1342,105 @@ def get_module_from_full_name(full_name: str) -> Optional[str]:
             return None
 
 
+class ModuleIndex:
+    """
+    Maps real paths of source files to loaded modules.
+
+    Synced with sys.modules incrementally (only added, removed and replaced modules are processed)
+    so lookups for events are O(1) and symlinked paths resolve to the same module.
+    Missed lookups (files that aren't imported) resync only when sys.modules changed since the last sync.
+    """
+
+    _instance: Optional["ModuleIndex"] = None
+    _instance_lock = Lock()
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._names: Dict[str, Tuple[Optional[str], Any]] = {}  # name -> (realpath, module)
+        self._paths: Dict[str, str] = {}  # realpath -> name
+        self._synced: Dict[str, Any] = {}  # copy of sys.modules at the last sync
+
+    @classmethod
+    def get(cls) -> "ModuleIndex":
+        with cls._instance_lock:
+            if not cls._instance:
+                cls._instance = cls()
+            return cls._instance
+
+    @classmethod
+    def _get_realpath(cls, module: Any) -> Optional[str]:
+        file = getattr(module, "__file__", None)
+        if not isinstance(file, str):
+            return None
+        return os.path.realpath(file)
+
+    def sync(self) -> None:
+        with self._lock:
+            modules = dict(sys.modules)
+            self._synced = modules
+
+            for name in self._names.keys() - modules.keys():
+                path, _ = self._names.pop(name)
+                if path and self._paths.get(path) == name:
+                    self._paths.pop(path)
+
+            for name, module in modules.items():
+                indexed = self._names.get(name)
+                if indexed and indexed[1] is module:
+                    continue
+
+                path = self._get_realpath(module)
+                self._names[name] = (path, module)
+                if path:
+                    # the latest loaded module wins
+                    self._paths[path] = name
+
+    def _lookup(self, path: str) -> Optional[Any]:
+        with self._lock:
+            name = self._paths.get(path)
+            if not name:
+                return None
+
+            module = sys.modules.get(name)
+            if module is None:
+                return None
+
+            if self._names[name][1] is not module:
+                # replaced in sys.modules (e.g. reloaded), same name keeps the same slot
+                if self._get_realpath(module) != path:
+                    return None
+                self._names[name] = (path, module)
+
+            return module
+
+    def get_module(self, path: Path) -> Optional[Any]:
+        realpath = os.path.realpath(str(path))
+        module = self._lookup(realpath)
+        if module:
+            return module
+
+        # misses stay misses until something is imported, removed or replaced, modules compare by identity
+        if sys.modules == self._synced:
+            return None
+
+        self.sync()
+        return self._lookup(realpath)
+
+    def get_modules(self, root: Path) -> Dict[Path, Any]:
+        """
+        Return loaded modules with source files under root.
+        """
+        self.sync()
+        prefix = os.path.join(os.path.realpath(str(root)), "")
+
+        with self._lock:
+            return {
+                Path(p): self._names[n][1] for p, n in self._paths.items() if p.startswith(prefix)
+            }
+
+
 def import_from_file_raw(path: Path) -> Any:
-    loader = importlib.machinery.SourceFileLoader(str(path), str(path))
+    loader = CachedSourceLoader(str(path), str(path))
     spec = importlib.util.spec_from_loader(loader.name, loader)
     module = importlib.util.module_from_spec(spec)
     loader.exec_module(module)
@@ -1,13 +1,20 @@
+import ast
+import dis
+import hashlib
 import inspect
+import marshal
 import os
 import sys
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
 from copy import copy
-from types import ModuleType
+from types import CodeType, FunctionType, ModuleType
 
 from dataclasses import dataclass, field
 from pathlib import Path
 from textwrap import dedent
-from typing import Any, Dict, List, Optional, Type, Set
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Type, Set, Union
 
 from envo import dependency_watcher
 from envo.misc import import_from_file
@@ -15,14 +22,153 @@ from envo.misc import import_from_file
 
 dataclass = dataclass(repr=False)
 
+_missing = object()
+
+
+class RollbackError(Exception):
+    """
+    Applied actions couldn't be undone, module state is inconsistent.
+    """
+
+
+class IncompatibleChange(Exception):
+    """
+    Change can't be applied to live objects (e.g. class bases or layout), needs a restart.
+    """
+
+
+class ReloadCancelled(Exception):
+    """
+    Reloaded sources changed again before the transaction finished.
+    """
+
+
+def _make_cell(value: Any) -> Any:
+    return (lambda: value).__closure__[0]
+
+
+def rebind(func: FunctionType, module_globals: Dict[str, Any], cls: Optional[type] = None) -> FunctionType:
+    """
+    Return copy of function using live module globals.
+
+    If cls is given `__class__` cell (zero argument super()) points to it.
+    """
+    closure = func.__closure__
+    if cls is not None and closure and "__class__" in func.__code__.co_freevars:
+        cells = list(closure)
+        cells[func.__code__.co_freevars.index("__class__")] = _make_cell(cls)
+        closure = tuple(cells)
+
+    ret = FunctionType(func.__code__, module_globals, func.__name__, func.__defaults__, closure)
+    ret.__kwdefaults__ = func.__kwdefaults__
+    ret.__qualname__ = func.__qualname__
+    ret.__doc__ = func.__doc__
+    ret.__annotations__ = func.__annotations__
+    ret.__dict__.update(func.__dict__)
+    return ret
+
+
+_nop = dis.opmap.get("NOP")
+
+
+def get_code_fingerprint(code: CodeType, lines: bool = False) -> bytes:
+    """
+    Hash of what code does. File names and line numbers are left out so moved or reformatted code hashes the same.
+    With lines the line table (relative to the first line) is included, reformatted code hashes differently.
+    """
+    consts = tuple(
+        get_code_fingerprint(c, lines) if isinstance(c, CodeType) else c for c in code.co_consts
+    )
+    # NOPs keep line numbers of wrapped expressions, instructions are two bytes long
+    instructions = code.co_code
+    instructions = b"".join(
+        instructions[i : i + 2] for i in range(0, len(instructions), 2) if instructions[i] != _nop
+    )
+    fields = (
+        instructions,
+        consts,
+        code.co_names,
+        code.co_varnames,
+        code.co_freevars,
+        code.co_cellvars,
+        code.co_argcount,
+        code.co_kwonlyargcount,
+        code.co_flags,
+    )
+    if lines:
+        fields += (getattr(code, "co_linetable", None) or code.co_lnotab,)
+    try:
+        dumped = marshal.dumps(fields)
+    except ValueError:
+        dumped = repr(fields).encode("utf-8")
+    return hashlib.blake2b(dumped, digest_size=16).digest()
+
+
+def rebind_obj(obj: Any, module_globals: Dict[str, Any], cls: Optional[type] = None) -> Any:
+    """
+    Rebind functions, static and class methods, leave other objects unchanged.
+    """
+    if isinstance(obj, FunctionType):
+        return rebind(obj, module_globals, cls)
+    if isinstance(obj, (staticmethod, classmethod)) and isinstance(obj.__func__, FunctionType):
+        return type(obj)(rebind(obj.__func__, module_globals, cls))
+    return obj
+
 
 @dataclass
 class Action:
     reloader: "PartialReloader"
+    # restore functions recorded while executing, run in reverse order by undo
+    _undo: List[Callable[[], None]] = field(init=False, default_factory=list, compare=False)
 
     def execute(self) -> None:
         pass
 
+    @property
+    def kind(self) -> str:
+        return self.__class__.__qualname__
+
+    def undo(self) -> None:
+        while self._undo:
+            self._undo.pop()()
+
+    def _set(self, container: Any, name: str, value: Any) -> None:
+        self._save(container, name)
+        if isinstance(container, dict):
+            container[name] = value
+        else:
+            setattr(container, name, value)
+
+    def _delete(self, container: Any, name: str) -> None:
+        self._save(container, name)
+        if isinstance(container, dict):
+            del container[name]
+        else:
+            delattr(container, name)
+
+    def _save(self, container: Any, name: str) -> None:
+        is_dict = isinstance(container, dict)
+        # own attributes only, inherited ones are restored by deleting the override
+        old = container.get(name, _missing) if is_dict else vars(container).get(name, _missing)
+
+        def restore() -> None:
+            if old is not _missing:
+                if is_dict:
+                    container[name] = old
+                else:
+                    setattr(container, name, old)
+            elif is_dict:
+                container.pop(name, None)
+            elif name in vars(container):
+                delattr(container, name)
+
+        self._undo.append(restore)
+
+    def _set_code(self, func: Any, code: Any) -> None:
+        old = func.__code__
+        self._undo.append(lambda: setattr(func, "__code__", old))
+        func.__code__ = code
+
     def __eq__(self, other: "Action") -> bool:
         raise NotImplementedError()
 
@@ -37,6 +183,10 @@ class Object:
         def __repr__(self) -> str:
             return f"Add: {repr(self.object)}"
 
+        @property
+        def kind(self) -> str:
+            return f"{self.object.__class__.__name__}.Add"
+
     @dataclass
     class Update(Action):
         parent: Optional["ContainerObj"]
@@ -46,6 +196,10 @@ class Object:
         def __repr__(self) -> str:
             return f"Update: {repr(self.old_object)}"
 
+        @property
+        def kind(self) -> str:
+            return f"{self.old_object.__class__.__name__}.Update"
+
     @dataclass
     class Delete(Action):
         parent: Optional["ContainerObj"]
@@ -54,8 +208,12 @@ class Object:
         def __repr__(self) -> str:
             return f"Delete: {repr(self.object)}"
 
+        @property
+        def kind(self) -> str:
+            return f"{self.object.__class__.__name__}.Delete"
+
         def execute(self) -> None:
-            delattr(self.parent.python_obj, self.object.name)
+            self._delete(self.parent.python_obj, self.object.name)
 
     python_obj: Any
     reloader: "PartialReloader"
@@ -144,20 +302,31 @@ class FinalObj(Object):
 
 @dataclass
 class Function(FinalObj):
+    _fingerprint: Optional[bytes] = field(init=False, default=None)
+
     class Add(FinalObj.Add):
         object: "Function"
 
         def execute(self) -> None:
-            setattr(self.parent.python_obj, self.object.name, self.object.python_obj)
+            parent = self.parent.python_obj
+            new_obj = rebind_obj(
+                self.object.python_obj,
+                self.reloader.module_obj.__dict__,
+                cls=parent if inspect.isclass(parent) else None,
+            )
+            self._set(parent, self.object.name, new_obj)
+            # keeps cached tree pointing to the live object
+            self.object.python_obj = new_obj
 
     class Update(FinalObj.Update):
         old_object: "Function"
         new_object: Optional["Function"]
 
         def execute(self) -> None:
-            self.old_object.get_func(
-                self.old_object.python_obj
-            ).__code__ = self.new_object.get_func(self.new_object.python_obj).__code__
+            self._set_code(
+                self.old_object.get_func(self.old_object.python_obj),
+                self.new_object.get_func(self.new_object.python_obj).__code__,
+            )
 
     def get_actions_for_update(
         self, new_object: "Function", ignore_objects: Optional[List[Object]] = None
@@ -180,32 +349,25 @@ class Function(FinalObj):
     ) -> List["Action"]:
         return [cls.Add(reloader=reloader, parent=parent, object=obj)]
 
+    @property
+    def fingerprint(self) -> bytes:
+        """
+        Code fingerprint, computed once per code object.
+        Includes the line table, reformatted code is swapped in too so tracebacks point at the right lines.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = get_code_fingerprint(self.get_func(self.python_obj).__code__, lines=True)
+
+        return self._fingerprint
+
+    def refresh(self) -> None:
+        self._fingerprint = None
+
     def __eq__(self, other: "Function") -> bool:
         if self.python_obj.__class__ is not other.python_obj.__class__:
             return False
 
-        compare_fields = [
-            "co_argcount",
-            "co_cellvars",
-            "co_code",
-            "co_consts",
-            "co_flags",
-            "co_freevars",
-            "co_lnotab",
-            "co_name",
-            "co_names",
-            "co_nlocals",
-            "co_stacksize",
-            "co_varnames",
-        ]
-
-        for f in compare_fields:
-            if getattr(self.get_func(self.python_obj).__code__, f) != getattr(
-                self.get_func(other.python_obj).__code__, f
-            ):
-                return False
-
-        return True
+        return self.fingerprint == other.fingerprint
 
     def __ne__(self, other: "Function") -> bool:
         return not (Function.__eq__(self, other))
@@ -243,6 +405,85 @@ class Method(Function):
         return obj.__func__
 
 
+@dataclass
+class Property(FinalObj):
+    accessors = ["fget", "fset", "fdel"]
+
+    class Add(FinalObj.Add):
+        def execute(self) -> None:
+            self.object.python_obj = self.object.rebound(self.parent.python_obj)
+            self._set(self.parent.python_obj, self.object.name, self.object.python_obj)
+
+    class Update(FinalObj.Update):
+        old_object: "Property"
+        new_object: Optional["Property"]
+
+        def execute(self) -> None:
+            old = self.old_object.python_obj
+            new = self.new_object.python_obj
+            cls = self.old_object.parent.python_obj
+
+            pairs = [(getattr(old, a), getattr(new, a)) for a in Property.accessors]
+            in_place = all(
+                (o is None) == (n is None)
+                and (o is None or isinstance(o, FunctionType) and isinstance(n, FunctionType)
+                     and o.__code__.co_freevars == n.__code__.co_freevars)
+                for o, n in pairs
+            )
+            if not in_place:
+                self._set(cls, self.old_object.name, self.new_object.rebound(cls))
+                return
+
+            # existing property object is kept, references to it stay valid
+            for o, n in pairs:
+                if o is not None:
+                    self._set_code(o, n.__code__)
+
+    def get_actions_for_update(self, new_object: "Property") -> List["Action"]:
+        if self == new_object:
+            return []
+
+        return [
+            self.Update(
+                reloader=self.reloader,
+                parent=self.parent,
+                old_object=self,
+                new_object=new_object,
+            )
+        ]
+
+    @classmethod
+    def get_actions_for_add(
+        cls, reloader: "PartialReloader", parent: "ContainerObj", obj: "Object"
+    ) -> List["Action"]:
+        return [cls.Add(reloader=reloader, parent=parent, object=obj)]
+
+    def rebound(self, cls: type) -> property:
+        module_globals = self.reloader.module_obj.__dict__
+        funcs = [rebind_obj(getattr(self.python_obj, a), module_globals, cls) for a in self.accessors]
+        return type(self.python_obj)(*funcs, self.python_obj.__doc__)
+
+    @property
+    def fingerprint(self) -> Tuple[Any, ...]:
+        ret = []
+        for a in self.accessors:
+            f = getattr(self.python_obj, a)
+            if isinstance(f, FunctionType):
+                ret.append(Function(f, reloader=self.reloader).fingerprint)
+            else:
+                ret.append(f)
+        return tuple(ret)
+
+    def __eq__(self, other: "Property") -> bool:
+        if self.python_obj.__class__ is not other.python_obj.__class__:
+            return False
+
+        return self.fingerprint == other.fingerprint
+
+    def __ne__(self, other: "Property") -> bool:
+        return not (Property.__eq__(self, other))
+
+
 @dataclass
 class ContainerObj(Object):
     children: Dict[str, "Object"] = field(init=False, default_factory=dict)
@@ -267,8 +508,14 @@ class ContainerObj(Object):
                     if not module_name.endswith(self.module.name):
                         continue
 
+                # slots, handled with the class layout
+                if inspect.ismemberdescriptor(o) or inspect.isgetsetdescriptor(o):
+                    continue
+
                 obj_class: Type[Object]
-                if inspect.ismethod(o) or inspect.ismethoddescriptor(o):
+                if isinstance(o, property):
+                    obj_class = Property
+                elif inspect.ismethod(o) or inspect.ismethoddescriptor(o):
                     obj_class = Method
                 elif inspect.isfunction(o):
                     obj_class = Function
@@ -299,6 +546,12 @@ class ContainerObj(Object):
 
         return ret
 
+    @classmethod
+    def get_actions_for_add(
+        cls, reloader: "PartialReloader", parent: "ContainerObj", obj: "Object"
+    ) -> List["Action"]:
+        return [cls.Add(reloader=reloader, parent=parent, object=obj)]
+
     def get_functions(self) -> List[Function]:
         ret = [o for o in self.children if isinstance(o, Function)]
         return ret
@@ -318,21 +571,63 @@ class ContainerObj(Object):
 
 @dataclass
 class Class(ContainerObj):
+    """
+    Classes are patched in place (methods, properties and attributes are children) so existing instances
+    keep working. Changes to bases, metaclass or __slots__ can't be applied to live instances.
+    """
+
+    class Add(ContainerObj.Add):
+        def execute(self) -> None:
+            cls = self.object.python_obj
+            # class is new, its methods should use live module globals
+            for n, o in list(vars(cls).items()):
+                rebound = rebind_obj(o, self.reloader.module_obj.__dict__, cls)
+                if rebound is not o:
+                    setattr(cls, n, rebound)
+                    if n in self.object.children:
+                        self.object.children[n].python_obj = rebound
+
+            self._set(self.parent.python_obj, self.object.name, cls)
+
     def get_actions_for_update(
         self, new_object: "Class"
     ) -> List["Action"]:
+        if self.layout != new_object.layout:
+            raise IncompatibleChange(f"Bases, metaclass or __slots__ of {self.full_name} changed")
+
         return []
 
+    @property
+    def layout(self) -> Tuple[Any, ...]:
+        cls = self.python_obj
+        slots = cls.__dict__.get("__slots__")
+        if isinstance(slots, str):
+            slots = [slots]
+
+        # compared by name, base classes from the reloaded module are new objects
+        return (
+            type(cls).__qualname__,
+            tuple(b.__qualname__ for b in cls.__bases__),
+            tuple(slots) if slots is not None else None,
+        )
+
     def get_dict(self) -> Dict[str, Any]:
         ret = self.python_obj.__dict__
         return ret
 
+    def _is_ignored(self, name: str) -> bool:
+        if super()._is_ignored(name):
+            return True
+
+        # part of the layout or regenerated for every class object
+        return name in ["__slots__", "__orig_bases__", "__parameters__", "_abc_impl", "__dataclass_params__"]
+
 
 @dataclass
 class Dictionary(ContainerObj):
     class Add(ContainerObj.Add):
         def execute(self) -> None:
-            setattr(self.parent.python_obj, self.object.name, self.object)
+            self._set(self.parent.python_obj, self.object.name, self.object.python_obj)
 
     def get_actions_for_update(
         self, new_object: "Class"
@@ -347,11 +642,11 @@ class Dictionary(ContainerObj):
 class Variable(FinalObj):
     class Add(FinalObj.Add):
         def execute(self) -> None:
-            setattr(self.parent.python_obj, self.object.name, self.object.python_obj)
+            self._set(self.parent.python_obj, self.object.name, self.object.python_obj)
 
     class Update(FinalObj.Update):
         def execute(self) -> None:
-            setattr(
+            self._set(
                 self.old_object.parent.python_obj,
                 self.old_object.name,
                 self.new_object.python_obj,
@@ -372,9 +667,7 @@ class Variable(FinalObj):
             )
         ]
 
-        for m in self.reloader.get_dependent_modules():
-            module = Module(m, reloader=self.reloader)
-            ret.extend(module.get_actions_for_update())
+        ret.extend(self.reloader.get_dependents_update_actions())
 
         return ret
 
@@ -389,13 +682,15 @@ class Variable(FinalObj):
 class DictionaryItem(FinalObj):
     class Add(FinalObj.Add):
         def execute(self) -> None:
-            self.parent.python_obj[self.object.name] = copy(self.object.python_obj)
+            self._set(self.parent.python_obj, self.object.name, copy(self.object.python_obj))
 
     class Update(FinalObj.Update):
         def execute(self) -> None:
-            self.old_object.parent.python_obj[
-                self.new_object.name
-            ] = self.new_object.python_obj
+            self._set(
+                self.old_object.parent.python_obj,
+                self.new_object.name,
+                self.new_object.python_obj,
+            )
 
     def get_actions_for_update(
         self, new_object: "Variable"
@@ -421,7 +716,7 @@ class Import(FinalObj):
     class Add(FinalObj.Add):
         def execute(self) -> None:
             module = sys.modules.get(self.object.name, self.object.python_obj)
-            setattr(self.parent.python_obj, self.object.name, module)
+            self._set(self.parent.python_obj, self.object.name, module)
 
     def get_actions_for_update(
         self, new_object: "Variable"
@@ -442,8 +737,8 @@ class Module(ContainerObj):
         module: "Module"
 
         def execute(self) -> None:
-            reloader = PartialReloader(self.module.python_obj, self.reloader.root)
-            reloader.run()
+            # dependents are reloaded by the transaction, once and after all their changed imports
+            self.reloader.transaction.schedule(self.module.python_obj)
 
         def __repr__(self) -> str:
             return f"Update: {repr(self.module)}"
@@ -495,6 +790,9 @@ class Module(ContainerObj):
         new_objects_names = b.keys() - a.keys()
         new_objects = {n: b[n] for n in new_objects_names}
         for o in new_objects.values():
+            # added with its parent
+            if o.parent.full_name not in a:
+                continue
             parent = a[o.parent.full_name]
             ret.extend(
                 o.get_actions_for_add(reloader=self.reloader, parent=parent, obj=o)
@@ -503,6 +801,9 @@ class Module(ContainerObj):
         deleted_objects_names = a.keys() - b.keys()
         deleted_objects = {n: a[n] for n in deleted_objects_names}
         for o in deleted_objects.values():
+            # deleted with its parent
+            if o.parent.full_name in deleted_objects:
+                continue
             parent = a[o.parent.full_name]
             ret.extend(
                 o.get_actions_for_delete(reloader=self.reloader, parent=parent, obj=o)
@@ -524,12 +825,89 @@ class Module(ContainerObj):
         return f"Module: {self.python_obj.__name__}"
 
 
+FunctionNode = Union[ast.FunctionDef, ast.AsyncFunctionDef]
+
+
+def is_method(obj: Any) -> bool:
+    return isinstance(obj, (staticmethod, classmethod))
+
+
+def get_function_class(obj: Any) -> Type[Function]:
+    return Method if is_method(obj) else Function
+
+
+@dataclass
+class SourceSnapshot:
+    """
+    Fingerprints of module definitions, used to find out what changed since the last reload.
+
+    Everything that is not a function definition (assignments, imports, calls, class bases and decorators)
+    is folded into headers of the module and classes - changes there mean side effects.
+    Fingerprints are hashes of source segments so moving code around doesn't count as a change.
+    """
+
+    header: bytes
+    class_headers: Dict[str, bytes]
+    functions: Dict[str, bytes]
+    nodes: Dict[str, FunctionNode]
+
+    @classmethod
+    def from_source(cls, source: str, filename: str) -> "SourceSnapshot":
+        tree = ast.parse(source, filename)
+        snapshot = cls(header=b"", class_headers={}, functions={}, nodes={})
+        snapshot.header = snapshot._collect(tree.body, source.splitlines(), prefix="")
+        return snapshot
+
+    @classmethod
+    def _get_segment(cls, node: ast.stmt, lines: List[str]) -> str:
+        decorators = getattr(node, "decorator_list", [])
+        start = min([node.lineno] + [d.lineno for d in decorators])
+        return "\n".join(lines[start - 1 : node.end_lineno])
+
+    @classmethod
+    def _fingerprint(cls, segments: List[str]) -> bytes:
+        return hashlib.blake2b("\n".join(segments).encode("utf-8"), digest_size=16).digest()
+
+    def _collect(self, body: List[ast.stmt], lines: List[str], prefix: str) -> bytes:
+        header = []
+        for n in body:
+            if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                self.functions[prefix + n.name] = self._fingerprint([self._get_segment(n, lines)])
+                self.nodes[prefix + n.name] = n
+            elif isinstance(n, ast.ClassDef):
+                name = prefix + n.name
+                # class line(s) up to the first statement: decorators, bases and keywords
+                class_header = self._get_segment(n, lines[: n.body[0].lineno - 1])
+                self.class_headers[name] = self._fingerprint(
+                    [class_header, self._collect(n.body, lines, prefix=f"{name}.").hex()]
+                )
+                header.append(f"class {n.name}")
+            else:
+                header.append(self._get_segment(n, lines))
+
+        return self._fingerprint(header)
+
+
 class PartialReloader:
     module_obj: Any
 
-    def __init__(self, module_obj: Any, root: Path) -> None:
+    # last reloaded version of each module, keyed by file
+    _snapshots: Dict[str, Tuple[Any, SourceSnapshot]] = {}
+    # object trees of live modules, kept in sync with applied actions
+    _trees: Dict[str, Tuple[Any, Module]] = {}
+
+    def __init__(self, module_obj: Any, root: Path, incremental: bool = True) -> None:
         self.root = root
         self.module_obj = module_obj
+        self.incremental = incremental
+        self.transaction: Optional["ReloadTransaction"] = None
+        self.actions: List[Action] = []
+        # time spent in reload phases (parse, incremental, tree, exec, diff, apply)
+        self.timings: Dict[str, float] = defaultdict(float)
+        self.used_incremental = False
+
+        self._new_snapshot: Optional[SourceSnapshot] = None
+        self._dependents_updated = False
 
     def _is_user_module(self, module: Any):
         if not hasattr(module, "__file__"):
@@ -548,6 +926,21 @@ class PartialReloader:
         ret = [str(p) for p in self.module_dir.glob("**/*.py")]
         return ret
 
+    def get_dependents_update_actions(self) -> List[Action]:
+        """
+        Return actions reloading dependent modules, only for the first changed variable.
+        """
+        if self._dependents_updated:
+            return []
+
+        self._dependents_updated = True
+
+        ret = []
+        for m in self.get_dependent_modules():
+            module = Module(m, reloader=self)
+            ret.extend(module.get_actions_for_update())
+        return ret
+
     def get_dependent_modules(self) -> List[ModuleType]:
         module_names = dependency_watcher.get_dependencies(self.module_obj)
 
@@ -562,7 +955,52 @@ class PartialReloader:
 
     @property
     def old_module(self) -> Module:
-        return Module(self.module_obj, reloader=self, name=f"{self.module_obj.__name__}")
+        module, tree = self._trees.get(self.file, (None, None))
+        if module is self.module_obj:
+            # nodes were built by an earlier reloader, actions they create belong to this one and its transaction
+            if tree.reloader is not self:
+                for o in tree.flat.values():
+                    o.reloader = self
+            return tree
+
+        tree = Module(self.module_obj, reloader=self, name=f"{self.module_obj.__name__}")
+        self._trees[self.file] = (self.module_obj, tree)
+        return tree
+
+    def _update_tree(self, actions: List[Action]) -> None:
+        """
+        Reflect applied actions in the cached object tree so the next reload doesn't have to rebuild it.
+        """
+        module, tree = self._trees.get(self.file, (None, None))
+        if module is not self.module_obj:
+            return
+
+        flat = tree.flat
+        for a in actions:
+            if isinstance(a, Object.Update):
+                old = flat.get(a.old_object.full_name)
+                if isinstance(old, Function):
+                    # code was swapped in place
+                    old.refresh()
+                elif isinstance(old, Property):
+                    # swapped in place or replaced
+                    old.python_obj = vars(a.old_object.parent.python_obj)[old.name]
+                elif old:
+                    old.python_obj = a.new_object.python_obj
+            elif isinstance(a, Object.Add):
+                parent = flat.get(a.parent.full_name)
+                if not isinstance(parent, ContainerObj):
+                    self._trees.pop(self.file)
+                    return
+
+                a.object.parent = parent
+                for o in a.object.flat.values():
+                    o.module = tree
+                parent.children[a.object.name] = a.object
+            elif isinstance(a, Object.Delete):
+                parent = flat.get(a.parent.full_name)
+                if isinstance(parent, ContainerObj):
+                    parent.children.pop(a.object.name, None)
 
     @property
     def new_module(self) -> Module:
@@ -572,21 +1010,327 @@ class PartialReloader:
             name=f"{self.module_obj.__name__}",
         )
 
-    def get_actions(self) -> List[Action]:
-        old_module = self.old_module
-        new_module = self.new_module
+    @property
+    def file(self) -> str:
+        return self.module_obj.__file__
+
+    def _get_old_snapshot(self) -> Optional[SourceSnapshot]:
+        module, snapshot = self._snapshots.get(self.file, (None, None))
+        # module was replaced (e.g. reimported) since the snapshot was taken
+        if module is not self.module_obj:
+            return None
+        return snapshot
+
+    def _compile_function(self, name: str, node: FunctionNode) -> Any:
+        """
+        Compile a single function definition in module's namespace without executing the module.
+        """
+        *class_path, func_name = name.split(".")
+        stmt: ast.stmt = node
+        if class_path:
+            # compile in a class body so methods get __class__ cell (zero argument super())
+            stmt = ast.copy_location(
+                ast.ClassDef(name=class_path[-1], bases=[], keywords=[], body=[node], decorator_list=[]),
+                node,
+            )
+
+        module = ast.Module(body=[stmt], type_ignores=[])
+        ast.fix_missing_locations(module)
+        code = compile(module, self.file, "exec")
 
-        ret = old_module.get_actions(new_module)
+        namespace: Dict[str, Any] = {}
+        exec(code, self.module_obj.__dict__, namespace)
+
+        if class_path:
+            ret = namespace[class_path[-1]].__dict__[func_name]
+        else:
+            ret = namespace[func_name]
+
+        func = Method.get_func(ret) if is_method(ret) else ret
+        func.__qualname__ = name
+        return ret
+
+    def _get_incremental_actions(self, old: SourceSnapshot, new: SourceSnapshot) -> Optional[List[Action]]:
+        """
+        Return actions for changed functions only or None if a full diff is needed.
+        """
+        if old.header != new.header or old.class_headers != new.class_headers:
+            return None
+
+        def is_plain(node: FunctionNode, in_class: bool) -> bool:
+            allowed = ["staticmethod", "classmethod"] if in_class else []
+            return all(isinstance(d, ast.Name) and d.id in allowed for d in node.decorator_list)
+
+        def get_parent(name: str) -> Object:
+            parent = Object(self.module_obj, reloader=self, name=self.module_obj.__name__)
+            for n in name.split(".")[:-1]:
+                parent = Object(getattr(parent.python_obj, n), reloader=self, name=n, parent=parent)
+            return parent
+
+        ret: List[Action] = []
+        for name in sorted(old.functions.keys() | new.functions.keys()):
+            if old.functions.get(name) == new.functions.get(name):
+                continue
+
+            in_class = "." in name
+            for node in [old.nodes.get(name), new.nodes.get(name)]:
+                # decorators can register or wrap functions
+                if node and not is_plain(node, in_class):
+                    return None
+
+            try:
+                parent = get_parent(name)
+            except AttributeError:
+                return None
+
+            short_name = name.split(".")[-1]
+            old_obj = parent.python_obj.__dict__.get(short_name)
+
+            if name not in new.functions:
+                old_obj = get_function_class(old_obj)(old_obj, reloader=self, name=short_name, parent=parent)
+                ret.append(old_obj.Delete(reloader=self, parent=parent, object=old_obj))
+                continue
+
+            new_python_obj = self._compile_function(name, new.nodes[name])
+            new_obj = get_function_class(new_python_obj)(
+                new_python_obj, reloader=self, name=short_name, parent=parent
+            )
+
+            if name not in old.functions:
+                ret.append(new_obj.Add(reloader=self, parent=parent, object=new_obj))
+                continue
+
+            # might have been replaced at runtime by something that is not a function
+            if not inspect.isfunction(Method.get_func(old_obj) if is_method(old_obj) else old_obj):
+                return None
+            if get_function_class(old_obj) is not new_obj.__class__:
+                return None
+
+            old_obj = new_obj.__class__(old_obj, reloader=self, name=short_name, parent=parent)
+            old_code = old_obj.get_func(old_obj.python_obj).__code__
+            if old_code.co_freevars != new_obj.get_func(new_obj.python_obj).__code__.co_freevars:
+                return None
+
+            ret.append(new_obj.Update(reloader=self, parent=parent, old_object=old_obj, new_object=new_obj))
+
+        return ret
+
+    @contextmanager
+    def _timed(self, phase: str) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[phase] += perf_counter() - start
+
+    def get_actions(self) -> List[Action]:
+        self._dependents_updated = False
+        self.used_incremental = False
+
+        with self._timed("parse"):
+            self._new_snapshot = SourceSnapshot.from_source(Path(self.file).read_text("utf-8"), self.file)
+
+        if self.incremental:
+            old_snapshot = self._get_old_snapshot()
+            if old_snapshot:
+                with self._timed("incremental"):
+                    ret = self._get_incremental_actions(old_snapshot, self._new_snapshot)
+                if ret is not None:
+                    self.used_incremental = True
+                    return ret
+
+        with self._timed("tree"):
+            old_module = self.old_module
+        with self._timed("exec"):
+            new_module = self.new_module
+
+        with self._timed("diff"):
+            ret = old_module.get_actions(new_module)
         return ret
 
     def apply_actions(self, actions: List[Action]) -> None:
-        for a in actions:
-            a.execute()
+        """
+        Execute actions, on failure the already executed ones are undone before re-raising.
+        """
+        executed = []
+        try:
+            with self._timed("apply"):
+                for a in actions:
+                    executed.append(a)
+                    a.execute()
+        except BaseException as e:
+            self._undo(executed, e)
+            raise
+
+        self._update_tree(actions)
+        if not self.used_incremental:
+            # module level code was executed again, imports might have changed
+            dependency_watcher.rescan(self.module_obj)
+
+        if self._new_snapshot:
+            self._snapshots[self.file] = (self.module_obj, self._new_snapshot)
+
+    def _undo(self, actions: List[Action], error: BaseException) -> None:
+        # cached tree and snapshot describe the reloaded version
+        self._trees.pop(self.file, None)
+        self._snapshots.pop(self.file, None)
+
+        try:
+            for a in reversed(actions):
+                a.undo()
+        except Exception as rollback_error:
+            raise RollbackError(f"Failed to roll back reload of {self.file} ({rollback_error})") from error
+
+    def rollback(self, error: BaseException) -> None:
+        """
+        Undo applied actions.
+        """
+        self._undo(self.actions, error)
+        self.actions = []
 
     def run(self) -> List[Action]:
         """
-        :return: True if succeded False i unable to reload
+        Reload the module and modules depending on it.
+
+        :return: actions applied to this module
+        """
+        ReloadTransaction([self]).run()
+        return self.actions
+
+
+class ReloadTransaction:
+    """
+    Reloads changed modules together with affected dependents.
+
+    Affected modules are ordered topologically once, every module is reloaded at most once
+    and only after the modules it imports.
+    """
+
+    def __init__(
+        self, reloaders: List[PartialReloader], cancelled: Optional[Callable[[], bool]] = None
+    ) -> None:
+        self.reloaders: Dict[str, PartialReloader] = OrderedDict()
+        for r in reloaders:
+            r.transaction = self
+            self.reloaders[r.module_obj.__name__] = r
+
+        self.cancelled = cancelled or (lambda: False)
+        self.time = 0.0  # s
+        self.completed = False
+
+        self._scheduled: Set[str] = set(self.reloaders.keys())
+        self._changed: Set[str] = set(self.reloaders.keys())
+        self._order: List[str] = []
+        self._dependents_time = 0.0
+
+    def schedule(self, module: ModuleType) -> None:
+        if module.__name__ in self.reloaders:
+            return
+
+        template = next(iter(self.reloaders.values()))
+        # source of a dependent is usually unchanged, only executing it again picks up new imported values
+        reloader = PartialReloader(module, template.root, incremental=False)
+        reloader.transaction = self
+        self.reloaders[module.__name__] = reloader
+        self._scheduled.add(module.__name__)
+
+        if module.__name__ not in self._order:
+            self._order.append(module.__name__)
+
+    @property
+    def actions(self) -> List[Action]:
+        return [a for r in self.reloaders.values() for a in r.actions]
+
+    @property
+    def modules_n(self) -> int:
+        return len(self.reloaders)
+
+    @property
+    def dependents_n(self) -> int:
+        return len(self.reloaders.keys() - self._changed)
+
+    @property
+    def incremental_n(self) -> int:
+        return sum(r.used_incremental for r in self.reloaders.values())
+
+    @property
+    def timings(self) -> Dict[str, float]:
+        """
+        Phase timings summed over modules, "dependents" is the total time spent reloading dependent modules.
+        """
+        ret: Dict[str, float] = defaultdict(float)
+        for r in self.reloaders.values():
+            for phase, t in r.timings.items():
+                ret[phase] += t
+
+        ret["dependents"] = self._dependents_time
+        return dict(ret)
+
+    def get_action_counts(self) -> Dict[str, int]:
+        """
+        Return number of applied actions by kind (e.g. "Function.Update").
+        """
+        ret: Dict[str, int] = defaultdict(int)
+        for a in self.actions:
+            ret[a.kind] += 1
+        return dict(ret)
+
+    def run(self) -> List[Action]:
+        start = perf_counter()
+
+        graph = dependency_watcher.get_graph()
+        affected = list(self.reloaders.keys())
+        for n in self.reloaders.keys():
+            affected.extend(graph.get_dependents(n))
+        self._order = graph.topological_order(affected)
+
+        done: List[str] = []
+        i = 0
+        try:
+            # order can grow when a dependent unknown to the graph is scheduled
+            while i < len(self._order):
+                name = self._order[i]
+                i += 1
+                if name not in self._scheduled or name in done:
+                    continue
+
+                reloader = self.reloaders[name]
+                module_start = perf_counter()
+                actions = reloader.get_actions()
+                # don't apply actions computed from outdated sources
+                if self.cancelled():
+                    # dependents of applied modules wouldn't be scheduled again, reload everything with newer sources
+                    applied, done = done, []
+                    self.rollback(applied, ReloadCancelled())
+                    break
+
+                reloader.apply_actions(actions)
+                reloader.actions = actions
+                done.append(name)
+
+                if name not in self._changed:
+                    self._dependents_time += perf_counter() - module_start
+            else:
+                self.completed = True
+        except BaseException as e:
+            self.rollback(done, e)
+            raise
+        finally:
+            self.time = perf_counter() - start
+
+        return self.actions
+
+    def rollback(self, done: List[str], error: BaseException) -> None:
+        """
+        Undo all reloaded modules, starting from the last one.
         """
-        actions = self.get_actions()
-        self.apply_actions(actions)
-        return actions
\ No newline at end of file
+        failed = []
+        for name in reversed(done):
+            try:
+                self.reloaders[name].rollback(error)
+            except RollbackError as e:
+                # keep going, restoring as much as possible
+                failed.append(str(e))
+
+        if failed:
+            raise RollbackError("\n".join(failed)) from error
\ No newline at end of file
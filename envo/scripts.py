@@ -10,6 +10,7 @@ from typing import Any, ClassVar, Dict, List, Optional, Type
 import envo.e2e
 from envo import Env, const, logger, logging, misc, shell
 from envo.env import EnvBuilder
+from envo.metrics import CommandMetrics
 from envo.misc import Callback, EnvoError, FilesWatcher
 from envo.shell import FancyShell, PromptBase, PromptState, Shell
 
@@ -123,6 +124,7 @@ class HeadlessMode:
         restart_nr: int
         msg: str
         env_path: Path
+        environ: Optional[Dict[str, str]] = None
 
     @dataclass
     class Callbacks:
@@ -169,9 +171,18 @@ class HeadlessMode:
 
         self.li.shell.calls.reset()
 
+    def stop(self) -> None:
+        if self.env:
+            self.env._exit()
+
     def init(self) -> None:
-        self.li.shell.set_context({"logger": logger})
+        self.prepare()
+        self.install()
 
+    def prepare(self) -> None:
+        """
+        Build and validate env without touching the shell, current env can keep serving meanwhile.
+        """
         self._create_env()
 
         self.prompt = NormalPrompt()
@@ -180,12 +191,16 @@ class HeadlessMode:
         self.prompt.name = self.env.get_name()
         self.prompt.msg = self.se.msg
 
+        self.env.validate()
+
+    def install(self) -> None:
+        self.li.shell.set_context({"logger": logger})
         self.li.shell.set_prompt(str(self.prompt))
 
         self.li.shell.set_variable("env", self.env)
         self.li.shell.set_variable("environ", os.environ)
 
-        self.env.validate()
+        self.env._bind_shell()
         self.env.activate()
 
         self.env.load()
@@ -205,6 +220,7 @@ class HeadlessMode:
                 reloader_enabled=self.reloader_enabled,
                 blocking=self.blocking,
                 extra_watchers=self.extra_watchers,
+                environ=self.se.environ,
             ),
         )
         return env
@@ -251,9 +267,6 @@ class NormalMode(HeadlessMode):
         logger.set_level(logging.Level.ERROR)
         logger.debug("Creating NormalMode")
 
-    def stop(self) -> None:
-        self.env._exit()
-
 
 class EmergencyMode(HeadlessMode):
     @dataclass
@@ -295,7 +308,7 @@ class EmergencyMode(HeadlessMode):
                     include=["env_*.py"],
                     exclude=[],
                 ),
-                calls=FilesWatcher.Callbacks(on_event=Callback(None)),
+                calls=FilesWatcher.Callbacks(on_changes=Callback(None)),
             )
         ]
 
@@ -314,9 +327,6 @@ class EmergencyMode(HeadlessMode):
 
         self.env.Meta.root = self.se.env_path.parent
 
-    def stop(self) -> None:
-        self.env._exit()
-
 
 class EnvoBase:
     @dataclass
@@ -401,6 +411,9 @@ class EnvoBase:
     def dump(self) -> None:
         raise NotImplementedError()
 
+    def stats(self) -> None:
+        raise NotImplementedError()
+
 
 class EnvoHeadless(EnvoBase):
     @dataclass
@@ -453,6 +466,7 @@ class EnvoHeadless(EnvoBase):
             sys.exit(self.shell.history[-1].rtn)
         finally:
             self.mode.unload()
+            self.shell.save_metrics()
 
     def dry_run(self) -> None:
         self.shell = Shell.create(Shell.Callbacks(), data_dir_name=self.data_dir_name)
@@ -468,6 +482,13 @@ class EnvoHeadless(EnvoBase):
         path = self.mode.env.dump_dot_env()
         logger.info(f"Saved envs to {str(path)} 💾", print_msg=True)
 
+    def stats(self) -> None:
+        metrics_file = Shell.get_data_dir(self.data_dir_name) / "metrics.json"
+        if not metrics_file.exists():
+            raise EnvoError("No command metrics recorded for this env yet.")
+
+        print(CommandMetrics.load(metrics_file).render())
+
 
 class Envo(EnvoBase):
     @dataclass
@@ -487,35 +508,88 @@ class Envo(EnvoBase):
         self.environ_before = os.environ.copy()  # type: ignore
         logger.set_level(logging.Level.ERROR)
 
+    def _create_mode(self, environ: Optional[Dict[str, str]] = None) -> NormalMode:
+        return NormalMode(
+            se=NormalMode.Sets(
+                stage=self.se.stage,
+                restart_nr=self.restart_count,
+                msg="",
+                env_path=self.find_env(),
+                environ=environ,
+            ),
+            li=NormalMode.Links(shell=self.shell),
+            calls=NormalMode.Callbacks(
+                restart=Callback(self.restart), on_error=Callback(self.on_error)
+            ),
+        )
+
     def init(self, *args: Any, **kwargs: Any) -> None:
         self.restart_count += 1
         try:
             self.shell.reset()
 
             if self.mode:
+                self.mode.stop()
                 self.mode.unload()
 
-            self.mode = NormalMode(
-                se=NormalMode.Sets(
-                    stage=self.se.stage,
-                    restart_nr=self.restart_count,
-                    msg="",
-                    env_path=self.find_env(),
-                ),
-                li=NormalMode.Links(shell=self.shell),
-                calls=NormalMode.Callbacks(
-                    restart=Callback(self.restart), on_error=Callback(self.on_error)
-                ),
-            )
+            self.mode = self._create_mode()
             self.mode.init()
 
         except BaseException as exc:
             self.on_error(exc)
 
-    def on_error(self, exc: BaseException) -> None:
+    def restart(self) -> None:
+        """
+        Build and validate new env while the current one keeps serving commands, then swap them.
+        If the new env fails the current one stays active. Called from reloader threads.
+        """
+        if not isinstance(self.mode, NormalMode):
+            self.init()
+            return
+
+        self.restart_count += 1
+        # current env is still activated, build the new one from environ it was activated on
+        mode = self._create_mode(environ=self.mode.env._environ_before)
+        try:
+            mode.prepare()
+        except BaseException as exc:
+            self._on_restart_error(exc)
+            return
+
+        old_mode = self.mode
+        # blocks until the running command (if any) finishes
+        self.shell.begin_reload()
+        try:
+            self.mode.stop()
+            self.mode.unload()
+            self.shell.reset()
+
+            self.mode = mode
+            self.mode.install()
+        except BaseException as exc:
+            self.on_error(exc)
+            return
+        finally:
+            self.shell.end_reload()
+
+        # files edited during the build were coalesced into the old env, new env was built without them
+        if old_mode.env._restart_stale:
+            self.mode.env._restart(metadata={"type": "reload", "reason": "files changed during restart"})
+
+    def _get_error_msg(self, exc: BaseException) -> str:
         msg = misc.get_envo_relevant_traceback(exc)
         msg = "".join(msg)
-        msg = msg.rstrip()
+        return msg.rstrip()
+
+    def _on_restart_error(self, exc: BaseException) -> None:
+        msg = self._get_error_msg(exc)
+        logger.error(msg)
+
+        self.mode.prompt.msg = f"Reload failed, previous env is still active:\n{msg}"
+        self.shell.set_prompt(self.mode.prompt.as_str())
+
+    def on_error(self, exc: BaseException) -> None:
+        msg = self._get_error_msg(exc)
 
         logger.error(msg)
 
@@ -649,6 +723,13 @@ class Dump(BaseOption):
         env_headless.dump()
 
 
+@dataclass
+class Stats(BaseOption):
+    def run(self) -> None:
+        envo.e2e.envo = env_headless = EnvoHeadless(EnvoHeadless.Sets(stage=self.stage))
+        env_headless.stats()
+
+
 @dataclass
 class Version(BaseOption):
     def run(self) -> None:
@@ -677,6 +758,7 @@ option_name_to_option: Dict[str, Type[BaseOption]] = {
     "run": Command,
     "dry-run": DryRun,
     "dump": Dump,
+    "stats": Stats,
     "": Start,
     "init": Init,
     "version": Version,
@@ -687,7 +769,7 @@ def _main() -> None:
     logger.debug("Starting")
 
     argv = sys.argv[1:]
-    keywords = ["init", "dry-run", "version", "dump", "run"]
+    keywords = ["init", "dry-run", "version", "dump", "run", "stats"]
 
     stage = DEFAULT_STAGE
     if argv and argv[0] not in keywords:
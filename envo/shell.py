@@ -5,7 +5,7 @@ import time
 from dataclasses import dataclass
 from enum import Enum
 from pathlib import Path
-from threading import Lock
+from threading import Condition
 from typing import Any, Callable, Dict, List, Optional, TextIO, Union
 
 import fire
@@ -18,6 +18,7 @@ from xonsh.readline_shell import ReadlineShell
 
 import envo
 from envo import logger
+from envo.metrics import CommandMetrics, CommandRecord, ReloadMetrics
 from envo.misc import Callback, is_windows
 
 
@@ -88,7 +89,13 @@ class Shell(BaseShell):  # type: ignore
         self.history = builtins.__xonsh__.history  # type: ignore
         self.context: Dict[str, Any] = {}
 
-        self.cmd_lock = Lock()
+        self.metrics = CommandMetrics()
+        self.reload_metrics = ReloadMetrics()
+        self.metrics_file: Optional[Path] = None
+
+        self._cmd_cond = Condition()
+        self._executing_cmd = False
+        self._reloading = False
 
         self.bootload()
 
@@ -130,6 +137,17 @@ class Shell(BaseShell):  # type: ignore
         setattr(builtins, built_in_name, value)
         exec(f"{name} = {built_in_name}", builtins.__dict__)
 
+    def unset_variable(self, name: str) -> None:
+        self.context.pop(name, None)
+
+        built_in_name = f"__envo_{name}__"
+        built_in_name = built_in_name.replace(".", "_")
+        builtins.__dict__.pop(built_in_name, None)
+        try:
+            exec(f"del {name}", builtins.__dict__)
+        except (NameError, AttributeError):
+            pass
+
     def _execute_with_fire(self, fun: Callable, command: str) -> Any:
         command_name = command.split()[0]
         command_args = command.split()[1:]
@@ -186,7 +204,7 @@ class Shell(BaseShell):  # type: ignore
 
         ctx: Dict[str, Any] = {}
 
-        data_dir = Path.home() / f".envo/xonsh_data/{data_dir_name}"
+        data_dir = cls.get_data_dir(data_dir_name)
         os.makedirs(data_dir, exist_ok=True)
 
         execer = Execer(xonsh_ctx=ctx)
@@ -225,8 +243,24 @@ class Shell(BaseShell):  # type: ignore
         builtins.__xonsh__.shell = shell  # type: ignore
         builtins.__xonsh__.shell.shell = shell  # type: ignore
 
+        shell.metrics_file = data_dir / "metrics.json"
+        shell.metrics = CommandMetrics.load(shell.metrics_file)
+
         return shell
 
+    @classmethod
+    def get_data_dir(cls, data_dir_name: str) -> Path:
+        return Path.home() / f".envo/xonsh_data/{data_dir_name}"
+
+    def save_metrics(self) -> None:
+        if not self.metrics_file:
+            return
+
+        try:
+            self.metrics.save(self.metrics_file)
+        except OSError as e:
+            logger.warning(f"Couldn't save command metrics ({e})")
+
     def set_fulll_traceback_enabled(self, enabled: bool = True):
         self.environ["XONSH_SHOW_TRACEBACK"] = enabled
 
@@ -245,9 +279,36 @@ class Shell(BaseShell):  # type: ignore
             self.history.buffer[-1]["rtn"] = self.history.last_cmd_rtn
             self.history.flush()
 
+    def begin_reload(self) -> None:
+        """
+        Wait for the running command or reload to finish, hold new commands until end_reload.
+        """
+        with self._cmd_cond:
+            self._cmd_cond.wait_for(
+                lambda: not self._reloading and not self._executing_cmd
+            )
+            self._reloading = True
+
+    def end_reload(self) -> None:
+        with self._cmd_cond:
+            self._reloading = False
+            self._cmd_cond.notify_all()
+
+    def _begin_cmd(self) -> None:
+        with self._cmd_cond:
+            self._cmd_cond.wait_for(
+                lambda: not self._reloading and not self._executing_cmd
+            )
+            self._executing_cmd = True
+
+    def _end_cmd(self) -> None:
+        with self._cmd_cond:
+            self._executing_cmd = False
+            self._cmd_cond.notify_all()
+
     def default(self, line: str) -> Any:
         logger.info("Executing command", {"command": line})
-        self.cmd_lock.acquire()
+        self._begin_cmd()
 
         class Stream:
             device: TextIO
@@ -256,14 +317,20 @@ class Shell(BaseShell):  # type: ignore
                 self.command = command
                 self.on_write = on_write
                 self.output: List[bytes] = []
+                self.hook_time = 0.0
+                self.bytes_n = 0
 
             def write(self, text: Union[bytes, str]) -> None:
+                t0 = time.perf_counter()
                 text = self.on_write(command=self.command, out=text)
+                self.hook_time += time.perf_counter() - t0
                 self.output.append(text)
 
                 if isinstance(text, str):
+                    self.bytes_n += len(text.encode("utf-8", errors="replace"))
                     self.device.write(text)
                 else:
+                    self.bytes_n += len(text)
                     self.device.buffer.write(text)
 
             def flush(self) -> None:
@@ -275,6 +342,9 @@ class Shell(BaseShell):  # type: ignore
         class StdErr(Stream):
             device = sys.__stderr__
 
+        record = CommandRecord(command=line)
+        start = time.perf_counter()
+
         try:
             out = None
             err = None
@@ -282,7 +352,9 @@ class Shell(BaseShell):  # type: ignore
             # W want to catch all exceptions just in case the command fails so we can handle std_err and post_cmd
             hist_line = line
             if self.calls.pre_cmd:
+                t0 = time.perf_counter()
                 line = self.calls.pre_cmd(line)
+                record.hooks_time["precmd"] += time.perf_counter() - t0
 
             if self.calls.on_stdout:
                 out = StdOut(command=line, on_write=self.calls.on_stdout)
@@ -299,10 +371,26 @@ class Shell(BaseShell):  # type: ignore
             if self.calls.on_stderr:
                 sys.stderr = sys.__stderr__
 
-            if self.calls.post_cmd and out and err:
-                self.calls.post_cmd(command=line, stdout=out.output, stderr=err.output)
-
-            self.cmd_lock.release()
+            try:
+                if self.calls.post_cmd and out and err:
+                    t0 = time.perf_counter()
+                    try:
+                        self.calls.post_cmd(command=line, stdout=out.output, stderr=err.output)
+                    finally:
+                        record.hooks_time["postcmd"] += time.perf_counter() - t0
+            finally:
+                self._end_cmd()
+
+                # failing commands and hooks are recorded too
+                if out:
+                    record.hooks_time["onstdout"] += out.hook_time
+                    record.stdout_bytes = out.bytes_n
+                if err:
+                    record.hooks_time["onstderr"] += err.hook_time
+                    record.stderr_bytes = err.bytes_n
+                record.rtn = getattr(self.history, "last_cmd_rtn", None)
+                record.wall_time = time.perf_counter() - start
+                self.metrics.add(record)
 
         return ret
 
@@ -335,6 +423,7 @@ class FancyShell(Shell, PromptToolkitShell):  # type: ignore
         self.cmdloop()
 
         self.calls.on_exit()
+        self.save_metrics()
 
     def set_prompt(self, prompt: str) -> None:
         super(FancyShell, self).set_prompt(prompt)
@@ -220,8 +220,9 @@ class TestHotReload(utils.TestBase):
 
         e.expected.pop()
 
-        e.output(r'Variable "test_var" is unset!\n')
-        e.prompt(PromptState.EMERGENCY_MAYBE_LOADING).eval()
+        # previous env stays active
+        e.output(r'Reload failed, previous env is still active:\nVariable "test_var" is unset!\n')
+        e.prompt(PromptState.MAYBE_LOADING).eval()
 
         e.expected.pop()
         e.expected.pop()
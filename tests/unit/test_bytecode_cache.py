@@ -0,0 +1,35 @@
+from envo.misc import BytecodeCache
+
+
+class TestBytecodeCache:
+    def test_unchanged_source_not_recompiled(self, sandbox):
+        cache_dir = sandbox / "cache"
+        path = str(sandbox / "carwash.py")
+
+        cache = BytecodeCache(cache_dir)
+        code = cache.get_code(path, b"sprinklers_n = 3\n")
+        assert cache.get_code(path, b"sprinklers_n = 3\n") is code
+        assert cache.compiled_n == 1
+
+        cache.get_code(path, b"sprinklers_n = 4\n")
+        assert cache.compiled_n == 2
+
+        # new session loads from disk
+        cache = BytecodeCache(cache_dir)
+        namespace = {}
+        exec(cache.get_code(path, b"sprinklers_n = 4\n"), namespace)
+        assert namespace["sprinklers_n"] == 4
+        assert cache.compiled_n == 0
+        assert cache.hits_n == 1
+
+    def test_corrupted_cache_file(self, sandbox):
+        cache_dir = sandbox / "cache"
+        path = str(sandbox / "carwash.py")
+
+        BytecodeCache(cache_dir).get_code(path, b"sprinklers_n = 3\n")
+        for f in cache_dir.iterdir():
+            f.write_bytes(f.read_bytes()[:20])
+
+        cache = BytecodeCache(cache_dir)
+        cache.get_code(path, b"sprinklers_n = 3\n")
+        assert cache.compiled_n == 1
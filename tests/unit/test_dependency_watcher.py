@@ -0,0 +1,144 @@
+import os
+import sys
+from pathlib import Path
+from textwrap import dedent
+
+from envo import dependency_watcher
+from envo.dependency_watcher import DependencyGraph, ImportCache, get_imports
+
+
+class TestDependencyGraph:
+    def test_dependents_in_topological_order(self):
+        graph = DependencyGraph()
+        graph.add("carwash", importer="car")
+        graph.add("car", importer="accounting")
+        graph.add("carwash", importer="accounting")
+        graph.add("carwash", importer="car")
+
+        assert graph.get_importers("carwash") == {"car", "accounting"}
+        assert graph.get_dependents("carwash") == ["car", "accounting"]
+        assert graph.get_dependents("accounting") == []
+
+        # cached closure is invalidated on change
+        graph.add("accounting", importer="office")
+        assert graph.get_dependents("carwash") == ["car", "accounting", "office"]
+
+    def test_cycles(self):
+        graph = DependencyGraph()
+        graph.add("carwash", importer="car")
+        graph.add("car", importer="sprayer")
+        graph.add("sprayer", importer="carwash")
+        graph.add("carwash", importer="office")
+
+        assert graph.get_cycles() == [["car", "carwash", "sprayer"]]
+        assert set(graph.get_dependents("carwash")) == {"car", "sprayer", "office"}
+
+    def test_remove(self):
+        graph = DependencyGraph()
+        graph.add("carwash", importer="car")
+        graph.remove("car")
+
+        assert graph.get_dependents("carwash") == []
+
+
+class TestGetImports:
+    def test_module_level_imports(self):
+        source = dedent("""
+        import os.path
+        from . import sprayers
+        from .dryers import Dryer
+        from ..office import *
+
+        try:
+            import car
+        except ImportError:
+            pass
+
+        def fun():
+            import accounting
+        """)
+
+        assert get_imports(source, "carwash.washing", is_package=False) == {
+            "os.path",
+            "carwash",
+            "carwash.sprayers",
+            "carwash.dryers",
+            "carwash.dryers.Dryer",
+            "car",
+        }
+
+    def test_relative_import_in_package(self):
+        assert get_imports("from . import sprayers", "carwash", is_package=True) == {
+            "carwash",
+            "carwash.sprayers",
+        }
+
+
+class TestTracking:
+    def test_scans_modules_under_root(self, sandbox):
+        (sandbox / "carwash3.py").write_text("sprinkler_n = 3\n")
+        (sandbox / "car3.py").write_text("from carwash3 import sprinkler_n\nimport json\n")
+
+        dependency_watcher.enable(sandbox)
+        try:
+            import car3
+
+            assert car3.sprinkler_n == 3
+            assert dependency_watcher.get_dependencies(sys.modules["carwash3"]) == ["car3"]
+            # modules outside of tracked roots are not in the graph
+            assert dependency_watcher.get_graph().get_imports("car3") == {"carwash3"}
+        finally:
+            dependency_watcher.disable(sandbox)
+            sys.modules.pop("car3", None)
+            sys.modules.pop("carwash3", None)
+
+        assert not dependency_watcher.is_enabled()
+
+
+class TestImportCache:
+    def test_persisted_and_incremental(self, sandbox):
+        cache_dir = sandbox / "cache"
+        (sandbox / "carwash4.py").write_text("sprinkler_n = 3\n")
+        car_file = sandbox / "car4.py"
+        car_file.write_text("from carwash4 import sprinkler_n\n")
+        modules = {Path(os.path.realpath(str(sandbox / f))): f[:-3] for f in ["carwash4.py", "car4.py"]}
+
+        cache = ImportCache(sandbox, cache_dir)
+        assert cache.get_imports(modules)["car4"] == {"carwash4", "carwash4.sprinkler_n"}
+        assert cache.scanned_n == 2
+        cache.save()
+
+        # next session parses only changed files
+        car_file.write_text("import carwash4\nimport json\n")
+        cache = ImportCache(sandbox, cache_dir)
+        assert cache.get_imports(modules)["car4"] == {"carwash4", "json"}
+        assert cache.scanned_n == 1
+
+        # files checked in this session aren't stat-ed again until invalidated
+        car_file.write_text("import carwash4\nimport json\nimport os\n")
+        assert cache.get_imports(modules)["car4"] == {"carwash4", "json"}
+        assert cache.scanned_n == 1
+
+        cache.invalidate(Path(os.path.realpath(str(car_file))))
+        assert cache.get_imports(modules)["car4"] == {"carwash4", "json", "os"}
+        assert cache.scanned_n == 2
+
+    def test_parallel_scan(self, sandbox, monkeypatch, mocker):
+        (sandbox / "carwash5.py").write_text("sprinkler_n = 3\n")
+        (sandbox / "car5.py").write_text("from carwash5 import sprinkler_n\n")
+        (sandbox / "office5.py").write_text("import car5\ndef (\n")
+        modules = {Path(os.path.realpath(str(sandbox / f))): f[:-3] for f in ["carwash5.py", "car5.py", "office5.py"]}
+
+        cache = ImportCache(sandbox, sandbox / "cache")
+        cache.parallel_threshold = 1
+        monkeypatch.setattr(os, "cpu_count", lambda: 2)
+        scan_in_process = mocker.spy(dependency_watcher, "_scan_in_process")
+
+        # files that fail to parse have no entry
+        assert cache.get_imports(modules) == {
+            "carwash5": set(),
+            "car5": {"carwash5", "carwash5.sprinkler_n"},
+            "office5": set(),
+        }
+        assert scan_in_process.call_count == 2
+        assert scan_in_process.spy_exception is None
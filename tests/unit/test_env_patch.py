@@ -0,0 +1,144 @@
+from pathlib import Path
+from textwrap import dedent
+from unittest.mock import MagicMock
+
+import pytest
+from watchdog.events import FileModifiedEvent
+
+from envo.env import Env, EnvBuilder, EnvPatch
+from envo.misc import Callback, ChangeSet, import_from_file
+from envo.partial_reloader import IncompatibleChange
+
+env_source = """
+from pathlib import Path
+
+from envo import UserEnv, command
+
+SPRINKLERS_N = 3
+
+
+class CarwashEnv(UserEnv):
+    class Meta(UserEnv.Meta):
+        root = Path(__file__).parent.absolute()
+        stage = "test"
+        name = "carwash"
+
+    sprinklers: int
+
+    def __init__(self) -> None:
+        self.sprinklers = SPRINKLERS_N
+
+    @command
+    def wash(self) -> str:
+        return "washing"
+
+
+Env = CarwashEnv
+"""
+
+
+def load_env(path: Path) -> type:
+    return EnvBuilder.build_env(import_from_file(path, path.parent).Env)
+
+
+def create_live_env(env_file: Path) -> Env:
+    source = dedent(env_source).replace(
+        "        name = \"carwash\"\n",
+        "        name = \"carwash\"\n        parents: List[str] = []\n        plugins: List[Plugin] = []\n",
+    )
+    env_file.write_text("from typing import List\nfrom envo import Plugin\n" + source)
+    env_class = EnvBuilder.build_shell_env_from_file(env_file)
+    return env_class(
+        li=Env.Links(shell=MagicMock(), status=MagicMock()),
+        calls=Env.Callbacks(restart=Callback(None), on_error=Callback(None)),
+        se=Env.Sets(extra_watchers=[], reloader_enabled=False),
+    )
+
+
+class TestEnvPatch:
+    def test_patches_in_place(self, sandbox):
+        env_file = sandbox / "env_test.py"
+        env_file.write_text(dedent(env_source))
+        env = load_env(env_file)
+        user_env = env.get_user_envs()[0]
+        wash = user_env.__dict__["wash"]
+
+        env_file.write_text(
+            dedent(env_source)
+            .replace('return "washing"', 'return "drying"')
+            .replace("SPRINKLERS_N = 3", "SPRINKLERS_N = 5")
+        )
+        EnvPatch(env, load_env(env_file)).apply()
+
+        # command object is kept, its body is new
+        assert user_env.__dict__["wash"] is wash
+        assert wash.func(None) == "drying"
+
+        obj = object.__new__(env)
+        user_env.__init__(obj)
+        assert obj.sprinklers == 5
+
+    def test_meta_change_needs_restart(self, sandbox):
+        env_file = sandbox / "env_test.py"
+        env_file.write_text(dedent(env_source))
+        env = load_env(env_file)
+
+        env_file.write_text(dedent(env_source).replace('name = "carwash"', 'name = "car"'))
+        with pytest.raises(IncompatibleChange):
+            EnvPatch(env, load_env(env_file))
+
+    def test_fingerprint_ignores_formatting(self, sandbox):
+        env_file = sandbox / "env_test.py"
+        env_file.write_text(dedent(env_source))
+        fingerprint = EnvPatch.get_fingerprint(load_env(env_file))
+
+        env_file.write_text(
+            "# comment\n\n" + dedent(env_source).replace('return "washing"', 'return (\n        "washing"\n    )')
+        )
+        assert EnvPatch.get_fingerprint(load_env(env_file)) == fingerprint
+
+        env_file.write_text(dedent(env_source).replace('return "washing"', 'return "drying"'))
+        assert EnvPatch.get_fingerprint(load_env(env_file)) != fingerprint
+
+    def test_failed_patch_leaves_live_env_unchanged(self, sandbox):
+        env_file = sandbox / "env_test.py"
+        env = create_live_env(env_file)
+        wash = env._magic_functions["command"]["wash"]
+        magic_functions = env._magic_functions
+
+        # other_var is never set so validation fails after classes were patched
+        env_file.write_text(
+            env_file.read_text()
+            .replace('return "washing"', 'return "drying"')
+            .replace("    sprinklers: int\n", "    sprinklers: int\n    other_var: int\n")
+        )
+        new_env = EnvBuilder.build_shell_env_from_file(env_file)
+
+        assert not env._partial_env_reload(new_env, metadata={})
+
+        assert env._magic_functions is magic_functions
+        assert env._magic_functions["command"]["wash"] is wash
+        assert wash.func(env) == "washing"
+        assert "other_var" not in env.get_user_envs()[0].__annotations__
+        assert not env._reload_pending
+        env.validate()
+
+    def test_unchanged_env_skips_reload(self, sandbox, mocker):
+        env_file = sandbox / "env_test.py"
+        env = create_live_env(env_file)
+        partial_env_reload = mocker.patch.object(env, "_partial_env_reload", return_value=True)
+        restart = mocker.patch.object(env, "_restart")
+        source = env_file.read_text()
+
+        def edit(new_source: str) -> None:
+            env_file.write_text(new_source)
+            changes = ChangeSet()
+            changes.add(FileModifiedEvent(str(env_file)))
+            env._on_env_edit(changes)
+
+        edit("# comment\n" + source.replace('return "washing"', 'return (\n            "washing"\n        )'))
+        assert not partial_env_reload.called
+        assert not restart.called
+
+        edit(source.replace("SPRINKLERS_N = 3", "SPRINKLERS_N = 5"))
+        assert partial_env_reload.called
@@ -0,0 +1,123 @@
+import os
+from pathlib import Path
+from textwrap import dedent
+from unittest.mock import MagicMock
+
+from envo.env import Env, EnvBuilder
+from envo.misc import Callback
+from envo.scripts import Envo, NormalMode
+
+env_source = """
+from pathlib import Path
+from typing import List
+
+from envo import Plugin, UserEnv, command
+
+
+class CarwashEnv(UserEnv):
+    class Meta(UserEnv.Meta):
+        root: Path = Path(__file__).parent.absolute()
+        stage: str = "test"
+        parents: List[str] = []
+        plugins: List[Plugin] = []
+        name: str = "carwash"
+
+    sprinklers: int
+
+    def __init__(self) -> None:
+        self.sprinklers = 3
+
+    @command
+    def wash(self) -> str:
+        return "washing"
+
+
+Env = CarwashEnv
+"""
+
+
+def create_env(sandbox: Path, restart: Callback, environ=None) -> Env:
+    env_file = sandbox / "env_test.py"
+    env_file.write_text(dedent(env_source))
+    env_class = EnvBuilder.build_shell_env_from_file(env_file)
+    return env_class(
+        li=Env.Links(shell=None, status=MagicMock()),
+        calls=Env.Callbacks(restart=restart, on_error=Callback(None)),
+        se=Env.Sets(extra_watchers=[], reloader_enabled=False, environ=environ),
+    )
+
+
+class TestEnvRestart:
+    def test_built_from_given_environ(self, sandbox):
+        env = create_env(sandbox, Callback(None), environ={"PATH": "/clean/bin"})
+
+        assert env.path == "/clean/bin"
+        assert env.pythonpath == f"{env.root}:"
+
+    def test_retries_after_failed_build_when_files_changed(self, sandbox):
+        builds = []
+
+        def restart() -> None:
+            builds.append(1)
+            # env file edited while the first build runs, coalesced into a retry
+            if len(builds) == 1:
+                env._restart({})
+
+        env = create_env(sandbox, Callback(restart))
+        env._restart({})
+
+        assert len(builds) == 2
+        assert not env._reload_pending
+
+    def test_retries_on_new_env_after_swap(self, sandbox, mocker):
+        (sandbox / "env_test.py").write_text(dedent(env_source))
+        envo = Envo(Envo.Sets(stage="test"))
+        envo.shell = MagicMock()
+
+        mode = envo._create_mode()
+        mode.prepare()
+        envo.mode = mode
+
+        builds = []
+        prepare = NormalMode.prepare
+
+        def build(self) -> None:
+            builds.append(self)
+            # env file edited while the first build runs, coalesced into the old env
+            if len(builds) == 1:
+                mode.env._restart({})
+            prepare(self)
+
+        mocker.patch.object(NormalMode, "prepare", build)
+        mocker.patch.object(NormalMode, "install")
+        mode.env._restart({})
+
+        # new env was built from the file before the edit, it's rebuilt after the swap
+        assert len(builds) == 2
+        assert envo.mode is builds[1]
+
+    def test_failed_restart_keeps_current_env(self, sandbox):
+        (sandbox / "env_test.py").write_text(dedent(env_source))
+        envo = Envo(Envo.Sets(stage="test"))
+        envo.shell = MagicMock()
+
+        mode = envo._create_mode()
+        mode.prepare()
+        mode.env.activate()
+        envo.mode = mode
+        env_vars = mode.env.get_env_vars()
+        commands = dict(mode.env._magic_functions["command"])
+
+        try:
+            (sandbox / "env_test.py").write_text("Env = (")
+            envo.restart()
+
+            assert envo.mode is mode
+            assert all(os.environ[k] == v for k, v in env_vars.items())
+            assert mode.env._magic_functions["command"] == commands
+            assert mode.env.wash() == "washing"
+            assert mode.prompt.msg.startswith("Reload failed")
+            envo.shell.begin_reload.assert_not_called()
+            envo.shell.reset.assert_not_called()
+        finally:
+            mode.env._deactivate()
@@ -0,0 +1,419 @@
+import errno
+import os
+from pathlib import Path
+from threading import Event, Thread, current_thread
+from time import sleep
+from typing import List
+
+from watchdog.events import (
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileMovedEvent,
+)
+
+from envo.misc import (
+    Callback,
+    ChangeSet,
+    FilesWatcher,
+    GlobMatcher,
+    IgnoreRules,
+    PathTrie,
+    WatchDir,
+    WatchManager,
+    get_watch_dirs,
+)
+
+
+class TestGlobMatcher:
+    def test_match(self):
+        matcher = GlobMatcher(
+            include=["**/*.py", "env_*.py"], exclude=["**/__pycache__", "**/.*"]
+        )
+
+        assert matcher.match("env_comm.py")
+        assert matcher.match("carwash/sprayers.py")
+        assert not matcher.match("carwash/__pycache__")
+        assert not matcher.match("carwash/.hidden")
+        assert not matcher.match("README.rst")
+
+    def test_empty(self):
+        matcher = GlobMatcher(include=[], exclude=[])
+
+        assert not matcher.match("env_comm.py")
+        assert not matcher.is_excluded("env_comm.py")
+
+
+class TestIgnoreRules:
+    def test_is_ignored(self, sandbox):
+        (sandbox / ".git").mkdir()
+        (sandbox / "carwash").mkdir()
+        (sandbox / ".gitignore").write_text("# generated\n*_pb2.py\n/build\nvenv/\n!keep_pb2.py\n")
+        (sandbox / "carwash/.ignore").write_text("vendor/**\n")
+
+        rules = IgnoreRules(sandbox / "carwash")
+        assert rules.top == sandbox
+
+        assert rules.is_ignored(sandbox / "carwash/sprayers_pb2.py", False)
+        assert not rules.is_ignored(sandbox / "carwash/keep_pb2.py", False)
+        assert rules.is_ignored(sandbox / "build/lib.py", False)
+        assert not rules.is_ignored(sandbox / "carwash/build/lib.py", False)
+        assert rules.is_ignored(sandbox / "carwash/venv", True)
+        assert not rules.is_ignored(sandbox / "carwash/venv", False)
+        assert rules.is_ignored(sandbox / "carwash/vendor/lib.py", False)
+        assert not rules.is_ignored(sandbox / "vendor/lib.py", False)
+
+    def test_negation(self, sandbox):
+        (sandbox / ".git").mkdir()
+        (sandbox / ".gitignore").write_text(
+            "build/\n!build/keep.py\nlogs/**\n!logs/keep.log\nrun[!a-z].py\nspray[a!].py\n"
+        )
+        rules = IgnoreRules(sandbox)
+
+        # can't re-include a file if its directory is excluded
+        assert rules.is_ignored(sandbox / "build/keep.py", False)
+        assert not rules.is_ignored(sandbox / "logs/keep.log", False)
+        assert rules.is_ignored(sandbox / "logs/error.log", False)
+
+        assert rules.is_ignored(sandbox / "run1.py", False)
+        assert not rules.is_ignored(sandbox / "runa.py", False)
+        assert rules.is_ignored(sandbox / "spray!.py", False)
+
+    def test_reload(self, sandbox):
+        (sandbox / ".git").mkdir()
+        (sandbox / ".gitignore").write_text("*.py\n")
+        rules = IgnoreRules(sandbox)
+        assert rules.is_ignored(sandbox / "carwash.py", False)
+
+        (sandbox / ".gitignore").write_text("")
+        rules.reload(sandbox / ".gitignore")
+        assert not rules.is_ignored(sandbox / "carwash.py", False)
+
+    def test_files_watcher_scanning(self, sandbox):
+        for d in [".git", "carwash", "venv/lib", "proto"]:
+            (sandbox / d).mkdir(parents=True)
+        for f in ["carwash/sprayers.py", "venv/lib/six.py", "proto/office_pb2.py"]:
+            (sandbox / f).touch()
+        (sandbox / ".gitignore").write_text("venv/\n*_pb2.py\n")
+
+        watcher = FilesWatcher(
+            FilesWatcher.Sets(root=sandbox, include=["**/*.py"], exclude=[], use_ignore_files=True),
+            calls=FilesWatcher.Callbacks(on_changes=Callback(None)),
+        )
+        assert watcher.get_matching_files() == [sandbox / "carwash/sprayers.py"]
+        assert watcher.is_excluded(sandbox / "venv")
+
+
+class TestPathTrie:
+    def test_get_along(self):
+        trie = PathTrie()
+        trie.add(Path("/project"), "project")
+        trie.add(Path("/project/carwash"), "carwash")
+        trie.add(Path("/other"), "other")
+
+        assert trie.get_along(Path("/project/carwash/sprayers.py")) == [
+            "project",
+            "carwash",
+        ]
+        assert trie.get_along(Path("/project/office/employees.py")) == ["project"]
+        assert trie.get_along(Path("/tmp/file.py")) == []
+
+    def test_top_paths(self):
+        trie = PathTrie()
+        trie.add(Path("/project"), "project")
+        trie.add(Path("/project/carwash"), "carwash")
+        trie.add(Path("/other"), "other")
+
+        assert trie.top_paths() == [Path("/project"), Path("/other")]
+
+        trie.remove(Path("/project"), "project")
+        assert trie.top_paths() == [Path("/project/carwash"), Path("/other")]
+
+        trie.remove(Path("/project/carwash"), "carwash")
+        assert trie.top_paths() == [Path("/other")]
+
+
+class TestGetWatchDirs:
+    def test_recursion_only_when_needed(self):
+        root = Path("/project")
+        assert get_watch_dirs(
+            root, ["*.py", "./test_dir/*.py", "test_dir/**/*.py", "conf/*/settings.py", "setup.cfg"]
+        ) == [
+            WatchDir(root, False),
+            WatchDir(root / "test_dir", True),
+            WatchDir(root / "conf", True),
+        ]
+
+
+class TestWatchManager:
+    def test_excluded_dirs_not_watched(self, sandbox, is_linux):
+        if not is_linux:
+            return
+
+        for d in ["carwash/office", ".venv/lib", "node_modules/lib", "carwash/__pycache__"]:
+            (sandbox / d).mkdir(parents=True)
+        (sandbox / "carwash/sprayers.py").touch()
+
+        watcher = FilesWatcher(
+            FilesWatcher.Sets(
+                root=sandbox,
+                include=["**/*.py"],
+                exclude=["**/.*", "node_modules", "**/__pycache__"],
+            ),
+            calls=FilesWatcher.Callbacks(on_changes=Callback(None)),
+        )
+        watcher.start()
+
+        try:
+            assert WatchManager.get().get_watches_n(sandbox) == 3
+        finally:
+            watcher.stop()
+
+    def test_flat_watch_dirs(self, sandbox, is_linux):
+        if not is_linux:
+            return
+
+        for d in ["carwash/office", "carwash/sprayers", "docs"]:
+            (sandbox / d).mkdir(parents=True)
+
+        include = ["env_*.py", "docs/*.md"]
+        watch_dirs = get_watch_dirs(sandbox, include)
+        assert watch_dirs == [WatchDir(sandbox, False), WatchDir(sandbox / "docs", False)]
+
+        watcher = FilesWatcher(
+            FilesWatcher.Sets(root=sandbox, include=include, exclude=[], watch_dirs=watch_dirs),
+            calls=FilesWatcher.Callbacks(on_changes=Callback(None)),
+        )
+        watcher.start()
+
+        try:
+            assert watcher.watches_n == 2
+            assert WatchManager.get().get_watches_n(sandbox) == 2
+        finally:
+            watcher.stop()
+
+    def test_polling_backend(self, sandbox):
+        (sandbox / "carwash").mkdir()
+        (sandbox / "node_modules").mkdir()
+        (sandbox / "carwash/sprayers.py").write_text("1")
+        (sandbox / "carwash/office.py").touch()
+        (sandbox / "carwash/notes.txt").touch()
+
+        changes: List[ChangeSet] = []
+        watcher = FilesWatcher(
+            FilesWatcher.Sets(
+                root=sandbox,
+                include=["**/*.py"],
+                exclude=["node_modules"],
+                backend="polling",
+            ),
+            calls=FilesWatcher.Callbacks(on_changes=Callback(changes.append)),
+        )
+        watcher.start()
+
+        try:
+            # only matching files are indexed
+            assert WatchManager.get()._polling.files_n == 2
+
+            (sandbox / "carwash/sprayers.py").write_text("12")
+            (sandbox / "carwash/office.py").unlink()
+            (sandbox / "carwash/dryers.py").touch()
+            (sandbox / "node_modules/lib.py").touch()
+
+            for _ in range(50):
+                if sum(len(c) for c in changes) >= 3:
+                    break
+                sleep(0.1)
+        finally:
+            watcher.stop()
+
+        events = {(c.path.name, c.event_type) for cs in changes for c in cs}
+        assert events == {
+            ("sprayers.py", "modified"),
+            ("office.py", "deleted"),
+            ("dryers.py", "created"),
+        }
+
+    def test_polling_fallback_when_out_of_watches(self, sandbox, is_linux, monkeypatch):
+        if not is_linux:
+            return
+
+        from watchdog.observers.inotify import InotifyEmitter
+
+        def on_thread_start(emitter) -> None:
+            raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+        monkeypatch.setattr(InotifyEmitter, "on_thread_start", on_thread_start)
+        (sandbox / "carwash").mkdir()
+
+        watcher = FilesWatcher(
+            FilesWatcher.Sets(root=sandbox / "carwash", include=["**/*.py"], exclude=[]),
+            calls=FilesWatcher.Callbacks(on_changes=Callback(None)),
+        )
+        watcher.start()
+
+        try:
+            manager = WatchManager.get()
+            assert manager._watches[sandbox / "carwash"] == (True, None)
+            assert not any(w.path == str(sandbox / "carwash") for w in manager._observer._emitter_for_watch)
+        finally:
+            watcher.stop()
+
+    def test_subscribe_while_dispatching(self, sandbox):
+        (sandbox / "carwash").mkdir()
+        (sandbox / "office").mkdir()
+
+        watcher = FilesWatcher(
+            FilesWatcher.Sets(root=sandbox / "carwash", include=["**/*.py"], exclude=[]),
+            calls=FilesWatcher.Callbacks(on_changes=Callback(None)),
+        )
+        watcher.start()
+
+        stop = Event()
+
+        def touch() -> None:
+            i = 0
+            while not stop.is_set():
+                (sandbox / f"carwash/sprayers_{i % 10}.py").write_text(str(i))
+                i += 1
+
+        def subscribe() -> None:
+            for _ in range(20):
+                other = FilesWatcher(
+                    FilesWatcher.Sets(root=sandbox / "office", include=["**/*.py"], exclude=[]),
+                    calls=FilesWatcher.Callbacks(on_changes=Callback(None)),
+                )
+                other.start()
+                other.stop()
+
+        toucher = Thread(target=touch, daemon=True)
+        subscriber = Thread(target=subscribe, daemon=True)
+        toucher.start()
+        subscriber.start()
+
+        subscriber.join(timeout=20)
+        stop.set()
+        toucher.join(timeout=5)
+
+        # deadlocked threads would keep the manager locked
+        assert not subscriber.is_alive()
+        assert not toucher.is_alive()
+        watcher.stop()
+
+    def test_ignore_file_edit_refreshes_off_observer_thread(self, sandbox, mocker):
+        (sandbox / ".git").mkdir()
+        (sandbox / ".gitignore").write_text("venv/\n")
+
+        watcher = FilesWatcher(
+            FilesWatcher.Sets(root=sandbox, include=["**/*.py"], exclude=[], use_ignore_files=True),
+            calls=FilesWatcher.Callbacks(on_changes=Callback(None)),
+        )
+        watcher.start()
+
+        manager = WatchManager.get()
+        refresh = manager.refresh
+        threads = []
+        refreshed = Event()
+
+        def record(w: FilesWatcher) -> None:
+            threads.append(current_thread())
+            refresh(w)
+            refreshed.set()
+
+        mocker.patch.object(manager, "refresh", record)
+        (sandbox / ".gitignore").write_text("venv/\nbuild/\n")
+
+        # observer holds its lock while dispatching, rescheduling there could deadlock with subscribe
+        assert refreshed.wait(5)
+        assert manager._observer not in threads
+        watcher.stop()
+
+
+class TestSuppressUnchanged:
+    def test_touch_and_identical_rewrite_suppressed(self, sandbox):
+        (sandbox / "carwash.py").write_text("sprayers = 1")
+
+        changes: List[ChangeSet] = []
+        watcher = FilesWatcher(
+            FilesWatcher.Sets(root=sandbox, include=["**/*.py"], exclude=[]),
+            calls=FilesWatcher.Callbacks(on_changes=Callback(changes.append)),
+        )
+        watcher._fingerprints.add(sandbox / "carwash.py")
+
+        def modify(content: str) -> None:
+            (sandbox / "carwash.py").write_text(content)
+            cs = ChangeSet()
+            cs.add(FileModifiedEvent(str(sandbox / "carwash.py")))
+            watcher._deliver(cs)
+
+        (sandbox / "carwash.py").touch()
+        modify("sprayers = 1")
+        assert changes == []
+        assert watcher.suppressed_n == 1
+
+        modify("sprayers = 2")
+        assert len(changes) == 1
+        assert watcher.suppressed_n == 1
+
+
+class TestDebounce:
+    def create_watcher(self, sandbox: Path, changes: List[ChangeSet]) -> FilesWatcher:
+        return FilesWatcher(
+            FilesWatcher.Sets(
+                root=sandbox, include=["**/*.py"], exclude=[], debounce=0.1, suppress_unchanged=False
+            ),
+            calls=FilesWatcher.Callbacks(on_changes=Callback(changes.append)),
+        )
+
+    def test_delivered_once_when_quiet(self, sandbox):
+        changes: List[ChangeSet] = []
+        watcher = self.create_watcher(sandbox, changes)
+
+        # each event re-arms the window
+        for i in range(5):
+            watcher.on_any_event(FileModifiedEvent(str(sandbox / f"sprayers_{i % 2}.py")))
+            sleep(0.05)
+        assert not changes
+
+        sleep(0.3)
+        assert len(changes) == 1
+        assert set(changes[0].paths) == {sandbox / "sprayers_0.py", sandbox / "sprayers_1.py"}
+
+        watcher.on_any_event(FileModifiedEvent(str(sandbox / "carwash.py")))
+        sleep(0.3)
+        assert len(changes) == 2
+        assert changes[1].paths == [sandbox / "carwash.py"]
+
+    def test_stop_cancels_pending(self, sandbox):
+        changes: List[ChangeSet] = []
+        watcher = self.create_watcher(sandbox, changes)
+        watcher.start()
+
+        watcher.on_any_event(FileModifiedEvent(str(sandbox / "carwash.py")))
+        watcher.stop()
+        sleep(0.3)
+
+        assert not changes
+        assert not watcher._timer
+
+
+class TestChangeSet:
+    def test_coalescing(self):
+        changes = ChangeSet()
+        changes.add(FileCreatedEvent("/project/.carwash.py.swp"))
+        changes.add(FileModifiedEvent("/project/carwash.py"))
+        changes.add(FileModifiedEvent("/project/.carwash.py.swp"))
+        changes.add(FileMovedEvent("/project/.carwash.py.swp", "/project/carwash.py"))
+        changes.add(FileCreatedEvent("/project/sprayers.py"))
+        changes.add(FileModifiedEvent("/project/sprayers.py"))
+        changes.add(FileDeletedEvent("/project/office.py"))
+
+        assert [(str(c.path), c.event_type) for c in changes] == [
+            ("/project/carwash.py", "created"),
+            ("/project/sprayers.py", "created"),
+            ("/project/office.py", "deleted"),
+        ]
+        assert changes.existing_paths == [
+            Path("/project/carwash.py"),
+            Path("/project/sprayers.py"),
+        ]
@@ -0,0 +1,50 @@
+from envo.metrics import CommandMetrics, CommandRecord, Histogram, ReloadMetrics
+
+
+class TestMetrics:
+    def test_histogram(self):
+        histogram = Histogram()
+        for v in [0.0005, 0.003, 0.003, 0.04, 20.0]:
+            histogram.add(v)
+
+        assert histogram.n == 5
+        assert histogram.max == 20.0
+        assert histogram.percentile(50) == 0.005
+        assert histogram.percentile(100) == 20.0
+
+    def test_save_load(self, sandbox):
+        metrics = CommandMetrics()
+        record = CommandRecord(command="ls", wall_time=0.1, stdout_bytes=10, rtn=1)
+        record.hooks_time["precmd"] += 0.01
+        metrics.add(record)
+        metrics.add_hook_time("precmd", "_pre_cmd", 0.01)
+
+        metrics.save(sandbox / "metrics.json")
+        loaded = CommandMetrics.load(sandbox / "metrics.json")
+
+        assert loaded.commands_n == 1
+        assert loaded.failed_n == 1
+        assert loaded.output_bytes == 10
+        assert loaded.histograms["hooks.precmd"].total == 0.01
+        assert loaded.histograms["hook.precmd._pre_cmd"].n == 1
+
+    def test_load_missing(self, sandbox):
+        assert CommandMetrics.load(sandbox / "missing.json").commands_n == 0
+
+    def test_reload_metrics(self):
+        metrics = ReloadMetrics()
+        metrics.add_reload(
+            time=0.02,
+            timings={"parse": 0.005, "apply": 0.001},
+            actions={"Function.Update": 2},
+            modules={"carwash": True, "car": False},
+            dependents_n=1,
+        )
+        metrics.add_restart(["car"])
+
+        assert metrics.incremental_n == 1
+        assert metrics.full_diff_modules == {"car": 1}
+        assert metrics.histograms["reload.parse"].n == 1
+        rendered = metrics.render()
+        assert "Function.Update" in rendered
+        assert "restarts: 1" in rendered
@@ -0,0 +1,70 @@
+import sys
+
+from envo.misc import ModuleIndex, import_from_file
+
+
+class TestModuleIndex:
+    def test_lookup(self, sandbox):
+        (sandbox / "carwash").mkdir()
+        module_file = sandbox / "carwash/sprayers.py"
+        module_file.write_text("sprayers_n = 2")
+        (sandbox / "link").symlink_to(sandbox / "carwash")
+
+        index = ModuleIndex()
+        assert index.get_module(module_file) is None
+
+        module = import_from_file(module_file, sandbox)
+        sys.modules["carwash.sprayers"] = module
+
+        try:
+            assert index.get_module(module_file) is module
+            assert index.get_module(sandbox / "link/sprayers.py") is module
+            assert list(index.get_modules(sandbox / "carwash").values()) == [module]
+
+            # reloaded module replaces the old one
+            reloaded = import_from_file(module_file, sandbox)
+            sys.modules["carwash.sprayers"] = reloaded
+            assert index.get_module(module_file) is reloaded
+        finally:
+            sys.modules.pop("carwash.sprayers")
+
+        assert index.get_module(module_file) is None
+
+    def test_miss_syncs_only_after_imports(self, sandbox, mocker):
+        index = ModuleIndex()
+        index.sync()
+        sync = mocker.spy(index, "sync")
+
+        # files that aren't imported don't scan sys.modules on every event
+        for _ in range(3):
+            assert index.get_module(sandbox / "test_carwash.py") is None
+        assert sync.call_count == 0
+
+        module_file = sandbox / "sprayers.py"
+        module_file.write_text("sprayers_n = 2")
+        module = import_from_file(module_file, sandbox)
+        sys.modules["sprayers"] = module
+
+        try:
+            assert index.get_module(module_file) is module
+            assert sync.call_count == 1
+        finally:
+            sys.modules.pop("sprayers")
+
+    def test_miss_syncs_when_module_swapped(self, sandbox):
+        module_file = sandbox / "dryers.py"
+        module_file.write_text("dryers_n = 2")
+        sys.modules["sprinklers"] = import_from_file(module_file, sandbox)
+
+        index = ModuleIndex()
+        index.sync()
+
+        # one module removed and another imported, number of loaded modules is the same
+        sys.modules.pop("sprinklers")
+        module = import_from_file(module_file, sandbox)
+        sys.modules["dryers"] = module
+
+        try:
+            assert index.get_module(module_file) is module
+        finally:
+            sys.modules.pop("dryers")
@@ -6,8 +6,9 @@ from typing import Any, List
 
 import pytest
 
+from envo import dependency_watcher
 from envo.misc import import_from_file
-import envo.partial_reloader as hihi
+from envo.partial_reloader import Action, IncompatibleChange, PartialReloader, ReloadTransaction
 from tests.unit import utils
 
 
@@ -31,7 +32,9 @@ def load_module(path: Path, root: Path) -> Any:
 class TestBase:
     @pytest.fixture(autouse=True)
     def setup(self, sandbox):
-        pass
+        dependency_watcher.enable(sandbox)
+        yield
+        dependency_watcher.disable(sandbox)
 
 
 class TestFunctions(TestBase):
@@ -111,6 +114,30 @@ class TestFunctions(TestBase):
         assert module.fun("str1").endswith(str(global_var_id))
         assert id(module.fun) == fun_id_before
 
+    def test_reformatted_function(self, sandbox):
+        module_file = sandbox / "module.py"
+        module_file.write_text(dedent("""
+        def fun(arg1: int) -> float:
+            return 1 / arg1
+        """))
+        module = load_module(module_file, sandbox)
+
+        module_file.write_text(dedent("""
+        def fun(
+            arg1: int,
+        ) -> float:
+            return 1 / arg1
+        """))
+
+        reloader = PartialReloader(module, sandbox)
+        assert_actions(reloader, ["Update: Function: module.fun"])
+        reloader.run()
+
+        # tracebacks point at the new lines
+        with pytest.raises(ZeroDivisionError) as e:
+            module.fun(0)
+        assert e.traceback[-1].lineno + 1 == 5
+
     def test_deleted_function(self, sandbox):
         Path("__init__.py").touch()
         module_file = sandbox / "module.py"
@@ -232,8 +259,10 @@ class TestGlobabVariable(TestBase):
 
         reloader = PartialReloader(carwash_module, sandbox)
         assert_actions(reloader, ['Update: Variable: carwash.sprinkler_n',
- 'Update: Module: car',
- 'Update: Module: accounting'])
+                                  'Update: Module: car',
+                                  'Update: Module: accounting',
+                                  # package __init__ imports them too
+                                  'Update: Module: sandbox'])
         reloader.run()
 
         assert carwash_module.sprinkler_n == 6
@@ -404,7 +433,10 @@ class TestClasses(TestBase):
         """))
 
         reloader = PartialReloader(carwash_module, sandbox)
-        assert_actions(reloader, ['Update: Variable: carwash1.Carwash.sprinkler_n', 'Update: Module: car1'])
+        assert_actions(
+            reloader,
+            ['Update: Variable: carwash1.Carwash.sprinkler_n', 'Update: Module: car1', 'Update: Module: sandbox'],
+        )
         reloader.run()
 
         assert carwash_module.Carwash.sprinkler_n == 6
@@ -728,6 +760,111 @@ class TestClasses(TestBase):
         assert hasattr(module.Carwash, "fun1")
         assert not hasattr(module.Carwash, "fun2")
 
+    def test_modified_property(self, sandbox):
+        module_file = sandbox / "module.py"
+        module_file.write_text(dedent("""
+        class Carwash:
+            @property
+            def sprinklers_n(self) -> int:
+                return 3
+        """))
+
+        module = load_module(module_file, sandbox)
+        carwash = module.Carwash()
+        prop = module.Carwash.__dict__["sprinklers_n"]
+
+        module_file.write_text(dedent("""
+        class Carwash:
+            @property
+            def sprinklers_n(self) -> int:
+                return 5
+        """))
+
+        reloader = PartialReloader(module, sandbox)
+        assert_actions(reloader, ["Update: Property: module.Carwash.sprinklers_n"])
+        reloader.run()
+
+        assert carwash.sprinklers_n == 5
+        assert module.Carwash.__dict__["sprinklers_n"] is prop
+
+    def test_added_method_with_super(self, sandbox):
+        module_file = sandbox / "module.py"
+        module_file.write_text(dedent("""
+        class Machine:
+            def describe(self) -> str:
+                return "machine"
+
+        class Carwash(Machine):
+            pass
+        """))
+
+        module = load_module(module_file, sandbox)
+        carwash = module.Carwash()
+
+        module_file.write_text(dedent("""
+        class Machine:
+            def describe(self) -> str:
+                return "machine"
+
+        class Carwash(Machine):
+            def describe(self) -> str:
+                return "carwash " + super().describe()
+        """))
+
+        reloader = PartialReloader(module, sandbox)
+        assert_actions(reloader, ["Add: Function: module.Carwash.describe"])
+        reloader.run()
+
+        assert carwash.describe() == "carwash machine"
+
+    def test_added_class(self, sandbox):
+        module_file = sandbox / "module.py"
+        module_file.write_text("sprinklers_n = 3\n")
+
+        module = load_module(module_file, sandbox)
+
+        module_file.write_text(dedent("""
+        sprinklers_n = 3
+
+        class Carwash:
+            def get_sprinklers_n(self) -> int:
+                return sprinklers_n
+        """))
+
+        reloader = PartialReloader(module, sandbox)
+        assert_actions(reloader, ["Add: Class: module.Carwash"])
+        reloader.run()
+
+        # uses live module globals
+        module.sprinklers_n = 4
+        assert module.Carwash().get_sprinklers_n() == 4
+
+    def test_changed_bases(self, sandbox):
+        module_file = sandbox / "module.py"
+        module_file.write_text(dedent("""
+        class Machine:
+            pass
+
+        class Carwash:
+            sprinklers_n = 3
+        """))
+
+        module = load_module(module_file, sandbox)
+
+        module_file.write_text(dedent("""
+        class Machine:
+            pass
+
+        class Carwash(Machine):
+            sprinklers_n = 5
+        """))
+
+        reloader = PartialReloader(module, sandbox)
+        with pytest.raises(IncompatibleChange):
+            reloader.run()
+
+        assert module.Carwash.sprinklers_n == 3
+
 
 class TestModules(TestBase):
     def test_import_relative(self, sandbox):
@@ -877,6 +1014,296 @@ class TestModules(TestBase):
         assert hasattr(module, "slave_module")
 
 
+class TestIncremental(TestBase):
+    def reload(self, module: Any, module_file: Path, source: str, sandbox: Path) -> List[str]:
+        module_file.write_text(dedent(source))
+        reloader = PartialReloader(module, sandbox)
+        return [repr(a) for a in reloader.run()]
+
+    def test_changed_definitions_only(self, sandbox):
+        module_file = sandbox / "module.py"
+        source = """
+        import math
+
+        class Carwash:
+            @staticmethod
+            def get_sprinklers_n() -> int:
+                return 1
+
+            def get_cars_n(self) -> int:
+                return 1
+
+        def fun() -> str:
+            return "fun"
+        """
+        module_file.write_text(dedent(source))
+        module = load_module(module_file, sandbox)
+        fun = module.fun
+
+        # first reload has nothing to compare with and does a full diff
+        assert self.reload(module, module_file, source.replace('"fun"', '"fun2"'), sandbox) == [
+            "Update: Function: module.fun"
+        ]
+
+        source = """
+        import math
+
+        class Carwash:
+            @staticmethod
+            def get_sprinklers_n() -> int:
+                return 5
+
+            def get_cars_n(self) -> int:
+                return 1
+
+            def get_washes_n(self) -> int:
+                return 3
+
+        def fun() -> str:
+            return "fun2"
+        """
+        assert self.reload(module, module_file, source, sandbox) == [
+            "Update: Method: module.Carwash.get_sprinklers_n",
+            "Add: Function: module.Carwash.get_washes_n",
+        ]
+        assert module.Carwash.get_sprinklers_n() == 5
+        assert module.Carwash().get_washes_n() == 3
+        assert fun() == "fun2"
+
+        assert self.reload(module, module_file, source.replace("return 3", "return 4"), sandbox) == [
+            "Update: Function: module.Carwash.get_washes_n"
+        ]
+        assert module.Carwash().get_washes_n() == 4
+
+    def test_side_effects_fall_back_to_full_diff(self, sandbox):
+        module_file = sandbox / "module.py"
+        source = """
+        def fun() -> int:
+            return 1
+        """
+        module_file.write_text(dedent(source))
+        module = load_module(module_file, sandbox)
+
+        self.reload(module, module_file, source.replace("return 1", "return 2"), sandbox)
+        actions = self.reload(
+            module,
+            module_file,
+            "\nimport math\n" + dedent(source).replace("return 1", "return math.floor(3.5)"),
+            sandbox,
+        )
+
+        assert actions == ["Add: Import: module.math", "Update: Function: module.fun"]
+        assert module.fun() == 3
+
+
+class TestCachedTree(TestBase):
+    def test_tree_updated_in_place(self, sandbox):
+        module_file = sandbox / "module.py"
+        module_file.write_text(
+            dedent(
+                """
+            class Carwash:
+                def fun1(self):
+                    return 1
+            """
+            )
+        )
+        module = load_module(module_file, sandbox)
+
+        tree = PartialReloader(module, sandbox, incremental=False).old_module
+
+        module_file.write_text(
+            dedent(
+                """
+            class Carwash:
+                def fun1(self):
+                    return 2
+
+                def fun2(self):
+                    return 3
+            """
+            )
+        )
+        reloader = PartialReloader(module, sandbox, incremental=False)
+        reloader.run()
+
+        reloader = PartialReloader(module, sandbox, incremental=False)
+        assert reloader.old_module is tree
+        assert "module.Carwash.fun2" in tree.flat
+        assert reloader.get_actions() == []
+
+        module_file.write_text(
+            dedent(
+                """
+            class Carwash:
+                def fun1(self):
+                    return 2
+            """
+            )
+        )
+        assert [repr(a) for a in reloader.run()] == ["Delete: Function: module.Carwash.fun2"]
+        assert "module.Carwash.fun2" not in tree.flat
+
+
+class TestTransaction(TestBase):
+    def test_dependents_reloaded_once_in_order(self, sandbox):
+        init_file = Path("__init__.py")
+        init_file.write_text(dedent("""
+        import carwash2
+        import car2
+        import accounting2
+        """))
+        (sandbox / "registry2.py").write_text("execs = []\n")
+        carwash_file = sandbox / "carwash2.py"
+        carwash_file.write_text("sprinkler_n = 3\ndryer_n = 1\n")
+        car_file = sandbox / "car2.py"
+        car_file.write_text(dedent("""
+        from carwash2 import sprinkler_n, dryer_n
+        import registry2
+
+        registry2.execs.append("car2")
+        car_sprinklers = sprinkler_n + dryer_n
+        """))
+        (sandbox / "accounting2.py").write_text(dedent("""
+        from carwash2 import sprinkler_n
+        from car2 import car_sprinklers
+        import registry2
+
+        registry2.execs.append("accounting2")
+        total = sprinkler_n + car_sprinklers
+        """))
+
+        load_module(init_file, sandbox)
+        registry = sys.modules["registry2"]
+        registry.execs.clear()
+
+        carwash_file.write_text("sprinkler_n = 6\ndryer_n = 2\n")
+        car_file.write_text(car_file.read_text().replace("sprinkler_n + dryer_n", "sprinkler_n * dryer_n"))
+
+        transaction = ReloadTransaction(
+            [PartialReloader(sys.modules[n], sandbox) for n in ["car2", "carwash2"]]
+        )
+        transaction.run()
+
+        assert transaction.completed
+        assert transaction.dependents_n == 2
+        assert transaction.get_action_counts()["Variable.Update"] == 8
+        assert transaction.timings["apply"] > 0
+        assert registry.execs == ["car2", "accounting2"]
+        assert sys.modules["car2"].car_sprinklers == 12
+        assert sys.modules["accounting2"].total == 18
+
+    def test_dependents_reloaded_with_full_diff(self, sandbox):
+        carwash_file = sandbox / "carwash5.py"
+        carwash_file.write_text("sprinkler_n = 3\n")
+        car_file = sandbox / "car5.py"
+        car_file.write_text("from carwash5 import sprinkler_n\n\ncar_sprinklers = sprinkler_n * 10\n")
+
+        carwash_module = load_module(carwash_file, sandbox)
+        car_module = load_module(car_file, sandbox)
+
+        # car5 is unchanged since its last reload, incremental reload would find nothing to do
+        car_reloader = PartialReloader(car_module, sandbox)
+        car_reloader.apply_actions(car_reloader.get_actions())
+
+        carwash_file.write_text("sprinkler_n = 6\n")
+        transaction = ReloadTransaction([PartialReloader(carwash_module, sandbox)])
+        transaction.run()
+
+        assert not transaction.reloaders["car5"].incremental
+        assert car_module.car_sprinklers == 60
+
+    def test_same_variable_edited_twice(self, sandbox):
+        carwash_file = sandbox / "carwash6.py"
+        carwash_file.write_text("sprinkler_n = 6\n")
+        car_file = sandbox / "car6.py"
+        car_file.write_text("from carwash6 import sprinkler_n\n\ncar_sprinklers = sprinkler_n * 10\n")
+
+        carwash_module = load_module(carwash_file, sandbox)
+        car_module = load_module(car_file, sandbox)
+
+        for sprinkler_n in [9, 12]:
+            carwash_file.write_text(f"sprinkler_n = {sprinkler_n}\n")
+            transaction = ReloadTransaction([PartialReloader(carwash_module, sandbox)])
+            transaction.run()
+
+            assert "car6" in transaction.reloaders
+            assert car_module.car_sprinklers == sprinkler_n * 10
+
+    def test_cancelled_transaction_rolled_back(self, sandbox):
+        carwash_file = sandbox / "carwash7.py"
+        carwash_file.write_text("sprinkler_n = 3\n")
+        car_file = sandbox / "car7.py"
+        car_file.write_text("from carwash7 import sprinkler_n\n\ncar_sprinklers = sprinkler_n * 10\n")
+
+        carwash_module = load_module(carwash_file, sandbox)
+        car_module = load_module(car_file, sandbox)
+
+        carwash_file.write_text("sprinkler_n = 6\n")
+        checks = []
+
+        def cancelled() -> bool:
+            # carwash7 is edited again after it's applied, before its dependent is reloaded
+            checks.append(1)
+            return len(checks) > 1
+
+        transaction = ReloadTransaction([PartialReloader(carwash_module, sandbox)], cancelled=cancelled)
+        transaction.run()
+
+        assert not transaction.completed
+        assert carwash_module.sprinkler_n == 3
+        assert car_module.car_sprinklers == 30
+
+        # next transaction reloads dependents too
+        transaction = ReloadTransaction([PartialReloader(carwash_module, sandbox)])
+        transaction.run()
+
+        assert carwash_module.sprinkler_n == 6
+        assert car_module.car_sprinklers == 60
+
+
+class TestRollback(TestBase):
+    def test_failed_apply_restores_module(self, sandbox):
+        module_file = sandbox / "module.py"
+        module_file.write_text(dedent("""
+        glob_var = 4
+
+        def fun():
+            return 1
+        """))
+
+        module = load_module(module_file, sandbox)
+        fun = module.fun
+
+        module_file.write_text(dedent("""
+        glob_var = 5
+        new_var = 2
+
+        def fun():
+            return 2
+        """))
+
+        class FailingAction(Action):
+            def execute(self) -> None:
+                raise RuntimeError("failed")
+
+        reloader = PartialReloader(module, sandbox)
+        actions = reloader.get_actions()
+        with pytest.raises(RuntimeError):
+            reloader.apply_actions(actions + [FailingAction(reloader)])
+
+        assert module.glob_var == 4
+        assert not hasattr(module, "new_var")
+        assert module.fun is fun
+        assert fun() == 1
+
+        # next reload starts from a clean state
+        reloader = PartialReloader(module, sandbox)
+        reloader.run()
+        assert module.glob_var == 5
+        assert fun() == 2
+
+
 class TestMisc(TestBase):
     def test_syntax_error(self, sandbox):
         module_file = sandbox / "module.py"
@@ -0,0 +1,86 @@
+import sys
+from threading import Condition, Event, Thread
+from types import SimpleNamespace
+
+import pytest
+
+from envo.metrics import CommandMetrics
+from envo.misc import Callback
+from envo.shell import Shell
+
+
+def create_shell() -> Shell:
+    # skip xonsh initialisation, only command coordination is exercised
+    shell = Shell.__new__(Shell)
+    shell.calls = Shell.Callbacks()
+    shell.history = None
+    shell.metrics = CommandMetrics()
+    shell._cmd_cond = Condition()
+    shell._executing_cmd = False
+    shell._reloading = False
+    shell.execute = lambda line, history_line: None
+    return shell
+
+
+class TestShell:
+    def test_failing_post_cmd_releases_command(self):
+        shell = create_shell()
+
+        def post_cmd(command, stdout, stderr) -> None:
+            raise RuntimeError("post_cmd failed")
+
+        shell.calls.on_stdout = Callback(lambda command, out: out)
+        shell.calls.on_stderr = Callback(lambda command, out: out)
+        shell.calls.post_cmd = Callback(post_cmd)
+
+        with pytest.raises(RuntimeError):
+            shell.default("ls")
+
+        assert not shell._executing_cmd
+        assert shell.metrics.commands_n == 1
+        assert shell.metrics.records[-1].hooks_time["postcmd"] > 0
+
+    def test_command_metrics(self):
+        shell = create_shell()
+        shell.history = SimpleNamespace(last_cmd_rtn=1, buffer=None)
+
+        def execute(line: str, history_line: str) -> None:
+            sys.stdout.write("washing\n")
+            sys.stderr.write("zażółć\n")
+
+        shell.execute = execute
+        shell.calls.pre_cmd = Callback(lambda command: command)
+        shell.calls.on_stdout = Callback(lambda command, out: out)
+        shell.calls.on_stderr = Callback(lambda command, out: out)
+        shell.calls.post_cmd = Callback(lambda command, stdout, stderr: None)
+
+        shell.default("wash")
+
+        record = shell.metrics.records[-1]
+        assert record.command == "wash"
+        assert record.stdout_bytes == 8
+        assert record.stderr_bytes == 11
+        assert record.rtn == 1
+        assert record.wall_time >= sum(record.hooks_time.values())
+        assert all(record.hooks_time[t] > 0 for t in ["precmd", "onstdout", "onstderr", "postcmd"])
+        assert shell.metrics.failed_n == 1
+
+    def test_reloads_are_serialised(self):
+        shell = create_shell()
+        second_began = Event()
+
+        def reload() -> None:
+            shell.begin_reload()
+            second_began.set()
+
+        shell.begin_reload()
+        thread = Thread(target=reload)
+        thread.start()
+
+        assert not second_began.wait(0.2)
+        shell.end_reload()
+        assert second_began.wait(5)
+        assert shell._reloading
+
+        shell.end_reload()
+        thread.join(5)
@@ -0,0 +1,107 @@
+import sys
+from pathlib import Path
+from typing import Any
+from unittest.mock import MagicMock
+
+import pytest
+from watchdog.events import FileModifiedEvent
+
+from envo import dependency_watcher
+from envo.env import Source, SourceReloader
+from envo.metrics import ReloadMetrics
+from envo.misc import Callback, ChangeSet, import_from_file
+from envo.partial_reloader import PartialReloader
+
+
+def load_module(path: Path, root: Path) -> Any:
+    module = import_from_file(path, root)
+    module.__name__ = path.stem
+    sys.modules[module.__name__] = module
+    return module
+
+
+def create_reloader(sandbox: Path) -> SourceReloader:
+    return SourceReloader(
+        li=SourceReloader.Links(env=MagicMock(), status=MagicMock(), logger=MagicMock(), metrics=ReloadMetrics()),
+        se=SourceReloader.Sets(source=Source(root=sandbox)),
+        calls=SourceReloader.Callbacks(
+            on_reload_start=Callback(None),
+            after_partial_reload=Callback(None),
+            on_reload_error=Callback(None),
+            on_restart_needed=Callback(None),
+        ),
+    )
+
+
+def edit(reloader: SourceReloader, *paths: Path) -> None:
+    changes = ChangeSet()
+    for p in paths:
+        changes.add(FileModifiedEvent(str(p)))
+    reloader._on_source_edit(changes)
+
+
+def reload_pending(reloader: SourceReloader) -> None:
+    # what the worker does with everything queued
+    generations = {p: reloader._generations[p] for p in reloader._pending.keys()}
+    reloader._pending.clear()
+    reloader._reload_files(generations)
+
+
+class TestSourceReloader:
+    @pytest.fixture(autouse=True)
+    def setup(self, sandbox):
+        dependency_watcher.enable(sandbox)
+        yield
+        dependency_watcher.disable(sandbox)
+
+    def test_newer_edit_supersedes_queued_reload(self, sandbox):
+        carwash_file = sandbox / "carwash8.py"
+        office_file = sandbox / "office8.py"
+        reloader = create_reloader(sandbox)
+
+        edit(reloader, carwash_file, office_file)
+        edit(reloader, carwash_file)
+
+        assert list(reloader._pending.keys()) == [office_file, carwash_file]
+        assert not reloader._is_current(carwash_file, 1)
+        assert reloader._is_current(carwash_file, 2)
+        assert reloader._is_current(office_file, 1)
+
+    def test_cancelled_reload_requeues_all_files(self, sandbox, mocker):
+        carwash_file = sandbox / "carwash9.py"
+        carwash_file.write_text("sprinkler_n = 3\n")
+        car_file = sandbox / "car9.py"
+        car_file.write_text("from carwash9 import sprinkler_n\n\ncar_sprinklers = sprinkler_n * 10\n")
+        office_file = sandbox / "office9.py"
+        office_file.write_text("desks_n = 2\n")
+
+        carwash_module = load_module(carwash_file, sandbox)
+        car_module = load_module(car_file, sandbox)
+        office_module = load_module(office_file, sandbox)
+        reloader = create_reloader(sandbox)
+
+        carwash_file.write_text("sprinkler_n = 6\n")
+        office_file.write_text("desks_n = 4\n")
+        edit(reloader, carwash_file, office_file)
+
+        apply_actions = PartialReloader.apply_actions
+
+        def apply_and_edit(self, actions) -> None:
+            apply_actions(self, actions)
+            # carwash9 saved again while the transaction runs
+            if reloader._generations[carwash_file] == 1:
+                edit(reloader, carwash_file)
+
+        mocker.patch.object(PartialReloader, "apply_actions", apply_and_edit)
+        reload_pending(reloader)
+
+        # applied module was rolled back, both files are reloaded again with the newer version
+        assert carwash_module.sprinkler_n == 3
+        assert office_module.desks_n == 2
+        assert set(reloader._pending.keys()) == {carwash_file, office_file}
+
+        reload_pending(reloader)
+
+        assert carwash_module.sprinkler_n == 6
+        assert office_module.desks_n == 4
+        assert car_module.car_sprinklers == 60